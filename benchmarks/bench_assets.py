@@ -0,0 +1,66 @@
+"""What the static assets cost per page view.
+
+Renders each page, then fetches the assets it links the way a browser with
+a warm cache would: nothing while a cached copy is fresh, a conditional
+request when it must be revalidated. Reports, for a first and a repeat
+view, the asset requests that reach the app and the bytes they send, and
+the time the app spends on one asset request:
+
+    MYSQL=sqlite:////tmp/bench.db python benchmarks/bench_assets.py [--ops N]
+"""
+import argparse, re, time
+from modernauth.app import app
+
+PAGES = ["/", "/missing-page"]
+ASSET = re.compile(r'(?:href|src)="(/assets/[^"]+)"')
+HEADERS = {"Accept-Encoding": "gzip, deflate, br"}
+
+
+def view(client, page, cache):
+    """Load ``page`` and its assets through ``cache``; return (requests, bytes)."""
+    html = client.get(page, headers=HEADERS).get_data(as_text=True)
+    requests = sent = 0
+    for url in ASSET.findall(html):
+        cached = cache.get(url)
+        if cached is not None and "immutable" in cached.headers.get("Cache-Control", ""):
+            continue
+        headers = dict(HEADERS)
+        if cached is not None and cached.headers.get("ETag"):
+            headers["If-None-Match"] = cached.headers["ETag"]
+        response = client.get(url, headers=headers)
+        requests += 1
+        sent += len(response.data)
+        if response.status_code == 200:
+            cache[url] = response
+    return requests, sent
+
+
+def per_request(client, url, headers, ops):
+    started = time.perf_counter()
+    for _ in range(ops):
+        client.get(url, headers=headers)
+    return (time.perf_counter() - started) / ops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=1000)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    print(f"{'page':>14}{'first view':>22}{'repeat view':>22}")
+    for page in PAGES:
+        cache = {}
+        first = view(client, page, cache)
+        repeat = view(client, page, cache)
+        print(f"{page:>14}" + "".join(f"{f'{n} req, {b:,} B':>22}" for n, b in (first, repeat)))
+
+    url = ASSET.search(client.get("/").get_data(as_text=True)).group(1)
+    etag = client.get(url, headers=HEADERS).headers["ETag"]
+    print(f"\n{url}")
+    print(f"  200: {per_request(client, url, HEADERS, args.ops) * 1e3:.2f} ms/request")
+    print(f"  304: {per_request(client, url, dict(HEADERS, **{'If-None-Match': etag}), args.ops) * 1e3:.2f} ms/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Microbenchmarks for modernauth.db against SQLite at several table sizes.
+
+Times the TokenSystemDB, UserDB and ServerConfig operations with 1k, 10k and
+100k rows already in the table, then checks that point operations stay flat
+as the table grows. A whole-table load()/save() creeping back into a hot path
+shows up as a per-operation time that scales with the row count and fails
+the run. UserDB.isuser is timed twice: with the cache off, so the query is
+measured, and with the default cache the app runs with:
+
+    python benchmarks/bench_db.py [--sizes 1000,10000,100000] [--max-ratio 3]
+"""
+import argparse, json, os, sys, tempfile, time
+from modernauth.hashing import legacy_hash
+from modernauth.db.tokensystem import TokenSystemDB
+from modernauth.db.userdb import UserDB
+from modernauth.db.server_config import ServerConfig
+from modernauth.db.schema import init_db
+
+# Operations that must not grow with the table size.
+POINT_OPERATIONS = (
+    "TokenSystemDB.create_token",
+    "TokenSystemDB.get_token_data",
+    "TokenSystemDB.authorize_token",
+    "UserDB.isuser",
+    "UserDB.isuser (default cache)",
+    "UserDB.signup",
+)
+
+
+def per_op(fn, ops, repeat=3):
+    """Best-of-``repeat`` mean seconds per call of ``fn(i)``."""
+    best = None
+    for r in range(repeat):
+        started = time.perf_counter()
+        for i in range(ops):
+            fn(r * ops + i)
+        elapsed = (time.perf_counter() - started) / ops
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def once(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def seed(size, url):
+    init_db(url)
+    tokens_db = TokenSystemDB(mysql_connection=url, hash_function=legacy_hash)
+    userdb = UserDB(mysql_connection=url, hash_function=legacy_hash, cache_size=0)
+    cached_userdb = UserDB(mysql_connection=url, hash_function=legacy_hash)
+    config = ServerConfig(mysql_connection=url, hash_function=legacy_hash, cache_ttl=0)
+    now = int(time.time())
+    store = tokens_db.store
+    with store.engine.begin() as conn:
+        conn.execute(store.tokens.insert(), [{
+            "token": legacy_hash(f"seed{i}"),
+            "username": f"player{i}",
+            "server_id": "bench",
+            # One row in ten is already expired so purge has work to do.
+            "expires_at": now - 60 if i % 10 == 0 else now + 600,
+            "authorized": False,
+            "extra": None,
+        } for i in range(size)])
+        conn.execute(userdb.users.insert(), [{
+            "server_id": "bench",
+            "username": f"player{i}",
+            "sub": legacy_hash(f"sub{i}"),
+        } for i in range(size)])
+        conn.execute(config.config_table.insert(), [{
+            "server_id": f"server{i}",
+            "config": json.dumps({"secret_key": legacy_hash(f"secret{i}")}),
+            "updated_at": 0,
+        } for i in range(max(size // 100, 1))])
+    return tokens_db, userdb, cached_userdb, config
+
+
+def run_size(size, ops):
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), f'bench{size}.db')}"
+    tokens_db, userdb, cached_userdb, config = seed(size, url)
+    results = {
+        "TokenSystemDB.create_token": per_op(
+            lambda i: tokens_db.create_token(f"new{i}", f"new{i}", server_id="bench"), ops),
+        "TokenSystemDB.get_token_data": per_op(
+            lambda i: tokens_db.get_token_data(f"seed{(i * 7919) % size}"), ops),
+        "TokenSystemDB.authorize_token": per_op(
+            lambda i: tokens_db.authorize_token(f"seed{(i * 7919) % size}"), ops),
+        "UserDB.isuser": per_op(
+            lambda i: userdb.isuser("bench", f"player{(i * 7919) % size}"), ops),
+        # The configuration the app runs with. Each repeat looks up the same
+        # ``ops`` players, so the first fills the cache and the best is warm.
+        "UserDB.isuser (default cache)": per_op(
+            lambda i: cached_userdb.isuser("bench", f"player{((i % ops) * 7919) % size}"), ops),
+        "UserDB.signup": per_op(
+            lambda i: userdb.signup("bench", f"newplayer{i}", f"sub{i}"), ops),
+        "UserDB.load": once(userdb.load),
+        "ServerConfig.load": once(config.load),
+    }
+    loaded = config.load()
+    results["ServerConfig.save"] = once(lambda: config.save(loaded))
+    results["TokenSystemDB.purge_expired_tokens"] = once(tokens_db.purge_expired_tokens)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--ops", type=int, default=200, help="calls per point-operation timing")
+    parser.add_argument("--max-ratio", type=float, default=3.0,
+                        help="allowed slowdown of point operations from the smallest to the largest size")
+    parser.add_argument("--out", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    results = {}
+    for size in sizes:
+        results[size] = run_size(size, args.ops)
+
+    names = list(results[sizes[0]])
+    print(f"{'operation':>36}" + "".join(f"{size:>12,}" for size in sizes))
+    for name in names:
+        unit, scale = ("us", 1e6) if name in POINT_OPERATIONS else ("ms", 1e3)
+        print(f"{name:>36}" + "".join(f"{results[s][name] * scale:>10.1f}{unit}" for s in sizes))
+
+    failures = []
+    smallest, largest = sizes[0], sizes[-1]
+    for name in POINT_OPERATIONS:
+        ratio = results[largest][name] / results[smallest][name]
+        if ratio > args.max_ratio:
+            failures.append(f"{name} is {ratio:.1f}x slower at {largest:,} rows than at {smallest:,} "
+                            f"(limit {args.max_ratio}x)")
+    if args.out:
+        with open(args.out, "w") as fh:
+            json.dump({str(size): r for size, r in results.items()}, fh, indent=2)
+    for failure in failures:
+        print("FAIL:", failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
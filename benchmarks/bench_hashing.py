@@ -0,0 +1,92 @@
+"""Compare the legacy SHA-512 hex digests with the keyed BLAKE2b format.
+
+Fills the tokensystem and users tables with the same rows under each digest
+format and reports the on-disk size of the token primary-key index and the
+users table, the cost of computing a digest, and point-lookup latency
+through TokenSystemDB and UserDB, against SQLite:
+
+    python benchmarks/bench_hashing.py [--rows N] [--ops N] [--rounds N]
+"""
+import argparse, os, random, sqlite3, tempfile, time
+from modernauth.hashing import Hasher
+from modernauth.db.tokensystem import TokenSystemDB
+from modernauth.db.userdb import UserDB
+from modernauth.db.schema import init_db
+
+
+def per_op(fn, ops):
+    started = time.perf_counter()
+    for i in range(ops):
+        fn(i)
+    return (time.perf_counter() - started) / ops
+
+
+def object_sizes(path):
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+    finally:
+        conn.close()
+
+
+def setup(label, hasher, rows, ops):
+    """Build one database; return its sizes and the timed operations."""
+    path = os.path.join(tempfile.mkdtemp(), f"{label}.db")
+    url = f"sqlite:///{path}"
+    init_db(url)
+    tokens_db = TokenSystemDB(mysql_connection=url, hash_function=hasher)
+    userdb = UserDB(mysql_connection=url, hash_function=hasher, cache_size=0)
+    now = int(time.time())
+    store = tokens_db.store
+    with store.engine.begin() as conn:
+        conn.execute(store.tokens.insert(), [{
+            "token": hasher(f"token{i}"), "username": f"player{i}", "server_id": "bench",
+            "expires_at": now + 600, "authorized": False, "extra": None,
+        } for i in range(rows)])
+        conn.execute(userdb.users.insert(), [{
+            "server_id": "bench", "username": f"player{i}", "sub": hasher(f"sub{i}"),
+        } for i in range(rows)])
+    with store.engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+    sizes = object_sizes(path)
+    picks = [random.randrange(rows) for _ in range(ops)]
+    static = {
+        "digest length": len(hasher("x")),
+        "token index KiB": sizes.get("sqlite_autoindex_tokensystem_1", 0) / 1024,
+        "users table KiB": sizes.get("users", 0) / 1024,
+    }
+    timed = {
+        "hash us/op": lambda i: hasher(f"token{picks[i]}"),
+        "get_token_data us/op": lambda i: tokens_db.get_token_data(f"token{picks[i]}"),
+        "login us/op": lambda i: userdb.login("bench", f"player{picks[i]}", f"sub{picks[i]}"),
+    }
+    return static, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5, help="alternating timing rounds; the best is kept")
+    args = parser.parse_args()
+
+    variants = {
+        "legacy": setup("legacy", Hasher(), args.rows, args.ops),
+        "blake2b": setup("blake2b", Hasher(key="bench-key", accept_legacy=False), args.rows, args.ops),
+    }
+    results = {label: dict(static) for label, (static, _) in variants.items()}
+    # Alternate the variants so drift in machine load hits both alike.
+    for _ in range(args.rounds):
+        for label, (_, timed) in variants.items():
+            for name, fn in timed.items():
+                elapsed = per_op(fn, args.ops) * 1e6
+                results[label][name] = min(results[label].get(name, elapsed), elapsed)
+    legacy, keyed = results["legacy"], results["blake2b"]
+    print(f"{args.rows:,} rows, {args.ops} lookups")
+    print(f"{'':>24}{'sha512 hex':>14}{'2$ blake2b':>14}")
+    for name in legacy:
+        print(f"{name:>24}{legacy[name]:>14.1f}{keyed[name]:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Per-request cost of checking X-Server-Secret, before and after the
+verified-secret cache.
+
+    python benchmarks/bench_secret_cache.py [--iterations N]
+"""
+import argparse, os, secrets, string, tempfile, timeit
+from modernauth.hashing import legacy_hash
+from modernauth.db.server_config import ServerConfig
+from modernauth.secret_cache import VerifiedSecretCache
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    config = ServerConfig(mysql_connection=f"sqlite:///{path}", hash_function=legacy_hash)
+    config.create_schema()
+    secret = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(100))
+    config.save({"bench": {"secret_key": legacy_hash(secret)}})
+    cache = VerifiedSecretCache(config, hash_function=legacy_hash)
+
+    def uncached():
+        return legacy_hash(secret) == config.get_secret("bench")
+
+    def cached():
+        return cache.verify("bench", secret)
+
+    assert uncached() and cached()
+    for name, fn in (("sha512 + compare", uncached), ("verified-secret cache", cached)):
+        seconds = min(timeit.repeat(fn, number=args.iterations, repeat=5))
+        print(f"{name:>24}: {seconds / args.iterations * 1e9:8.0f} ns/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Compare DB-backed and stateless (HMAC-signed) login tokens.
+
+Times the createtoken step and the pending-token check the /auth and
+/api/authstatus routes perform, against a SQLite database.
+
+    python benchmarks/bench_token_modes.py [--iterations N]
+"""
+import argparse, os, tempfile, time
+from modernauth.hashing import legacy_hash
+from modernauth.db.tokensystem import TokenSystemDB
+from modernauth.signed_tokens import SignedTokenCodec
+
+
+def timed(fn, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    tokens_db = TokenSystemDB(mysql_connection=f"sqlite:///{path}", hash_function=legacy_hash)
+    tokens_db.create_schema()
+    signer = SignedTokenCodec(os.urandom(32))
+    signed = [signer.issue("bench", f"player{i}") for i in range(args.iterations)]
+
+    results = {
+        "db: create_token": timed(
+            lambda i: tokens_db.create_token(f"player{i}", f"token{i}", server_id="bench"), args.iterations),
+        "db: get_token_data": timed(
+            lambda i: tokens_db.get_token_data(f"token{i}"), args.iterations),
+        "stateless: issue": timed(
+            lambda i: signer.issue("bench", f"player{i}"), args.iterations),
+        "stateless: verify": timed(
+            lambda i: signer.verify(signed[i], server_id="bench"), args.iterations),
+    }
+    for name, seconds in results.items():
+        print(f"{name:>20}: {seconds * 1e6:9.1f} us/op")
+
+
+if __name__ == "__main__":
+    main()
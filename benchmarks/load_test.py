@@ -0,0 +1,365 @@
+"""HTTP load test for the plugin login flow.
+
+Starts the app on a local port against a throwaway SQLite database and drives
+N simulated players concurrently through the same steps as
+``scripts/simulate.py``: POST /api/createtoken, the browser hit on
+/auth/<server_id>/<token>, and GET /api/authstatus until logged in, plus
+/api/isuser lookups. Auth0 is never contacted: each player presents a signed
+session cookie that already holds a logged-in user.
+
+Reports throughput, p50/p95/p99 latency and SQL statements per request for
+each endpoint, and writes everything to a JSON file that can be compared
+against an earlier run:
+
+    python benchmarks/load_test.py --players 500 --out run.json
+    python benchmarks/load_test.py --players 500 --compare run.json
+
+``--server asgi`` serves ``modernauth.asgi`` on uvicorn instead of the Flask
+app on a threaded WSGI server. ``--pending N`` replaces the login flow with N
+players whose /api/authstatus long-polls are all open at once; once they are
+held for ``--hold`` seconds every player logs in, and the report gives how
+long each poll took to answer after its login. Polls that time out first
+are repeated, as the plugin does:
+
+    python benchmarks/load_test.py --server asgi --pending 3000 --wait 30
+"""
+import argparse, asyncio, json, logging, os, platform, socket, subprocess, sys, tempfile, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def configure_environment(args):
+    workdir = tempfile.mkdtemp(prefix="modernauth-load-")
+    os.environ.update({
+        "MYSQL": f"sqlite:///{os.path.join(workdir, 'load.db')}?timeout=30",
+        "APP_SECRET_KEY": "load-test",
+        "AUTH0_DOMAIN": "auth0.invalid",
+        "AUTH0_CLIENT_ID": "load-test",
+        "AUTH0_CLIENT_SECRET": "load-test",
+        "TOKEN_SWEEP_INTERVAL": "0",
+        "TOKEN_STORE": args.token_store,
+        "TOKEN_STORE_PATH": os.path.join(workdir, "tokens.db"),
+    })
+    return workdir
+
+
+class ServerStats:
+    """Counts SQL statements issued while serving each endpoint."""
+
+    def __init__(self, app):
+        from flask import g, has_request_context, request
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        self.queries = defaultdict(int)
+        self.requests = defaultdict(int)
+        self._lock = threading.Lock()
+
+        @event.listens_for(Engine, "before_cursor_execute")
+        def _count(conn, cursor, statement, parameters, context, executemany):
+            if has_request_context():
+                g.load_test_queries = g.get("load_test_queries", 0) + 1
+
+        @app.after_request
+        def _record(response):
+            endpoint = request.endpoint or "unknown"
+            with self._lock:
+                self.requests[endpoint] += 1
+                self.queries[endpoint] += g.get("load_test_queries", 0)
+            return response
+
+    def per_request(self):
+        return {
+            endpoint: self.queries[endpoint] / count
+            for endpoint, count in self.requests.items() if count
+        }
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    server.socket.listen(4096)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server.shutdown, f"http://127.0.0.1:{server.server_port}"
+
+
+def start_asgi_server():
+    import uvicorn
+    from modernauth.asgi import app as asgi_app
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(asgi_app, log_level="error", backlog=4096, lifespan="off"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def shutdown():
+        server.should_exit = True
+        thread.join()
+
+    return shutdown, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def call(self, name, fn):
+        started = time.perf_counter()
+        try:
+            response = fn()
+            failed = response.status_code >= 400
+        except Exception:
+            response, failed = None, True
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            if failed:
+                self.errors[name] += 1
+        return response
+
+
+def run_player(index, base_url, server_id, secret, cookie, recorder, args):
+    import requests
+    session = requests.Session()
+    headers = {"X-Server-Secret": secret}
+    username = f"player{index}"
+    token = f"load-{index}-{os.urandom(8).hex()}"
+
+    recorder.call("isuser", lambda: session.get(f"{base_url}/api/isuser/{server_id}/{username}"))
+    response = recorder.call("createtoken", lambda: session.post(
+        f"{base_url}/api/createtoken",
+        json={"server_id": server_id, "token": token, "username": username},
+        headers=headers))
+    if response is None or response.status_code != 200:
+        return False
+    token = response.json().get("token", token)
+
+    params = {"wait": args.wait} if args.wait else {}
+    logged_in = False
+    for attempt in range(args.max_polls):
+        if attempt == args.auth_after_polls:
+            recorder.call("auth", lambda: session.get(
+                f"{base_url}/auth/{server_id}/{token}",
+                params={"username": username},
+                cookies={"session": cookie}))
+        response = recorder.call("authstatus", lambda: session.get(
+            f"{base_url}/api/authstatus/{server_id}/{token}", params=params, headers=headers))
+        if response is not None and response.status_code == 200 and response.json().get("logged_in"):
+            logged_in = True
+            break
+    for _ in range(args.isuser_per_player):
+        recorder.call("isuser", lambda: session.get(f"{base_url}/api/isuser/{server_id}/{username}"))
+    return logged_in
+
+
+async def raw_get(host, port, path, headers):
+    """One GET on its own connection, so thousands can be open at once
+    without a client thread each. Returns ``(status, body)``."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        lines = [f"GET {path} HTTP/1.1", f"Host: {host}:{port}", "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ", 2)[1]), body
+
+
+async def hold_pending(base_url, server_id, secret, cookie, tokens, recorder, args):
+    """Open a long-poll per token, log every player in once all are held,
+    and time each poll from its player's login to its answer."""
+    host, port = base_url.rsplit("//", 1)[1].split(":")
+    port = int(port)
+    authorized_at = {}
+    pending = 0
+    peak = 0
+
+    async def poll(index, token):
+        # Like the plugin, poll again whenever a wait ends before the login.
+        nonlocal pending, peak
+        while True:
+            pending += 1
+            peak = max(peak, pending)
+            polled = time.perf_counter()
+            try:
+                status, body = await raw_get(host, port, f"/api/authstatus/{server_id}/{token}?wait={args.wait}",
+                                             {"X-Server-Secret": secret})
+                logged_in = status == 200 and b'"logged_in":true' in body.replace(b" ", b"")
+            except OSError:
+                status, logged_in = 599, False
+            finally:
+                pending -= 1
+            answered = time.perf_counter()
+            late = index in authorized_at and authorized_at[index] < polled
+            if logged_in or status != 200 or late:
+                break
+        with recorder._lock:
+            recorder.latencies["authstatus"].append(answered - authorized_at.get(index, answered))
+            if not logged_in:
+                recorder.errors["authstatus"] += 1
+        return logged_in
+
+    async def login(index, token, limit):
+        async with limit:
+            started = time.perf_counter()
+            try:
+                status, _ = await raw_get(host, port, f"/auth/{server_id}/{token}?username=player{index}",
+                                          {"Cookie": f"session={cookie}"})
+            except OSError:
+                status = 599
+            authorized_at[index] = time.perf_counter()
+            with recorder._lock:
+                recorder.latencies["auth"].append(authorized_at[index] - started)
+                if status >= 400:
+                    recorder.errors["auth"] += 1
+
+    polls = [asyncio.ensure_future(poll(i, token)) for i, token in enumerate(tokens)]
+    await asyncio.sleep(args.hold)
+    held = pending
+    limit = asyncio.Semaphore(args.concurrency)
+    await asyncio.gather(*(login(i, token, limit) for i, token in enumerate(tokens)))
+    results = await asyncio.gather(*polls)
+    return sum(results), {"held_polls": held, "peak_pending_polls": peak}
+
+
+def summarize(recorder, server_stats, duration, args, logged_in):
+    endpoints = {}
+    for name, samples in sorted(recorder.latencies.items()):
+        endpoints[name] = {
+            "requests": len(samples),
+            "errors": recorder.errors[name],
+            "throughput_rps": len(samples) / duration if duration else 0.0,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+        }
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                  text=True, check=False).stdout.strip()
+    except OSError:
+        revision = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": revision,
+        "python": platform.python_version(),
+        "parameters": vars(args),
+        "duration_s": duration,
+        "players_logged_in": logged_in,
+        "total_requests": sum(e["requests"] for e in endpoints.values()),
+        "throughput_rps": sum(e["requests"] for e in endpoints.values()) / duration if duration else 0.0,
+        "endpoints": endpoints,
+        "sql_statements_per_request": server_stats.per_request() if server_stats else {},
+    }
+
+
+def print_report(result, baseline=None):
+    print(f"{result['players_logged_in']}/{result['parameters']['players']} players logged in, "
+          f"{result['total_requests']} requests in {result['duration_s']:.2f}s "
+          f"({result['throughput_rps']:.0f} req/s)")
+    if "held_polls" in result:
+        print(f"{result['held_polls']} of {result['parameters']['pending']} authstatus polls were open at once "
+              f"when the logins began; authstatus latency is measured from each player's login")
+    print(f"{'endpoint':>12} {'reqs':>7} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, stats in result["endpoints"].items():
+        line = (f"{name:>12} {stats['requests']:>7} {stats['errors']:>5} {stats['throughput_rps']:>8.1f} "
+                f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+        if baseline and name in baseline.get("endpoints", {}):
+            before = baseline["endpoints"][name]["p95_ms"]
+            if before:
+                line += f"   p95 {stats['p95_ms'] / before - 1:+.0%} vs baseline"
+        print(line)
+    if result["sql_statements_per_request"]:
+        print("SQL statements per request (server side):")
+        for endpoint, count in sorted(result["sql_statements_per_request"].items()):
+            print(f"{endpoint:>24}: {count:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=500, help="simulated players joining at once")
+    parser.add_argument("--concurrency", type=int, default=100, help="client threads")
+    parser.add_argument("--wait", type=float, default=0, help="long-poll seconds for authstatus (0 polls)")
+    parser.add_argument("--max-polls", type=int, default=20)
+    parser.add_argument("--auth-after-polls", type=int, default=1,
+                        help="authstatus polls before the player completes the browser login")
+    parser.add_argument("--isuser-per-player", type=int, default=2)
+    parser.add_argument("--token-store", default="sql", choices=("sql", "sqlite", "memory"))
+    parser.add_argument("--server", default="wsgi", choices=("wsgi", "asgi"),
+                        help="threaded WSGI server, or modernauth.asgi on uvicorn")
+    parser.add_argument("--pending", type=int, default=0,
+                        help="hold this many authstatus long-polls open at once instead of the login flow")
+    parser.add_argument("--hold", type=float, default=5, help="seconds the pending polls are held before logins")
+    parser.add_argument("--out", help="write results to this JSON file")
+    parser.add_argument("--compare", help="earlier results JSON to compare p95 latency against")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    from modernauth.db.schema import init_db
+    init_db(os.environ["MYSQL"])
+    import modernauth.app as modernauth_app
+    from modernauth.app import app, create_hash, AUTHSTATUS_MAX_WAIT
+
+    if hasattr(modernauth_app, "limiter"):
+        modernauth_app.limiter.enabled = False
+    server_id, secret = "load-test", os.urandom(32).hex()
+    modernauth_app.server_config_obj.save({server_id: {"secret_key": create_hash(secret)}})
+    # Log in through the session interface so any SESSION_BACKEND works.
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user"] = {"sub": "auth0|load-test", "name": "load-test"}
+    cookie = client.get_cookie(app.config["SESSION_COOKIE_NAME"]).value
+
+    server_stats = ServerStats(app)
+    shutdown, base_url = start_asgi_server() if args.server == "asgi" else start_server(app)
+    recorder = Recorder()
+    extra = {}
+    if args.pending:
+        args.players = args.pending
+        args.wait = args.wait or AUTHSTATUS_MAX_WAIT
+        tokens = [f"load-{i}-{os.urandom(8).hex()}" for i in range(args.pending)]
+        for i, token in enumerate(tokens):
+            modernauth_app.tokens_db.create_token(f"player{i}", token, server_id=server_id)
+        started = time.perf_counter()
+        logged_in, extra = asyncio.run(hold_pending(base_url, server_id, secret, cookie, tokens, recorder, args))
+    else:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(
+                lambda i: run_player(i, base_url, server_id, secret, cookie, recorder, args),
+                range(args.players)))
+        logged_in = sum(results)
+    duration = time.perf_counter() - started
+    shutdown()
+
+    result = summarize(recorder, server_stats, duration, args, logged_in)
+    result.update(extra)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+    print_report(result, baseline)
+    if args.out:
+        with open(args.out, "w") as fh:
+            json.dump(result, fh, indent=2)
+    return 0 if logged_in == args.players else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
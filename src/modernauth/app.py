@@ -1,118 +1,226 @@
-import os, requests, hashlib
-from flask import Flask, redirect, session, url_for, request, render_template, jsonify, send_from_directory
+import hmac, os
+from flask import Blueprint, Flask, Response, redirect, session, url_for, request, render_template, jsonify, send_file, abort
 from authlib.integrations.flask_client import OAuth
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from dotenv import load_dotenv
 from urllib.parse import urlencode
-from modernauth.db.userdb import UserDB
-from modernauth.db.tokensystem import TokenSystemDB
-from modernauth.db.server_config import ServerConfig
+from werkzeug.local import LocalProxy
+from modernauth.signed_tokens import SignedTokenCodec
+from modernauth.db.engine import all_pool_stats
+from modernauth import metrics
+from modernauth.auth0 import default_timeout
+from modernauth.ratelimit import default_storage_uri
+from modernauth.services import services
+from modernauth.sessions import ServerSideSessionInterface, regenerate_session
 load_dotenv()
-app = Flask(__name__)
-app.secret_key = os.getenv("APP_SECRET_KEY")
+bp = Blueprint("modernauth", __name__)
 
+# Browser routes are limited per client IP. The /api/* routes carry their own
+# per-server_id limit (see api_rate_limit_key). Counters live in a store that
+# every worker on the host shares.
+RATELIMIT_DEFAULT = os.getenv("RATELIMIT_DEFAULT", "10000 per day")
+RATELIMIT_API = os.getenv("RATELIMIT_API", "2000 per minute")
 limiter = Limiter(
     get_remote_address,
-    app=app,
-    default_limits=["10000 per day"],
-    storage_uri="memory://",
+    default_limits=[RATELIMIT_DEFAULT],
+    storage_uri=os.getenv("RATELIMIT_STORAGE_URI") or default_storage_uri(),
+    strategy=os.getenv("RATELIMIT_STRATEGY", "moving-window"),
 )
+oauth = OAuth()
 
-oauth = OAuth(app)
-oauth.register(
-    "auth0",
-    client_id=os.getenv("AUTH0_CLIENT_ID"),
-    client_secret=os.getenv("AUTH0_CLIENT_SECRET"),
-    client_kwargs={"scope": "openid profile email"},
-    server_metadata_url=f"https://{os.getenv('AUTH0_DOMAIN')}/.well-known/openid-configuration",
-)
+AUTHSTATUS_MAX_WAIT = float(os.getenv("AUTHSTATUS_MAX_WAIT", "30"))
+AUTHSTATUS_POLL_INTERVAL = float(os.getenv("AUTHSTATUS_POLL_INTERVAL", "1"))
+AUTHSTATUS_BATCH_LIMIT = int(os.getenv("AUTHSTATUS_BATCH_LIMIT", "100"))
+ISUSER_BATCH_LIMIT = int(os.getenv("ISUSER_BATCH_LIMIT", "1000"))
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 DOCS_DIR = os.path.join(BASE_DIR, 'docs', 'build', 'html')
 
-def create_hash(data: str, algorithm: str = 'sha512') -> str:
-    """Create a unique hash of a string using the specified algorithm."""
-    hash_obj = hashlib.new(algorithm)
-    hash_obj.update(data.encode('utf-8'))
-    return hash_obj.hexdigest()
+# Built on first use in each worker process; see modernauth.services.
+create_hash = LocalProxy(lambda: services.hasher)
+server_config_obj = LocalProxy(lambda: services.server_config)
+secret_cache = LocalProxy(lambda: services.secret_cache)
+userdb = LocalProxy(lambda: services.userdb)
+tokens_db = LocalProxy(lambda: services.tokens_db)
+auth0_http = LocalProxy(lambda: services.auth0_http)
+management_tokens = LocalProxy(lambda: services.management_tokens)
+session_store = LocalProxy(lambda: services.session_store)
+
+# "cookie" keeps Flask's signed-cookie sessions. "sql" or "sqlite" keeps
+# session data server-side and only a signed session id in the cookie.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "cookie")
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+
+
+def user_record(userinfo):
+    """The userinfo claims the app uses; sessions keep only these."""
+    return {"sub": userinfo["sub"], "name": userinfo.get("name"), "email": userinfo.get("email")}
+
+
+def api_rate_limit_key():
+    """Rate-limit key for the /api/* routes: the server_id when the request
+    carries that server's secret, otherwise the client IP, so unauthenticated
+    callers cannot spend a server's quota."""
+    server_id = (request.view_args or {}).get("server_id")
+    if server_id is None:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and isinstance(data.get("server_id"), str):
+            server_id = data["server_id"]
+    if server_id and secret_cache.verify(server_id, request.headers.get("X-Server-Secret")):
+        return f"server:{server_id}"
+    return f"ip:{get_remote_address()}"
+
+
+STATELESS_TOKENS = os.getenv("TOKEN_MODE", "db") == "stateless"
+token_signer = SignedTokenCodec(
+    os.getenv("TOKEN_SIGNING_KEY") or os.getenv("APP_SECRET_KEY")
+) if STATELESS_TOKENS else None
+
+
+def get_pending_token(token):
+    if STATELESS_TOKENS:
+        return token_signer.verify(token)
+    return tokens_db.get_token_data(token)
+
+
+def authorize_pending_token(token, token_data):
+    if STATELESS_TOKENS:
+        return tokens_db.grant_token(
+            token, token_data["username"], token_data["server_id"], token_data["expiration_time"]
+        )
+    return tokens_db.authorize_token(token)
 
-server_config_obj = ServerConfig(
-    mysql_connection=os.getenv("MYSQL"),
-    hash_function=create_hash
-)
-userdb = UserDB(
-    mysql_connection=os.getenv("MYSQL"),
-    hash_function=create_hash
-)
-tokens_db = TokenSystemDB(
-    mysql_connection=os.getenv("MYSQL"),
-    hash_function=create_hash
-)
-@app.route("/developers/")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+# /metrics is only served to requests carrying this bearer token.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Set by ``modernauth serve`` so /metrics sums every worker on the host.
+METRICS_STORE_PATH = os.getenv("METRICS_STORE_PATH")
+
+
+def _pool_samples(field):
+    return [((name,), stats[field]) for name, stats in all_pool_stats().items() if field in stats]
+
+
+def _cache_samples(field):
+    userdb_obj = services.built("userdb")
+    caches = {
+        "server_config": services.built("server_config"),
+        "server_secret": services.built("secret_cache"),
+        "user_membership": userdb_obj.cache if userdb_obj is not None else None,
+    }
+    samples = []
+    for name, cache in caches.items():
+        if cache is None:
+            continue
+        samples.append(((name,), getattr(cache, field)))
+    return samples
+
+
+if METRICS_ENABLED:
+    if METRICS_STORE_PATH and metrics.REGISTRY.shared is None:
+        metrics.REGISTRY.share(METRICS_STORE_PATH, interval=float(os.getenv("METRICS_FLUSH_INTERVAL", "5")))
+    for field, help_text in (
+        ("checked_out", "Connections currently checked out of the pool."),
+        ("overflow", "Connections open beyond the pool size."),
+        ("size", "Configured pool size."),
+        ("wait_seconds_total", "Total time spent waiting for a pooled connection."),
+        ("wait_count", "Connections handed out by the pool."),
+    ):
+        metrics.REGISTRY.gauge(
+            f"modernauth_db_pool_{field}", help_text,
+            lambda field=field: _pool_samples(field), ("pool",))
+    metrics.REGISTRY.gauge(
+        "modernauth_cache_hits", "Lookups answered from an in-process cache.",
+        lambda: _cache_samples("hits"), ("cache",))
+    metrics.REGISTRY.gauge(
+        "modernauth_cache_misses", "Lookups that fell through an in-process cache.",
+        lambda: _cache_samples("misses"), ("cache",))
+
+
+@bp.route("/metrics")
+@limiter.exempt
+def metrics_endpoint():
+    if not METRICS_ENABLED or not METRICS_TOKEN:
+        return render_template('404.html'), 404
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/developers/")
 def developers():
     return redirect('https://docs.bonkmc.org', code=302)
 
 
-@app.route('/docs/')
+@bp.route('/docs/')
 def docs_index():
     return redirect('https://docs.bonkmc.org', code=302)
 
 
-@app.route('/assets/<path:path>')
-def serve_assets(path):
-    return send_from_directory(os.path.join(os.path.dirname(__file__), 'assets'), path)
+@bp.app_template_global()
+def asset_url(name):
+    """URL of the fingerprinted copy of the asset ``name``."""
+    return url_for("modernauth.serve_assets", path=services.assets.path(name))
+
 
-@app.route("/")
+@bp.route('/assets/<path:path>')
+@limiter.exempt
+def serve_assets(path):
+    asset = services.assets.resolve(path, request.headers.get("Accept-Encoding"))
+    if asset is None:
+        abort(404)
+    response = send_file(asset.file, mimetype=asset.mimetype, etag=asset.etag, conditional=True)
+    response.headers.update(asset.headers)
+    return response
+
+@bp.route("/")
 def home():
     if "user" in session:
         return render_template("home.html", user=session["user"].get("name"))
     return render_template("home.html", user=None)
 
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def page_not_found(error):
     return render_template('404.html'), 404
 
 
-@app.route("/login")
+@bp.route("/login")
 def login():
     next_url = request.args.get('next')
     if next_url:
         session['login_next'] = next_url
     return oauth.auth0.authorize_redirect(
-        redirect_uri=url_for("callback", _external=True),
+        redirect_uri=url_for(".callback", _external=True),
         prompt="login"
     )
 
 
-@app.route("/callback")
+@bp.route("/callback")
 def callback():
-    token_response = oauth.auth0.authorize_access_token()
-    userinfo = token_response["userinfo"]
-    session["user"] = {
-        "sub":   userinfo["sub"],
-        "name":  userinfo.get("name"),
-        "email": userinfo.get("email")
-    }
+    with metrics.auth0_latency.time("authorize_access_token"):
+        token_response = oauth.auth0.authorize_access_token()
+    regenerate_session(session)
+    session["user"] = user_record(token_response["userinfo"])
 
     if "incoming_token" in session and "incoming_server_id" in session:
         tk  = session.pop("incoming_token")
         sid = session.pop("incoming_server_id")
-        return redirect(url_for("auth_token", server_id=sid, token=tk))
+        return redirect(url_for(".auth_token", server_id=sid, token=tk))
 
     if "login_next" in session:
         dest = session.pop("login_next")
         return redirect(f"{dest}?username={session['user']['name']}")
 
-    return redirect(url_for("home"))
+    return redirect(url_for(".home"))
 
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     session.clear()
     params = {
-        "returnTo": url_for("home", _external=True),
+        "returnTo": url_for(".home", _external=True),
         "client_id": os.getenv("AUTH0_CLIENT_ID")
     }
     return redirect(
@@ -120,10 +228,10 @@ def logout():
     )
 
 
-@app.route("/auth/<server_id>/<token>")
+@bp.route("/auth/<server_id>/<token>")
 def auth_token(server_id, token):
     username = request.args.get("username") or session.pop("pending_username", None)
-    token_data = tokens_db.get_token_data(token)
+    token_data = get_pending_token(token)
     if not token_data or token_data.get("server_id") != server_id:
         return render_template("error.html", message="Invalid token or server mismatch.")
     user = session.get("user")
@@ -132,21 +240,23 @@ def auth_token(server_id, token):
         session["incoming_server_id"] = server_id
         if username:
             session["pending_username"] = username
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
 
     sub = user["sub"]
 
     if not userdb.isuser(server_id, username):
-        if userdb.signup(server_id, username, sub):
-            tokens_db.authorize_token(token)
-            return render_template(
-                "success.html",
-                message=f"Created account for {username} on {server_id}."
-            )
-        return render_template("error.html", message="Signup failed.")
+        if not userdb.signup(server_id, username, sub):
+            return render_template("error.html", message="Signup failed.")
+        if not authorize_pending_token(token, token_data):
+            return render_template("error.html", message="Token expired or already used.")
+        return render_template(
+            "success.html",
+            message=f"Created account for {username} on {server_id}."
+        )
 
     if userdb.login(server_id, username, sub):
-        tokens_db.authorize_token(token)
+        if not authorize_pending_token(token, token_data):
+            return render_template("error.html", message="Token expired or already used.")
         return render_template(
             "success.html",
             message=f"Logged in as {username} on {server_id}."
@@ -158,7 +268,8 @@ def auth_token(server_id, token):
     )
 
 
-@app.route("/api/createtoken", methods=["POST"])
+@bp.route("/api/createtoken", methods=["POST"])
+@limiter.limit(RATELIMIT_API, key_func=api_rate_limit_key)
 def create_token():
     data = request.get_json()
     not_authorized_response = {"message": "Your token or was not valid, or you are not authorized to use this endpoint."}
@@ -167,92 +278,122 @@ def create_token():
     server_id = data.get("server_id")
     token = data.get("token")
     username = data.get("username")
-    if not server_id or not token or not username:
+    if not server_id or not username or not (token or STATELESS_TOKENS):
         return jsonify(not_authorized_response), 403
-    config = server_config_obj.load()
-    expected_secret = config.get(server_id, {}).get("secret_key")
-    provided_secret = create_hash(request.headers.get("X-Server-Secret"))
-    if not provided_secret or provided_secret != expected_secret:
+    if not secret_cache.verify(server_id, request.headers.get("X-Server-Secret")):
         return jsonify(not_authorized_response), 403
+    if STATELESS_TOKENS:
+        token = token_signer.issue(server_id, username)
+        return jsonify({"message": "Token created successfully.", "token": token}), 200
     tokens_db.create_token(username, token, server_id=server_id)
     return jsonify({"message": "Token created successfully."}), 200
 
 
-@app.route("/api/authstatus/<server_id>/<token>", methods=["GET"])
+@bp.route("/api/authstatus/<server_id>/<token>", methods=["GET"])
+@limiter.limit(RATELIMIT_API, key_func=api_rate_limit_key)
 def auth_status(server_id, token):
-    config = server_config_obj.load()
-    expected = config.get(server_id, {}).get("secret_key")
-    provided = create_hash(request.headers.get("X-Server-Secret", ""))
-    if not expected or provided != expected:
+    if not secret_cache.verify(server_id, request.headers.get("X-Server-Secret")):
         return jsonify({"logged_in": False})
-
-    token_data = tokens_db.get_token_data(token)
-    if not token_data or token_data.get("server_id") != server_id:
+    if STATELESS_TOKENS and not token_signer.verify(token, server_id=server_id):
         return jsonify({"logged_in": False})
 
-    username = token_data.get("username")
-    if userdb.isuser(server_id, username) and token_data.get("authorized"):
-        tokens_db.remove_token(token)
-        return jsonify({"logged_in": True})
+    wait = min(request.args.get("wait", 0, type=float), AUTHSTATUS_MAX_WAIT)
+    if wait > 0:
+        token_data = tokens_db.wait_for_authorization(
+            token, wait, server_id=server_id, poll_interval=AUTHSTATUS_POLL_INTERVAL,
+            require_row=not STATELESS_TOKENS
+        )
+        if not token_data or not token_data.get("authorized"):
+            return jsonify({"logged_in": False})
+
+    # A token is only authorized once /auth has signed the player up or
+    # logged them in, so consuming it is the whole check.
+    token_data = tokens_db.consume_if_authorized(server_id, token, keep_spent=STATELESS_TOKENS)
+    return jsonify({"logged_in": token_data is not None})
+
+
+@bp.route("/api/authstatus/batch", methods=["POST"])
+@limiter.limit(RATELIMIT_API, key_func=api_rate_limit_key)
+def auth_status_batch():
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
+    not_authorized_response = {"message": "Your token or was not valid, or you are not authorized to use this endpoint."}
+    server_id = data.get("server_id")
+    tokens = data.get("tokens")
+    if not server_id or not isinstance(tokens, list) or not all(isinstance(t, str) for t in tokens):
+        return jsonify({"message": "Expected a server_id and a list of tokens."}), 400
+    if len(tokens) > AUTHSTATUS_BATCH_LIMIT:
+        return jsonify({"message": f"At most {AUTHSTATUS_BATCH_LIMIT} tokens per request."}), 413
+    if not secret_cache.verify(server_id, request.headers.get("X-Server-Secret")):
+        return jsonify(not_authorized_response), 403
 
-    return jsonify({"logged_in": False})
+    candidates = tokens
+    if STATELESS_TOKENS:
+        candidates = [t for t in tokens if token_signer.verify(t, server_id=server_id)]
+    consumed = tokens_db.consume_authorized(server_id, candidates, keep_spent=STATELESS_TOKENS)
+    return jsonify({"statuses": {token: token in consumed for token in tokens}})
 
 
-@app.route("/api/isuser/<server_id>/<username>", methods=["GET"])
+@bp.route("/api/isuser/<server_id>/<username>", methods=["GET"])
+@limiter.limit(RATELIMIT_API, key_func=api_rate_limit_key)
 def is_user(server_id, username):
     return jsonify({"exists": userdb.isuser(server_id, username)})
 
 
-@app.route("/settings")
+@bp.route("/api/isuser/batch", methods=["POST"])
+@limiter.limit(RATELIMIT_API, key_func=api_rate_limit_key)
+def is_user_batch():
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
+    server_id = data.get("server_id")
+    usernames = data.get("usernames")
+    if not server_id or not isinstance(usernames, list) or not all(isinstance(u, str) for u in usernames):
+        return jsonify({"message": "Expected a server_id and a list of usernames."}), 400
+    if len(usernames) > ISUSER_BATCH_LIMIT:
+        return jsonify({"message": f"At most {ISUSER_BATCH_LIMIT} usernames per request."}), 413
+    if not secret_cache.verify(server_id, request.headers.get("X-Server-Secret")):
+        return jsonify({"message": "Your token or was not valid, or you are not authorized to use this endpoint."}), 403
+    return jsonify({"exists": userdb.isusers(server_id, usernames)})
+
+
+@bp.route("/settings")
 def settings():
     if "user" not in session or "sub" not in session["user"]:
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     user_sub = session["user"]["sub"]
     return render_template("settings.html", user=session["user"])
 
 
-@app.route("/link/<provider>")
+@bp.route("/link/<provider>")
 def link_provider(provider):
     if "user" not in session or "sub" not in session["user"]:
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     connection_map = {
         "google": "google-oauth2"
     }
     if provider not in connection_map:
         return render_template("error.html", message="Unknown provider.")
     session["linking"] = provider
-    redirect_uri = url_for("link_callback", provider=provider, _external=True)
+    redirect_uri = url_for(".link_callback", provider=provider, _external=True)
     return oauth.auth0.authorize_redirect(
         redirect_uri=redirect_uri,
         connection=connection_map[provider]
     )
 
 
+
 def get_management_token():
-    domain = os.getenv("AUTH0_DOMAIN")
-    client_id = os.getenv("AUTH0_CLIENT_ID")
-    client_secret = os.getenv("AUTH0_CLIENT_SECRET")
-    audience = f"https://{domain}/api/v2/"
-    url = f"https://{domain}/oauth/token"
-    payload = {
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "audience": audience,
-        "grant_type": "client_credentials"
-    }
-    headers = {"Content-Type": "application/json"}
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()["access_token"]
+    return management_tokens.get()
 
 
-@app.route("/link_callback/<provider>")
+@bp.route("/link_callback/<provider>")
 def link_callback(provider):
     if "linking" not in session or session["linking"] != provider:
         return render_template("error.html", message="Linking session expired or invalid.")
     session.pop("linking", None)
     try:
-        token_response = oauth.auth0.authorize_access_token()
+        with metrics.auth0_latency.time("authorize_access_token"):
+            token_response = oauth.auth0.authorize_access_token()
     except Exception as e:
         return render_template("error.html", message="Failed to link account: " + str(e))
     linking_info = token_response.get("userinfo")
@@ -279,18 +420,48 @@ def link_callback(provider):
     }
     r = None
     try:
-        r = requests.post(mgmt_url, json=payload, headers=headers)
+        with metrics.auth0_latency.time("link_identity"):
+            r = auth0_http.post(mgmt_url, json=payload, headers=headers, timeout=default_timeout())
+        if r.status_code == 401:
+            management_tokens.invalidate()
         r.raise_for_status()
     except Exception as e:
         error_details = r.text if r is not None else "No response received"
         return render_template("error.html", message="Error linking account via Management API: " + str(
             e) + " Details: " + error_details)
-    if "linked_accounts" not in session["user"]:
-        session["user"]["linked_accounts"] = {}
-    session["user"]["linked_accounts"][provider] = linking_info
+    user = session["user"]
+    user.setdefault("linked_accounts", {})[provider] = user_record(linking_info)
+    session["user"] = user
     message = f"Successfully linked {provider.capitalize()} account."
     return render_template("success.html", message=message)
 
 
+def create_app():
+    """Build the Flask app. Database objects are created lazily on first use
+    in each process, so this neither connects to the database nor creates
+    tables; run ``modernauth init-db`` for that."""
+    app = Flask(__name__)
+    app.secret_key = os.getenv("APP_SECRET_KEY")
+    if SESSION_BACKEND != "cookie":
+        app.session_interface = ServerSideSessionInterface(session_store, ttl=SESSION_TTL)
+    limiter.init_app(app)
+    oauth.init_app(app)
+    oauth.register(
+        "auth0",
+        client_id=os.getenv("AUTH0_CLIENT_ID"),
+        client_secret=os.getenv("AUTH0_CLIENT_SECRET"),
+        client_kwargs={"scope": "openid profile email"},
+        server_metadata_url=f"https://{os.getenv('AUTH0_DOMAIN')}/.well-known/openid-configuration",
+    )
+    if METRICS_ENABLED:
+        metrics.instrument_sqlalchemy()
+        metrics.instrument_app(app)
+    app.register_blueprint(bp)
+    return app
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 3000)))
@@ -0,0 +1,220 @@
+"""ASGI entry point, served by ``modernauth serve --worker-class uvicorn``.
+
+The plugin-facing /api routes run here as async views on the asyncio
+database engines, so a pending /api/authstatus long-poll holds a coroutine
+rather than a worker thread. /assets/* is sent from the event loop too.
+Every other path, including the browser OAuth flow, is handed to the Flask
+app in ``modernauth.app`` on a thread pool. Needs the ``asgi`` extra.
+"""
+import os, time
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from limits import parse_many
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags
+from modernauth import metrics
+from modernauth.app import (
+    app as flask_app, limiter, token_signer, RATELIMIT_API, STATELESS_TOKENS, METRICS_ENABLED,
+    AUTHSTATUS_MAX_WAIT, AUTHSTATUS_POLL_INTERVAL, AUTHSTATUS_BATCH_LIMIT, ISUSER_BATCH_LIMIT
+)
+from modernauth.db.engine import dispose_async_engines
+from modernauth.services import services
+
+NOT_AUTHORIZED = {"message": "Your token or was not valid, or you are not authorized to use this endpoint."}
+API_LIMITS = parse_many(RATELIMIT_API)
+
+api_routes = []
+
+
+async def get_json(request):
+    """The JSON body, or ``None`` if there is none or it does not parse."""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def api_rate_limit_key(request):
+    """Same key as ``modernauth.app.api_rate_limit_key``."""
+    server_id = request.path_params.get("server_id")
+    if server_id is None:
+        data = await get_json(request)
+        if isinstance(data, dict) and isinstance(data.get("server_id"), str):
+            server_id = data["server_id"]
+    if server_id and await services.secret_cache.verify_async(server_id, request.headers.get("X-Server-Secret")):
+        return f"server:{server_id}"
+    return f"ip:{request.client.host if request.client else '127.0.0.1'}"
+
+
+async def rate_limited(request, endpoint):
+    # Hits the counters Flask-Limiter keeps for the Flask view of the same
+    # name, so both apps spend one quota.
+    if not limiter.enabled:
+        return False
+    key = await api_rate_limit_key(request)
+    for item in API_LIMITS:
+        if not await run_in_threadpool(limiter.limiter.hit, item, key, f"modernauth.{endpoint}"):
+            return True
+    return False
+
+
+def api_route(rule, methods=("GET",)):
+    """Register an async view under the Flask-style ``rule`` with the /api
+    rate limit and request metrics, labelled exactly as the Flask routes are."""
+    path = rule.replace("<", "{").replace(">", "}")
+
+    def decorator(view):
+        async def endpoint(request):
+            started = time.perf_counter()
+            if await rate_limited(request, view.__name__):
+                response = JSONResponse({"message": f"Rate limit exceeded: {RATELIMIT_API}"}, 429)
+            else:
+                response = await view(request, **request.path_params)
+            if METRICS_ENABLED:
+                metrics.http_latency.observe(time.perf_counter() - started, rule)
+                metrics.http_requests.inc(request.method, rule, str(response.status_code))
+                if response.status_code == 429:
+                    metrics.rate_limited.inc(rule)
+            return response
+
+        api_routes.append(Route(path, endpoint, methods=list(methods), name=view.__name__))
+        return view
+
+    return decorator
+
+
+@api_route("/api/createtoken", methods=["POST"])
+async def create_token(request):
+    data = await get_json(request)
+    if not isinstance(data, dict):
+        return JSONResponse(NOT_AUTHORIZED, 403)
+    server_id = data.get("server_id")
+    token = data.get("token")
+    username = data.get("username")
+    if not server_id or not username or not (token or STATELESS_TOKENS):
+        return JSONResponse(NOT_AUTHORIZED, 403)
+    if not await services.secret_cache.verify_async(server_id, request.headers.get("X-Server-Secret")):
+        return JSONResponse(NOT_AUTHORIZED, 403)
+    if STATELESS_TOKENS:
+        token = token_signer.issue(server_id, username)
+        return JSONResponse({"message": "Token created successfully.", "token": token})
+    await services.tokens_db.create_token_async(username, token, server_id=server_id)
+    return JSONResponse({"message": "Token created successfully."})
+
+
+@api_route("/api/authstatus/<server_id>/<token>")
+async def auth_status(request, server_id, token):
+    if not await services.secret_cache.verify_async(server_id, request.headers.get("X-Server-Secret")):
+        return JSONResponse({"logged_in": False})
+    if STATELESS_TOKENS and not token_signer.verify(token, server_id=server_id):
+        return JSONResponse({"logged_in": False})
+
+    try:
+        wait = min(float(request.query_params.get("wait", 0)), AUTHSTATUS_MAX_WAIT)
+    except ValueError:
+        wait = 0
+    tokens_db = services.tokens_db
+    if wait > 0:
+        token_data = await tokens_db.wait_for_authorization_async(
+            token, wait, server_id=server_id, poll_interval=AUTHSTATUS_POLL_INTERVAL,
+            require_row=not STATELESS_TOKENS
+        )
+        if not token_data or not token_data.get("authorized"):
+            return JSONResponse({"logged_in": False})
+
+    token_data = await tokens_db.consume_if_authorized_async(server_id, token, keep_spent=STATELESS_TOKENS)
+    return JSONResponse({"logged_in": token_data is not None})
+
+
+@api_route("/api/authstatus/batch", methods=["POST"])
+async def auth_status_batch(request):
+    data = await get_json(request)
+    data = data if isinstance(data, dict) else {}
+    server_id = data.get("server_id")
+    tokens = data.get("tokens")
+    if not server_id or not isinstance(tokens, list) or not all(isinstance(t, str) for t in tokens):
+        return JSONResponse({"message": "Expected a server_id and a list of tokens."}, 400)
+    if len(tokens) > AUTHSTATUS_BATCH_LIMIT:
+        return JSONResponse({"message": f"At most {AUTHSTATUS_BATCH_LIMIT} tokens per request."}, 413)
+    if not await services.secret_cache.verify_async(server_id, request.headers.get("X-Server-Secret")):
+        return JSONResponse(NOT_AUTHORIZED, 403)
+
+    candidates = tokens
+    if STATELESS_TOKENS:
+        candidates = [t for t in tokens if token_signer.verify(t, server_id=server_id)]
+    consumed = await services.tokens_db.consume_authorized_async(server_id, candidates, keep_spent=STATELESS_TOKENS)
+    return JSONResponse({"statuses": {token: token in consumed for token in tokens}})
+
+
+@api_route("/api/isuser/<server_id>/<username>")
+async def is_user(request, server_id, username):
+    return JSONResponse({"exists": await services.userdb.isuser_async(server_id, username)})
+
+
+@api_route("/api/isuser/batch", methods=["POST"])
+async def is_user_batch(request):
+    data = await get_json(request)
+    data = data if isinstance(data, dict) else {}
+    server_id = data.get("server_id")
+    usernames = data.get("usernames")
+    if not server_id or not isinstance(usernames, list) or not all(isinstance(u, str) for u in usernames):
+        return JSONResponse({"message": "Expected a server_id and a list of usernames."}, 400)
+    if len(usernames) > ISUSER_BATCH_LIMIT:
+        return JSONResponse({"message": f"At most {ISUSER_BATCH_LIMIT} usernames per request."}, 413)
+    if not await services.secret_cache.verify_async(server_id, request.headers.get("X-Server-Secret")):
+        return JSONResponse(NOT_AUTHORIZED, 403)
+    return JSONResponse({"exists": await services.userdb.isusers_async(server_id, usernames)})
+
+
+class StaticAssets:
+    """ASGI app for /assets/*, answered without a Flask thread. Paths the
+    asset manifest does not know fall through to ``fallback`` (Flask), which
+    renders the 404 page."""
+
+    rule = "/assets/<path:path>"
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    async def __call__(self, scope, receive, send):
+        started = time.perf_counter()
+        request = Request(scope, receive)
+        asset = None
+        if request.method in ("GET", "HEAD"):
+            asset = services.assets.resolve(request.path_params["path"], request.headers.get("accept-encoding"))
+        if asset is None:
+            await self.fallback(scope, receive, send)
+            return
+        if parse_etags(request.headers.get("if-none-match")).contains(asset.etag):
+            response = Response(status_code=304, headers=asset.headers)
+        else:
+            response = FileResponse(asset.file, headers=asset.headers, media_type=asset.mimetype)
+        await response(scope, receive, send)
+        if METRICS_ENABLED:
+            metrics.http_latency.observe(time.perf_counter() - started, self.rule)
+            metrics.http_requests.inc(request.method, self.rule, str(response.status_code))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Load (or build) the asset manifest before the first request needs it.
+    await run_in_threadpool(lambda: services.assets)
+    if METRICS_ENABLED and metrics.REGISTRY.shared is not None:
+        metrics.REGISTRY.shared.start()
+    yield
+    await dispose_async_engines()
+
+
+def create_asgi_app():
+    """The /api routes and /assets above in front of the Flask app. Browser
+    routes run on a pool of ``WORKER_THREADS`` threads (default 10)."""
+    wsgi = WSGIMiddleware(flask_app, workers=int(os.getenv("WORKER_THREADS", "10")))
+    routes = api_routes + [Route("/assets/{path:path}", StaticAssets(wsgi)), Mount("/", app=wsgi)]
+    return Starlette(routes=routes, lifespan=lifespan)
+
+
+app = create_asgi_app()
@@ -0,0 +1,73 @@
+import os, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+from modernauth import metrics
+
+
+def make_session(pool_size=10):
+    """A ``requests.Session`` that keeps connections to Auth0 alive."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def default_timeout():
+    return (
+        float(os.getenv("AUTH0_CONNECT_TIMEOUT", "3")),
+        float(os.getenv("AUTH0_READ_TIMEOUT", "10")),
+    )
+
+
+class ManagementTokenCache:
+    """Caches the Auth0 Management API token until shortly before it expires.
+
+    Only one thread refreshes at a time; threads that arrive during a refresh
+    wait for it and reuse its result instead of requesting their own token.
+    """
+
+    def __init__(self, domain, client_id, client_secret, session=None, timeout=None,
+                 refresh_margin=300, base_url=None):
+        self.base_url = base_url or f"https://{domain}"
+        self.audience = f"https://{domain}/api/v2/"
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.session = session or make_session()
+        self.timeout = timeout or default_timeout()
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._refresh_at = 0.0
+        self._lock = threading.Lock()
+
+    def _valid(self):
+        return self._token is not None and time.monotonic() < self._refresh_at
+
+    def get(self):
+        if self._valid():
+            return self._token
+        with self._lock:
+            if not self._valid():
+                self._refresh()
+            return self._token
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+            self._refresh_at = 0.0
+
+    def _refresh(self):
+        payload = {
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "audience": self.audience,
+            "grant_type": "client_credentials"
+        }
+        requested_at = time.monotonic()
+        with metrics.auth0_latency.time("management_token"):
+            response = self.session.post(f"{self.base_url}/oauth/token", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        body = response.json()
+        expires_in = float(body.get("expires_in", 86400))
+        self._token = body["access_token"]
+        self._refresh_at = requested_at + max(expires_in - self.refresh_margin, expires_in / 2)
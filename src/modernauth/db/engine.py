@@ -0,0 +1,200 @@
+import os, sqlite3, time, threading, weakref
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+_engines = {}
+_async_engines = {}
+_engines_lock = threading.Lock()
+_tracked_engines = weakref.WeakSet()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long callers waited for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_count = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            self.wait_count += 1
+            self.wait_seconds += waited
+            if waited > self.max_wait_seconds:
+                self.max_wait_seconds = waited
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """TimedQueuePool for async engines."""
+
+
+def _pool_options(poolclass=TimedQueuePool):
+    return {
+        "poolclass": poolclass,
+        "pool_size": _env_int("DB_POOL_SIZE", 5),
+        "max_overflow": _env_int("DB_MAX_OVERFLOW", 10),
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", 1800),
+        "pool_timeout": _env_int("DB_POOL_TIMEOUT", 30),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1").lower() not in ("0", "false", "no"),
+    }
+
+
+def make_engine(url):
+    url = url.replace("mysql://", "mysql+pymysql://")
+    options = {} if url.startswith("sqlite") else _pool_options()
+    return create_engine(url=url, echo=False, **options)
+
+
+def get_engine(url):
+    """Return the engine shared by every db class connecting to ``url``."""
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = _engines[url] = make_engine(url)
+        return engine
+
+
+ASYNC_DRIVERS = {"mysql": "mysql+aiomysql", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_url(url):
+    """``url`` with its driver swapped for the asyncio one."""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def make_async_engine(url):
+    from sqlalchemy.ext.asyncio import create_async_engine
+    url = async_url(url)
+    options = {} if url.get_backend_name() == "sqlite" else _pool_options(TimedAsyncQueuePool)
+    return create_async_engine(url, echo=False, **options)
+
+
+def get_async_engine(url):
+    """Return the asyncio engine shared by every db class connecting to
+    ``url``. Needs the ``asgi`` extra (aiomysql or aiosqlite). Its
+    connections belong to the event loop that opened them, so a process
+    should only use it from one loop."""
+    key = async_url(url).render_as_string(hide_password=False)
+    with _engines_lock:
+        engine = _async_engines.get(key)
+        if engine is None:
+            engine = _async_engines[key] = make_async_engine(key)
+        return engine
+
+
+async def dispose_async_engines():
+    with _engines_lock:
+        engines = list(_async_engines.values())
+    for engine in engines:
+        await engine.dispose()
+
+
+def track_engine(engine):
+    """Include an engine not made by ``get_engine`` in ``dispose_engines``."""
+    _tracked_engines.add(engine)
+    return engine
+
+
+# Milliseconds a writer waits on another process's lock before giving up.
+SQLITE_BUSY_TIMEOUT = 5000
+
+
+def sqlite_pragmas(dbapi_connection, busy_timeout=SQLITE_BUSY_TIMEOUT):
+    """The settings of every host-local SQLite file shared by the worker
+    processes: WAL mode, relaxed fsync and a busy timeout in milliseconds."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+    cursor.close()
+
+
+def configure_sqlite(engine, busy_timeout=SQLITE_BUSY_TIMEOUT):
+    """Apply ``sqlite_pragmas`` to every connection of ``engine``."""
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):
+        sqlite_pragmas(dbapi_connection, busy_timeout)
+
+    return track_engine(engine)
+
+
+def connect_sqlite(path, busy_timeout=SQLITE_BUSY_TIMEOUT):
+    """A raw ``sqlite3`` connection with ``sqlite_pragmas`` applied, in
+    autocommit mode so ``sqlite_transaction`` controls the transactions. For
+    the stores that run outside SQLAlchemy (metrics, rate limits)."""
+    conn = sqlite3.connect(path, timeout=busy_timeout / 1000, isolation_level=None)
+    sqlite_pragmas(conn, busy_timeout)
+    return conn
+
+
+@contextmanager
+def sqlite_transaction(conn):
+    """A write transaction on a ``connect_sqlite`` connection. It takes the
+    write lock up front (``BEGIN IMMEDIATE``), so the busy timeout applies
+    there rather than as a deadlock on upgrade from a read lock."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    try:
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+def dispose_engines():
+    """Forget pooled connections inherited from a parent process. Runs in
+    every forked child (e.g. gunicorn workers under ``--preload``); the
+    parent's connections are dropped without being closed, since the parent
+    may still be using them."""
+    global _engines_lock
+    _engines_lock = threading.Lock()
+    for engine in list(_engines.values()) + list(_tracked_engines):
+        engine.dispose(close=False)
+    for engine in list(_async_engines.values()):
+        engine.sync_engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=dispose_engines)
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            "wait_count": pool.wait_count,
+            "wait_seconds_total": pool.wait_seconds,
+            "wait_seconds_max": pool.max_wait_seconds,
+        })
+    return stats
+
+
+def all_pool_stats():
+    with _engines_lock:
+        engines = dict(_engines)
+        engines.update((url, engine.sync_engine) for url, engine in _async_engines.items())
+    return {url.split("@")[-1]: pool_stats(engine) for url, engine in engines.items()}
@@ -0,0 +1,196 @@
+import hashlib, math, threading, time
+from collections import OrderedDict
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.count = 0
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value: str):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    @property
+    def full(self) -> bool:
+        """Past its capacity, where the false-positive rate starts to climb."""
+        return self.count > self.capacity
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class _ServerFilter:
+    def __init__(self, bloom, version, checked_at):
+        self.bloom = bloom
+        self.version = version
+        self.checked_at = checked_at
+        self.refreshing = threading.Lock()
+
+
+class MembershipCache:
+    """Per-process cache of which usernames exist on which server.
+
+    Known members sit in a bounded LRU for ``ttl`` seconds. Each server also
+    gets a Bloom filter of its usernames, tagged with the server's row in
+    ``user_versions``, which every signup and delete bumps in the same
+    transaction. A filter that falls behind catches up from the change log
+    ``UserDB`` keeps, and is only rebuilt from scratch when it is new, too
+    far behind or full. A filter whose version was confirmed within
+    ``check_interval`` seconds answers misses as definite negatives, and only
+    then are the server's LRU entries trusted either. When the version has
+    moved, the filter is rebuilt and the server's LRU entries are dropped, so
+    signups and deletes made by other workers show up within
+    ``check_interval`` (``0`` checks on every lookup). Changes made in this
+    process apply at once.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300, check_interval=1.0, error_rate=0.01):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.error_rate = error_rate
+        self._members = OrderedDict()
+        self._filters = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.filter_builds = 0
+
+    def lookup(self, server_id, username, checked=False):
+        """Return ``True`` or ``False`` when the answer is cached, else ``None``.
+        Nothing is answered for a server whose filter is not current, since
+        another worker may have changed its users, unless the caller has just
+        ``checked`` its version."""
+        now = time.monotonic()
+        key = (server_id, username)
+        with self._lock:
+            entry = self._filters.get(server_id)
+            if entry is None or entry.version is None or \
+                    (not checked and now - entry.checked_at >= self.check_interval):
+                self.misses += 1
+                return None
+            expires = self._members.get(key)
+            if expires is not None:
+                if expires > now:
+                    self._members.move_to_end(key)
+                    self.hits += 1
+                    return True
+                del self._members[key]
+            if username not in entry.bloom:
+                self.hits += 1
+                self.negative_hits += 1
+                return False
+            self.misses += 1
+        return None
+
+    def fresh(self, server_id):
+        entry = self._filters.get(server_id)
+        return entry is not None and entry.version is not None and \
+            time.monotonic() - entry.checked_at < self.check_interval
+
+    def version(self, server_id):
+        entry = self._filters.get(server_id)
+        return entry.version if entry is not None else None
+
+    def refreshing(self, server_id):
+        """A lock held while one thread checks ``server_id``'s version, so
+        concurrent lookups do not all query it; they use the database instead."""
+        with self._lock:
+            entry = self._filters.get(server_id)
+            if entry is None:
+                entry = self._filters[server_id] = _ServerFilter(BloomFilter(1), None, float("-inf"))
+            return entry.refreshing
+
+    def confirm(self, server_id, version, checked_at):
+        """Mark the filter current after reading an unchanged ``version``.
+        ``checked_at`` is taken before the version was read."""
+        with self._lock:
+            entry = self._filters.get(server_id)
+            if entry is not None and entry.version == version:
+                entry.checked_at = checked_at
+
+    def set_filter(self, server_id, version, usernames, checked_at):
+        """Install a filter of ``usernames`` read at ``version``."""
+        usernames = list(usernames)
+        bloom = BloomFilter(max(len(usernames) * 2, 1024), self.error_rate)
+        for username in usernames:
+            bloom.add(username)
+        with self._lock:
+            entry = self._filters[server_id]
+            entry.bloom, entry.version, entry.checked_at = bloom, version, checked_at
+            for key in [key for key in self._members if key[0] == server_id]:
+                del self._members[key]
+            self.filter_builds += 1
+
+    def apply(self, server_id, from_version, changes, checked_at):
+        """Catch the filter up from ``from_version`` with ``(version, username,
+        deleted)`` rows. Returns ``False`` if it needs a rebuild instead."""
+        with self._lock:
+            entry = self._filters.get(server_id)
+            if entry is None or entry.version is None or entry.version < from_version:
+                return False
+            for version, username, deleted in changes:
+                if version <= entry.version:
+                    continue
+                if deleted:
+                    self._members.pop((server_id, username), None)
+                else:
+                    entry.bloom.add(username)
+                entry.version = version
+            if entry.bloom.full:
+                return False
+            entry.checked_at = checked_at
+        return True
+
+    def advance(self, server_id, version):
+        """Record this process's own change, which moved the server to
+        ``version``. The filter already reflects it, so if it was current it
+        stays current instead of being rebuilt."""
+        with self._lock:
+            entry = self._filters.get(server_id)
+            if entry is not None and entry.version is not None and entry.version == version - 1:
+                entry.version = version
+
+    def add(self, server_id, username):
+        with self._lock:
+            self._members[(server_id, username)] = time.monotonic() + self.ttl
+            self._members.move_to_end((server_id, username))
+            while len(self._members) > self.max_entries:
+                self._members.popitem(last=False)
+            entry = self._filters.get(server_id)
+            if entry is not None:
+                entry.bloom.add(username)
+                if entry.bloom.full:
+                    entry.version = None
+
+    def remove(self, server_id, username):
+        # The filter cannot drop a name; a deleted one just reads as "maybe"
+        # and falls through to the database.
+        with self._lock:
+            self._members.pop((server_id, username), None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._members),
+            "filters": len(self._filters),
+            "filter_builds": self.filter_builds,
+        }
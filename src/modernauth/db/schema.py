@@ -0,0 +1,14 @@
+from modernauth.db.engine import get_engine
+from modernauth.db.server_config import ServerConfig
+from modernauth.db.userdb import UserDB
+from modernauth.db.token_stores import SQLTokenStore
+from modernauth.db.sessions import SQLSessionStore
+
+
+def init_db(mysql_connection):
+    """Create every table in the main database, or upgrade older layouts in
+    place. Safe to run repeatedly."""
+    ServerConfig(mysql_connection=mysql_connection, hash_function=None).create_schema()
+    UserDB(mysql_connection=mysql_connection, hash_function=None, cache_size=0).create_schema()
+    SQLTokenStore(get_engine(mysql_connection)).create_schema()
+    SQLSessionStore(get_engine(mysql_connection)).create_schema()
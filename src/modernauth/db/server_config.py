@@ -1,25 +1,53 @@
-import json
-from sqlalchemy import create_engine, Table, Column, String, MetaData
+import json, time, threading
+from collections import OrderedDict
+from sqlalchemy import Table, Column, String, BigInteger, MetaData, bindparam, func, inspect
 from sqlalchemy.exc import SQLAlchemyError
-
-def make_engine_with_env_ssl(url):
-    return create_engine(
-        url=url.replace("mysql://", "mysql+pymysql://"),
-        echo=False
-    )
+from modernauth.db.engine import get_engine, get_async_engine
 
 
 class ServerConfig:
-    def __init__(self, mysql_connection, hash_function):
-        self.engine = make_engine_with_env_ssl(mysql_connection)
+    def __init__(self, mysql_connection, hash_function, cache_ttl=30, cache_size=10000):
+        self.mysql_connection = mysql_connection
+        self.engine = get_engine(mysql_connection).execution_options(modernauth_db="ServerConfig")
+        self._async_engine = None
         self.metadata = MetaData()
         self.create_hash = hash_function
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._listeners = []
+        self.hits = 0
+        self.misses = 0
         self.config_table = Table(
             'server_config', self.metadata,
             Column('server_id', String(255), primary_key=True, nullable=False),
-            Column('config', String(4096))
+            Column('config', String(4096)),
+            Column('updated_at', BigInteger, nullable=False, default=0)
         )
+
+    def create_schema(self):
+        """Create the table, or add columns missing from an older layout."""
         self.metadata.create_all(self.engine)
+        self._add_updated_at_column()
+
+    @property
+    def async_engine(self):
+        if self._async_engine is None:
+            self._async_engine = get_async_engine(self.mysql_connection).execution_options(
+                modernauth_db="ServerConfig")
+        return self._async_engine
+
+    def _add_updated_at_column(self):
+        try:
+            columns = {c['name'] for c in inspect(self.engine).get_columns('server_config')}
+            if 'updated_at' not in columns:
+                with self.engine.begin() as conn:
+                    conn.exec_driver_sql(
+                        "ALTER TABLE server_config ADD COLUMN updated_at BIGINT NOT NULL DEFAULT 0"
+                    )
+        except SQLAlchemyError:
+            pass
 
     def load(self):
         try:
@@ -37,28 +65,244 @@ class ServerConfig:
             return {}
 
     def save(self, config):
+        """Make the table match ``config``, touching only the servers that were
+        added, changed or removed, in one transaction."""
+        updated_at = time.time_ns()
+        wanted = {server_id: json.dumps(conf) for server_id, conf in config.items()}
         try:
             with self.engine.begin() as conn:
-                conn.execute(self.config_table.delete())
-                for server_id, conf in config.items():
-                    conf_json = json.dumps(conf)
-                    ins = self.config_table.insert().values(
-                        server_id=server_id,
-                        config=conf_json
+                stored = dict(conn.execute(
+                    self.config_table.select().with_only_columns(
+                        self.config_table.c.server_id, self.config_table.c.config)
+                ).all())
+                removed = [server_id for server_id in stored if server_id not in wanted]
+                added = [{"server_id": server_id, "config": conf_json, "updated_at": updated_at}
+                         for server_id, conf_json in wanted.items() if server_id not in stored]
+                changed = [{"b_server_id": server_id, "b_config": conf_json, "b_updated_at": updated_at}
+                           for server_id, conf_json in wanted.items()
+                           if server_id in stored and stored[server_id] != conf_json]
+                if removed:
+                    conn.execute(self.config_table.delete().where(self.config_table.c.server_id.in_(removed)))
+                if changed:
+                    conn.execute(
+                        self.config_table.update()
+                        .where(self.config_table.c.server_id == bindparam('b_server_id'))
+                        .values(config=bindparam('b_config'), updated_at=bindparam('b_updated_at')),
+                        changed
                     )
-                    conn.execute(ins)
-            return True
+                if added:
+                    conn.execute(self.config_table.insert(), added)
+        except SQLAlchemyError:
+            return False
+        for server_id in removed + [row["b_server_id"] for row in changed] + [row["server_id"] for row in added]:
+            self.invalidate(server_id)
+        return True
+
+    def upsert(self, server_id, conf):
+        """Insert or replace the config of a single server."""
+        values = {"config": json.dumps(conf), "updated_at": time.time_ns()}
+        try:
+            with self.engine.begin() as conn:
+                updated = conn.execute(
+                    self.config_table.update()
+                    .where(self.config_table.c.server_id == server_id)
+                    .values(**values)
+                ).rowcount
+                if updated == 0:
+                    conn.execute(self.config_table.insert().values(server_id=server_id, **values))
         except SQLAlchemyError:
             return False
+        self.invalidate(server_id)
+        return True
+
+    def delete(self, server_id):
+        """Remove a single server; return whether it existed."""
+        try:
+            with self.engine.begin() as conn:
+                deleted = conn.execute(
+                    self.config_table.delete().where(self.config_table.c.server_id == server_id)
+                ).rowcount
+        except SQLAlchemyError:
+            return False
+        self.invalidate(server_id)
+        return deleted == 1
+
+    def add_listener(self, callback):
+        """Call ``callback(server_id)`` whenever a cached config is found to
+        have changed. ``server_id`` is ``None`` when every entry was dropped."""
+        self._listeners.append(callback)
+
+    def _notify(self, server_id):
+        for callback in self._listeners:
+            callback(server_id)
+
+    def invalidate(self, server_id=None):
+        with self._cache_lock:
+            if server_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(server_id, None)
+        self._notify(server_id)
+
+    def _updated_at_query(self, server_id):
+        return (self.config_table.select()
+                .with_only_columns(self.config_table.c.updated_at)
+                .where(self.config_table.c.server_id == server_id))
+
+    def _row_query(self, server_id):
+        return self.config_table.select().where(self.config_table.c.server_id == server_id)
+
+    def _fresh(self, server_id, now):
+        """The cache entry for ``server_id`` and whether it can be served as is."""
+        with self._cache_lock:
+            entry = self._cache.get(server_id)
+            if entry is not None:
+                self._cache.move_to_end(server_id)
+        if entry is not None and now - entry[2] < self.cache_ttl:
+            self.hits += 1
+            return entry, True
+        self.misses += 1
+        return entry, False
+
+    def _touch(self, server_id, entry, now):
+        with self._cache_lock:
+            self._cache[server_id] = (entry[0], entry[1], now)
+            self._cache.move_to_end(server_id)
+        return entry[0]
+
+    def _remember(self, server_id, entry, row, now):
+        if entry is not None:
+            self._notify(server_id)
+        if row is None:
+            conf, updated_at = None, None
+        else:
+            try:
+                conf = json.loads(row['config'])
+            except Exception:
+                conf = {}
+            updated_at = row['updated_at']
+        with self._cache_lock:
+            self._cache[server_id] = (conf, updated_at, now)
+            self._cache.move_to_end(server_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return conf
+
+    def get(self, server_id):
+        """Return the config dict for ``server_id`` (or ``None``), served from
+        memory for ``cache_ttl`` seconds. Once an entry goes stale only its
+        ``updated_at`` is re-read; the config is decoded again only if it changed."""
+        now = time.monotonic()
+        entry, fresh = self._fresh(server_id, now)
+        if fresh:
+            return entry[0]
+        try:
+            with self.engine.connect() as conn:
+                if entry is not None:
+                    updated_at = conn.execute(self._updated_at_query(server_id)).scalar()
+                    if updated_at == entry[1]:
+                        return self._touch(server_id, entry, now)
+                row = conn.execute(self._row_query(server_id)).mappings().first()
+        except SQLAlchemyError:
+            return entry[0] if entry is not None else None
+        return self._remember(server_id, entry, row, now)
+
+    async def get_async(self, server_id):
+        """``get`` on the asyncio engine, sharing the same cache."""
+        now = time.monotonic()
+        entry, fresh = self._fresh(server_id, now)
+        if fresh:
+            return entry[0]
+        try:
+            async with self.async_engine.connect() as conn:
+                if entry is not None:
+                    updated_at = (await conn.execute(self._updated_at_query(server_id))).scalar()
+                    if updated_at == entry[1]:
+                        return self._touch(server_id, entry, now)
+                row = (await conn.execute(self._row_query(server_id))).mappings().first()
+        except SQLAlchemyError:
+            return entry[0] if entry is not None else None
+        return self._remember(server_id, entry, row, now)
 
     def get_secret(self, server_id):
-        config = self.load()
-        return config.get(server_id, {}).get("secret_key")
+        return (self.get(server_id) or {}).get("secret_key")
+
+    async def get_secret_async(self, server_id):
+        return (await self.get_async(server_id) or {}).get("secret_key")
 
     def update_secret(self, server_id, new_secret):
-        config = self.load()
-        if server_id in config:
-            config[server_id]["secret_key"] = self.create_hash(new_secret)
-            self.save(config)
-            return True
-        return False
\ No newline at end of file
+        """Replace one server's secret in a single UPDATE that edits the
+        stored JSON in place, so the server's other settings are kept and
+        nothing can change between a read and the write. Returns whether the
+        server exists."""
+        secret_hash = self.create_hash(new_secret)
+        config = self.config_table.c.config
+        try:
+            with self.engine.begin() as conn:
+                if conn.dialect.name in ("mysql", "mariadb", "sqlite"):
+                    updated = conn.execute(
+                        self.config_table.update()
+                        .where(self.config_table.c.server_id == server_id)
+                        .values(config=func.json_set(func.coalesce(config, "{}"), "$.secret_key", secret_hash),
+                                updated_at=time.time_ns())
+                    ).rowcount
+                else:
+                    updated = self._update_secret_compare_and_set(conn, server_id, secret_hash)
+        except SQLAlchemyError:
+            return False
+        self.invalidate(server_id)
+        return updated == 1
+
+    def _update_secret_compare_and_set(self, conn, server_id, secret_hash):
+        # For dialects without json_set: the UPDATE only applies if the row
+        # still holds what was read.
+        stored = conn.execute(
+            self.config_table.select()
+            .with_only_columns(self.config_table.c.config)
+            .where(self.config_table.c.server_id == server_id)
+        ).scalar()
+        if stored is None:
+            return 0
+        try:
+            conf = json.loads(stored)
+        except Exception:
+            conf = {}
+        conf["secret_key"] = secret_hash
+        return conn.execute(
+            self.config_table.update()
+            .where(
+                self.config_table.c.server_id == server_id,
+                self.config_table.c.config == stored
+            )
+            .values(config=json.dumps(conf), updated_at=time.time_ns())
+        ).rowcount
+
+    def rehash(self):
+        """Rewrite stored secret digests still in an older format. Returns the
+        number of servers converted."""
+        converted = 0
+        try:
+            with self.engine.begin() as conn:
+                rows = conn.execute(self.config_table.select()).mappings().all()
+                for row in rows:
+                    try:
+                        conf = json.loads(row['config'])
+                    except Exception:
+                        continue
+                    secret = conf.get("secret_key")
+                    if not secret or self.create_hash.is_current(secret):
+                        continue
+                    conf["secret_key"] = self.create_hash.upgrade(secret)
+                    conn.execute(
+                        self.config_table.update()
+                        .where(
+                            self.config_table.c.server_id == row['server_id'],
+                            self.config_table.c.config == row['config']
+                        )
+                        .values(config=json.dumps(conf), updated_at=time.time_ns())
+                    )
+                    converted += 1
+        except SQLAlchemyError:
+            return 0
+        self.invalidate()
+        return converted
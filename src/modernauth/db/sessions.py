@@ -0,0 +1,117 @@
+import os, time, json, tempfile
+from sqlalchemy import create_engine, Table, Column, Index, String, Text, BigInteger, MetaData
+from sqlalchemy.exc import SQLAlchemyError
+from modernauth.db.engine import get_engine, configure_sqlite
+from modernauth.db.sweeper import sweep_expired
+
+
+class SQLSessionStore:
+    """Server-side session data, one JSON row per session id. Expired
+    sessions are never returned, only removed by ``sweep``."""
+
+    def __init__(self, engine):
+        self.engine = engine.execution_options(modernauth_db="SessionStore")
+        self.metadata = MetaData()
+        self.sessions = Table(
+            'sessions', self.metadata,
+            Column('id', String(64), primary_key=True, nullable=False),
+            Column('data', Text, nullable=False),
+            Column('expires_at', BigInteger, nullable=False),
+            Index('ix_sessions_expires_at', 'expires_at')
+        )
+
+    def create_schema(self):
+        self.metadata.create_all(self.engine)
+
+    def get(self, sid):
+        """Return ``(data, expires_at)`` for a live session, else ``None``."""
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(
+                    self.sessions.select()
+                    .with_only_columns(self.sessions.c.data, self.sessions.c.expires_at)
+                    .where(self.sessions.c.id == sid, self.sessions.c.expires_at > int(time.time()))
+                ).first()
+        except SQLAlchemyError:
+            return None
+        if row is None:
+            return None
+        try:
+            return json.loads(row.data), row.expires_at
+        except ValueError:
+            return None
+
+    def put(self, sid, data, expires_at):
+        values = {"data": json.dumps(data, separators=(",", ":")), "expires_at": int(expires_at)}
+        try:
+            with self.engine.begin() as conn:
+                updated = conn.execute(
+                    self.sessions.update().where(self.sessions.c.id == sid).values(**values)
+                ).rowcount
+                if updated == 0:
+                    conn.execute(self.sessions.insert().values(id=sid, **values))
+        except SQLAlchemyError:
+            return False
+        return True
+
+    def touch(self, sid, expires_at):
+        """Push back the expiry of a live session without rewriting it."""
+        try:
+            with self.engine.begin() as conn:
+                return conn.execute(
+                    self.sessions.update()
+                    .where(self.sessions.c.id == sid, self.sessions.c.expires_at > int(time.time()))
+                    .values(expires_at=int(expires_at))
+                ).rowcount == 1
+        except SQLAlchemyError:
+            return False
+
+    def delete(self, sid):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(self.sessions.delete().where(self.sessions.c.id == sid))
+        except SQLAlchemyError:
+            pass
+
+    def sweep(self, batch_size):
+        """Remove up to ``batch_size`` expired sessions; return how many went."""
+        now = int(time.time())
+        with self.engine.begin() as conn:
+            expired = conn.execute(
+                self.sessions.select().with_only_columns(self.sessions.c.id)
+                .where(self.sessions.c.expires_at <= now)
+                .limit(batch_size)
+            ).scalars().all()
+            if not expired:
+                return 0
+            return conn.execute(
+                self.sessions.delete().where(
+                    self.sessions.c.id.in_(expired),
+                    self.sessions.c.expires_at <= now
+                )
+            ).rowcount
+
+    def sweep_expired(self, batch_size=1000, max_batches=None):
+        """Delete expired sessions in batches of at most ``batch_size`` rows.
+        Returns ``(removed, elapsed_seconds)``."""
+        return sweep_expired(self.sweep, batch_size, max_batches)
+
+
+class SQLiteSessionStore(SQLSessionStore):
+    """Session table in a local SQLite file in WAL mode, shared by every
+    worker process on the host and created on first use."""
+
+    def __init__(self, path, busy_timeout=5000):
+        self.path = path
+        super().__init__(configure_sqlite(create_engine(f"sqlite:///{path}", echo=False), busy_timeout))
+        self.create_schema()
+
+
+def make_session_store(backend, mysql_connection=None, path=None):
+    """Build the session store named by ``backend``: ``sql`` (the main
+    database) or ``sqlite`` (a host-local file)."""
+    if backend == "sql":
+        return SQLSessionStore(get_engine(mysql_connection))
+    if backend == "sqlite":
+        return SQLiteSessionStore(path or os.path.join(tempfile.gettempdir(), "modernauth-sessions.db"))
+    raise ValueError(f"Unknown session store backend: {backend!r}")
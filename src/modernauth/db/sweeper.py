@@ -0,0 +1,56 @@
+import logging, threading, time
+from sqlalchemy.exc import SQLAlchemyError
+from modernauth import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_expired(sweep, batch_size=1000, max_batches=None):
+    """Call ``sweep(batch_size)``, which deletes up to ``batch_size`` expired
+    rows and returns how many went, until a batch comes back short. Returns
+    ``(removed, elapsed_seconds)``."""
+    started = time.perf_counter()
+    removed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        try:
+            swept = sweep(batch_size)
+        except SQLAlchemyError:
+            break
+        removed += swept
+        batches += 1
+        if swept < batch_size:
+            break
+    return removed, time.perf_counter() - started
+
+
+class ExpirySweeper(threading.Thread):
+    """Background thread that periodically calls ``target.sweep_expired`` to
+    remove expired rows; ``what`` names them in the thread name and log."""
+
+    def __init__(self, target, what, interval=60, batch_size=1000, max_batches=10):
+        super().__init__(name=f"modernauth-{what}-sweeper", daemon=True)
+        self.target = target
+        self.what = what
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sweep_once()
+
+    def sweep_once(self):
+        """Run one sweep and publish its result on ``/metrics``."""
+        removed, elapsed = self.target.sweep_expired(
+            batch_size=self.batch_size,
+            max_batches=self.max_batches
+        )
+        metrics.expired_rows_swept.inc(self.what, amount=removed)
+        metrics.sweep_latency.observe(elapsed, self.what)
+        logger.info("Swept %d expired %s in %.3fs", removed, self.what, elapsed)
+        return removed
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,577 @@
+import os, time, json, asyncio, functools, tempfile, threading
+from abc import ABC, abstractmethod
+from sqlalchemy import (
+    create_engine, bindparam, Table, Column, Index, String, BigInteger, Boolean, MetaData, inspect
+)
+from sqlalchemy.exc import SQLAlchemyError
+from modernauth.db.engine import get_engine, get_async_engine, configure_sqlite
+from modernauth.hashing import CURRENT_PREFIX
+
+LEGACY_TABLE = 'tokensystem_legacy'
+
+
+class TokenStore(ABC):
+    """Storage for login tokens, keyed by the already-hashed token.
+
+    Token data is returned as a dict with ``username``, ``server_id``,
+    ``expiration_time`` and ``authorized`` plus any extra keys. Expired
+    tokens are never returned, only removed by ``sweep``.
+    """
+
+    def create_schema(self):
+        """Create or upgrade whatever storage the backend needs."""
+
+    @abstractmethod
+    def put(self, htok, username, server_id, expires_at, authorized=False, extra=None, replace=True):
+        """Store a token. With ``replace=False`` an existing token is left
+        alone and ``False`` is returned."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, htok):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, htok):
+        raise NotImplementedError
+
+    @abstractmethod
+    def authorize(self, htok):
+        """Mark an unexpired token authorized; return whether one matched."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def consume(self, htok, server_id, keep_spent=False):
+        """Atomically remove an authorized token and return its data. With
+        ``keep_spent`` the token is marked unauthorized instead of removed."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def consume_many(self, htoks, server_id, keep_spent=False):
+        """Batch ``consume``; returns ``{htok: username}`` for the tokens won."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def sweep(self, batch_size):
+        """Remove up to ``batch_size`` expired tokens; return how many went."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def rehash(self, upgrade, batch_size):
+        """Replace every key not in the current digest format with
+        ``upgrade(key)``; return how many were converted."""
+        raise NotImplementedError
+
+    # Used by the ASGI routes. Backends without an asyncio driver run the
+    # blocking call in the event loop's default executor.
+
+    async def _in_thread(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+    async def put_async(self, htok, username, server_id, expires_at, authorized=False, extra=None, replace=True):
+        return await self._in_thread(self.put, htok, username, server_id, expires_at,
+                                     authorized=authorized, extra=extra, replace=replace)
+
+    async def get_async(self, htok):
+        return await self._in_thread(self.get, htok)
+
+    async def consume_async(self, htok, server_id, keep_spent=False):
+        return await self._in_thread(self.consume, htok, server_id, keep_spent=keep_spent)
+
+    async def consume_many_async(self, htoks, server_id, keep_spent=False):
+        return await self._in_thread(self.consume_many, htoks, server_id, keep_spent=keep_spent)
+
+    def authorized(self, htoks):
+        """The subset of ``htoks`` that are authorized and unexpired."""
+        return {htok for htok in htoks if (self.get(htok) or {}).get("authorized")}
+
+    async def authorized_async(self, htoks):
+        return await self._in_thread(self.authorized, htoks)
+
+
+def _token_data(username, server_id, expires_at, authorized, extra):
+    token_data = {}
+    if extra:
+        try:
+            token_data.update(json.loads(extra))
+        except Exception:
+            pass
+    token_data.update({
+        "username": username,
+        "server_id": server_id,
+        "expiration_time": expires_at,
+        "authorized": bool(authorized)
+    })
+    return token_data
+
+
+class SQLTokenStore(TokenStore):
+    def __init__(self, engine):
+        self.engine = engine.execution_options(modernauth_db="TokenSystemDB")
+        self.metadata = MetaData()
+        self.tokens = Table(
+            'tokensystem', self.metadata,
+            Column('token', String(255), primary_key=True, nullable=False),
+            Column('username', String(255), nullable=False),
+            Column('server_id', String(255), nullable=False),
+            Column('expires_at', BigInteger, nullable=False),
+            Column('authorized', Boolean, nullable=False, default=False),
+            Column('extra', String(4096))
+        )
+        self.expires_index = Index('ix_tokensystem_expires_at', self.tokens.c.expires_at)
+        self._async_engine = None
+
+    @property
+    def async_engine(self):
+        if self._async_engine is None:
+            self._async_engine = self._make_async_engine().execution_options(modernauth_db="TokenSystemDB")
+        return self._async_engine
+
+    def _make_async_engine(self):
+        return get_async_engine(self.engine.url)
+
+    def create_schema(self):
+        self.migrate_legacy_layout()
+        self.metadata.create_all(self.engine)
+        try:
+            self.expires_index.create(self.engine, checkfirst=True)
+        except SQLAlchemyError:
+            pass
+
+    def _row_to_data(self, row):
+        return _token_data(row['username'], row['server_id'], row['expires_at'],
+                           row['authorized'], row['extra'])
+
+    def migrate_legacy_layout(self):
+        """Convert a ``tokensystem`` table using the old JSON ``data`` column
+        into the typed layout. Returns the number of rows carried over, or
+        ``None`` if there was nothing to migrate."""
+        try:
+            columns = {c['name'] for c in inspect(self.engine).get_columns('tokensystem')}
+        except SQLAlchemyError:
+            return None
+        if 'data' not in columns or 'username' in columns:
+            return None
+        legacy = Table(
+            LEGACY_TABLE, MetaData(),
+            Column('token', String(255), primary_key=True, nullable=False),
+            Column('data', String(4096))
+        )
+        now = time.time()
+        migrated = 0
+        try:
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE tokensystem RENAME TO {LEGACY_TABLE}")
+            self.tokens.create(self.engine, checkfirst=True)
+            with self.engine.begin() as conn:
+                rows = []
+                for row in conn.execute(legacy.select()).mappings():
+                    try:
+                        token_data = json.loads(row['data'])
+                    except Exception:
+                        continue
+                    expires_at = token_data.pop("expiration_time", 0)
+                    if expires_at <= now or "username" not in token_data:
+                        continue
+                    rows.append({
+                        "token": row['token'],
+                        "username": token_data.pop("username"),
+                        "server_id": token_data.pop("server_id", ""),
+                        "expires_at": int(expires_at),
+                        "authorized": bool(token_data.pop("authorized", False)),
+                        "extra": json.dumps(token_data) if token_data else None
+                    })
+                if rows:
+                    conn.execute(self.tokens.insert(), rows)
+                migrated = len(rows)
+                legacy.drop(conn)
+        except SQLAlchemyError:
+            return None
+        return migrated
+
+    def _put_statements(self, htok, username, server_id, expires_at, authorized, extra, replace):
+        statements = [self.tokens.delete().where(self.tokens.c.token == htok)] if replace else []
+        statements.append(
+            self.tokens.insert().values(
+                token=htok,
+                username=username,
+                server_id=server_id,
+                expires_at=int(expires_at),
+                authorized=authorized,
+                extra=json.dumps(extra) if extra else None
+            )
+        )
+        return statements
+
+    def _live_query(self, htok):
+        return self.tokens.select().where(
+            self.tokens.c.token == htok,
+            self.tokens.c.expires_at > int(time.time())
+        )
+
+    def put(self, htok, username, server_id, expires_at, authorized=False, extra=None, replace=True):
+        try:
+            with self.engine.begin() as conn:
+                for statement in self._put_statements(htok, username, server_id, expires_at,
+                                                      authorized, extra, replace):
+                    conn.execute(statement)
+        except SQLAlchemyError:
+            return False
+        return True
+
+    def get(self, htok):
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(self._live_query(htok)).mappings().first()
+        except SQLAlchemyError:
+            return None
+        return self._row_to_data(row) if row else None
+
+    def delete(self, htok):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(self.tokens.delete().where(self.tokens.c.token == htok))
+        except SQLAlchemyError:
+            pass
+
+    def authorize(self, htok):
+        try:
+            with self.engine.begin() as conn:
+                return conn.execute(
+                    self.tokens.update().where(
+                        self.tokens.c.token == htok,
+                        self.tokens.c.expires_at > int(time.time())
+                    ).values(authorized=True)
+                ).rowcount == 1
+        except SQLAlchemyError:
+            return False
+
+    def _authorized_row(self, htok, server_id, now):
+        return (
+            (self.tokens.c.token == htok) &
+            (self.tokens.c.server_id == server_id) &
+            (self.tokens.c.authorized == True) &
+            (self.tokens.c.expires_at > now)
+        )
+
+    def _consume(self, htok, server_id, now, keep_spent):
+        condition = self._authorized_row(htok, server_id, now)
+        if keep_spent:
+            return self.tokens.update().where(condition).values(authorized=False)
+        return self.tokens.delete().where(condition)
+
+    def _authorized_rows(self, htoks, server_id, now):
+        return (
+            self.tokens.c.token.in_(htoks) &
+            (self.tokens.c.server_id == server_id) &
+            (self.tokens.c.authorized == True) &
+            (self.tokens.c.expires_at > now)
+        )
+
+    def _consume_many(self, htoks, server_id, now, keep_spent):
+        condition = self._authorized_rows(htoks, server_id, now)
+        if keep_spent:
+            return self.tokens.update().where(condition).values(authorized=False)
+        return self.tokens.delete().where(condition)
+
+    def _consume_many_returning(self, dialect, htoks, server_id, now, keep_spent):
+        """``_consume_many`` returning the token and username of each row it
+        took, or ``None`` if the dialect has no RETURNING for it (MySQL, or
+        any dialect on SQLAlchemy 1.4, which lacks these flags)."""
+        if not getattr(dialect, "update_returning" if keep_spent else "delete_returning", False):
+            return None
+        return self._consume_many(htoks, server_id, now, keep_spent).returning(
+            self.tokens.c.token, self.tokens.c.username)
+
+    def _lock_authorized_rows(self, htoks, server_id, now):
+        return (
+            self.tokens.select()
+            .with_only_columns(self.tokens.c.token, self.tokens.c.username)
+            .where(self._authorized_rows(htoks, server_id, now))
+            .with_for_update()
+        )
+
+    def consume(self, htok, server_id, keep_spent=False):
+        # The DELETE repeats every condition, so only the caller whose
+        # statement actually hits the row wins a concurrent race.
+        now = int(time.time())
+        try:
+            with self.engine.begin() as conn:
+                row = conn.execute(
+                    self.tokens.select().where(self._authorized_row(htok, server_id, now))
+                ).mappings().first()
+                if row is None:
+                    return None
+                deleted = conn.execute(self._consume(htok, server_id, now, keep_spent)).rowcount
+        except SQLAlchemyError:
+            return None
+        return self._row_to_data(row) if deleted == 1 else None
+
+    def consume_many(self, htoks, server_id, keep_spent=False):
+        # One statement takes every token: DELETE ... RETURNING where the
+        # dialect has it, otherwise the rows are locked first so the DELETE
+        # takes exactly the ones selected.
+        htoks = list(htoks)
+        if not htoks:
+            return {}
+        now = int(time.time())
+        try:
+            with self.engine.begin() as conn:
+                statement = self._consume_many_returning(conn.dialect, htoks, server_id, now, keep_spent)
+                if statement is not None:
+                    return dict(conn.execute(statement).all())
+                rows = conn.execute(self._lock_authorized_rows(htoks, server_id, now)).all()
+                if rows:
+                    conn.execute(self._consume_many([token for token, _ in rows], server_id, now, keep_spent))
+        except SQLAlchemyError:
+            return {}
+        return dict(rows)
+
+    async def put_async(self, htok, username, server_id, expires_at, authorized=False, extra=None, replace=True):
+        try:
+            async with self.async_engine.begin() as conn:
+                for statement in self._put_statements(htok, username, server_id, expires_at,
+                                                      authorized, extra, replace):
+                    await conn.execute(statement)
+        except SQLAlchemyError:
+            return False
+        return True
+
+    async def get_async(self, htok):
+        try:
+            async with self.async_engine.connect() as conn:
+                row = (await conn.execute(self._live_query(htok))).mappings().first()
+        except SQLAlchemyError:
+            return None
+        return self._row_to_data(row) if row else None
+
+    async def consume_async(self, htok, server_id, keep_spent=False):
+        now = int(time.time())
+        try:
+            async with self.async_engine.begin() as conn:
+                row = (await conn.execute(
+                    self.tokens.select().where(self._authorized_row(htok, server_id, now))
+                )).mappings().first()
+                if row is None:
+                    return None
+                deleted = (await conn.execute(self._consume(htok, server_id, now, keep_spent))).rowcount
+        except SQLAlchemyError:
+            return None
+        return self._row_to_data(row) if deleted == 1 else None
+
+    async def consume_many_async(self, htoks, server_id, keep_spent=False):
+        htoks = list(htoks)
+        if not htoks:
+            return {}
+        now = int(time.time())
+        try:
+            async with self.async_engine.begin() as conn:
+                statement = self._consume_many_returning(conn.dialect, htoks, server_id, now, keep_spent)
+                if statement is not None:
+                    return dict((await conn.execute(statement)).all())
+                rows = (await conn.execute(self._lock_authorized_rows(htoks, server_id, now))).all()
+                if rows:
+                    await conn.execute(self._consume_many([token for token, _ in rows], server_id, now, keep_spent))
+        except SQLAlchemyError:
+            return {}
+        return dict(rows)
+
+    async def authorized_async(self, htoks, chunk_size=500):
+        now = int(time.time())
+        found = set()
+        async with self.async_engine.connect() as conn:
+            for i in range(0, len(htoks), chunk_size):
+                result = await conn.execute(
+                    self.tokens.select().with_only_columns(self.tokens.c.token).where(
+                        self.tokens.c.token.in_(htoks[i:i + chunk_size]),
+                        self.tokens.c.authorized == True,
+                        self.tokens.c.expires_at > now
+                    )
+                )
+                found.update(result.scalars())
+        return found
+
+    def sweep(self, batch_size):
+        # MySQL rejects LIMIT inside an IN subquery and SQLite has no
+        # DELETE ... LIMIT, so select the batch first.
+        now = int(time.time())
+        with self.engine.begin() as conn:
+            expired = conn.execute(
+                self.tokens.select().with_only_columns(self.tokens.c.token)
+                .where(self.tokens.c.expires_at <= now)
+                .limit(batch_size)
+            ).scalars().all()
+            if not expired:
+                return 0
+            return conn.execute(
+                self.tokens.delete().where(
+                    self.tokens.c.token.in_(expired),
+                    self.tokens.c.expires_at <= now
+                )
+            ).rowcount
+
+    def rehash(self, upgrade, batch_size):
+        # Walk the primary key so each batch is an index range scan.
+        converted = 0
+        last = ""
+        rename = self.tokens.update().where(self.tokens.c.token == bindparam('old_token')).values(
+            token=bindparam('new_token'))
+        while True:
+            with self.engine.begin() as conn:
+                legacy = conn.execute(
+                    self.tokens.select().with_only_columns(self.tokens.c.token)
+                    .where(
+                        self.tokens.c.token > last,
+                        ~self.tokens.c.token.startswith(CURRENT_PREFIX, autoescape=True)
+                    )
+                    .order_by(self.tokens.c.token)
+                    .limit(batch_size)
+                ).scalars().all()
+                if not legacy:
+                    return converted
+                conn.execute(rename, [{"old_token": t, "new_token": upgrade(t)} for t in legacy])
+            converted += len(legacy)
+            last = legacy[-1]
+
+
+class SQLiteTokenStore(SQLTokenStore):
+    """Token table in a local SQLite file in WAL mode, shared by every worker
+    process on the host. The file is host-local, so its table is created on
+    first use rather than by ``init-db``."""
+
+    def __init__(self, path, busy_timeout=5000):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        super().__init__(configure_sqlite(create_engine(f"sqlite:///{path}", echo=False), busy_timeout))
+        self.create_schema()
+
+    def _make_async_engine(self):
+        from sqlalchemy.ext.asyncio import create_async_engine
+        engine = create_async_engine(f"sqlite+aiosqlite:///{self.path}", echo=False)
+        configure_sqlite(engine.sync_engine, self.busy_timeout)
+        return engine
+
+
+class MemoryTokenStore(TokenStore):
+    """Process-local token store, for tests and single-process runs."""
+
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def _live(self, htok, now):
+        row = self._rows.get(htok)
+        if row is not None and row["expires_at"] > now:
+            return row
+        return None
+
+    def _authorized(self, htok, server_id, now):
+        row = self._live(htok, now)
+        if row is not None and row["server_id"] == server_id and row["authorized"]:
+            return row
+        return None
+
+    @staticmethod
+    def _to_data(row):
+        return _token_data(row["username"], row["server_id"], row["expires_at"],
+                           row["authorized"], row["extra"])
+
+    def put(self, htok, username, server_id, expires_at, authorized=False, extra=None, replace=True):
+        with self._lock:
+            if not replace and htok in self._rows:
+                return False
+            self._rows[htok] = {
+                "username": username,
+                "server_id": server_id,
+                "expires_at": int(expires_at),
+                "authorized": authorized,
+                "extra": json.dumps(extra) if extra else None
+            }
+        return True
+
+    def get(self, htok):
+        with self._lock:
+            row = self._live(htok, int(time.time()))
+            return self._to_data(row) if row else None
+
+    def delete(self, htok):
+        with self._lock:
+            self._rows.pop(htok, None)
+
+    def authorize(self, htok):
+        with self._lock:
+            row = self._live(htok, int(time.time()))
+            if row is None:
+                return False
+            row["authorized"] = True
+            return True
+
+    def _take(self, htok, row, keep_spent):
+        if keep_spent:
+            row["authorized"] = False
+        else:
+            del self._rows[htok]
+
+    def consume(self, htok, server_id, keep_spent=False):
+        with self._lock:
+            row = self._authorized(htok, server_id, int(time.time()))
+            if row is None:
+                return None
+            token_data = self._to_data(row)
+            self._take(htok, row, keep_spent)
+            return token_data
+
+    def consume_many(self, htoks, server_id, keep_spent=False):
+        now = int(time.time())
+        consumed = {}
+        with self._lock:
+            for htok in htoks:
+                row = self._authorized(htok, server_id, now)
+                if row is not None:
+                    consumed[htok] = row["username"]
+                    self._take(htok, row, keep_spent)
+        return consumed
+
+    def sweep(self, batch_size):
+        now = int(time.time())
+        with self._lock:
+            expired = [h for h, row in self._rows.items() if row["expires_at"] <= now][:batch_size]
+            for htok in expired:
+                del self._rows[htok]
+        return len(expired)
+
+    # Nothing here blocks, so the async forms skip the executor.
+
+    async def put_async(self, *args, **kwargs):
+        return self.put(*args, **kwargs)
+
+    async def get_async(self, htok):
+        return self.get(htok)
+
+    async def consume_async(self, htok, server_id, keep_spent=False):
+        return self.consume(htok, server_id, keep_spent=keep_spent)
+
+    async def consume_many_async(self, htoks, server_id, keep_spent=False):
+        return self.consume_many(htoks, server_id, keep_spent=keep_spent)
+
+    async def authorized_async(self, htoks):
+        return self.authorized(htoks)
+
+    def rehash(self, upgrade, batch_size):
+        with self._lock:
+            legacy = [h for h in self._rows if not h.startswith(CURRENT_PREFIX)]
+            for htok in legacy:
+                self._rows[upgrade(htok)] = self._rows.pop(htok)
+        return len(legacy)
+
+
+def make_token_store(backend, mysql_connection=None, path=None):
+    """Build the token store named by ``backend``: ``sql`` (the main database),
+    ``sqlite`` (a host-local file) or ``memory``."""
+    if backend == "sql":
+        return SQLTokenStore(get_engine(mysql_connection))
+    if backend == "sqlite":
+        return SQLiteTokenStore(path or os.path.join(tempfile.gettempdir(), "modernauth-tokens.db"))
+    if backend == "memory":
+        return MemoryTokenStore()
+    raise ValueError(f"Unknown token store backend: {backend!r}")
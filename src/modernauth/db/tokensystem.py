@@ -1,107 +1,233 @@
-import time, json
-from sqlalchemy import create_engine, Table, Column, String, MetaData
+import time, asyncio, threading
 from sqlalchemy.exc import SQLAlchemyError
+from modernauth.db.token_stores import make_token_store
+from modernauth.db.sweeper import ExpirySweeper, sweep_expired
 
-def make_engine_with_env_ssl(url):
-    return create_engine(
-        url=url.replace("mysql://", "mysql+pymysql://"),
-        echo=False
-    )
+
+class _Waiter:
+    """Wakes everything waiting on one token: each thread blocks on its own
+    ``threading.Event`` in ``events``, coroutines register their loop and an
+    ``asyncio.Event`` in ``async_events``."""
+
+    def __init__(self):
+        self.count = 0
+        self.events = set()
+        self.async_events = set()
+
+    def set(self):
+        for event in list(self.events):
+            event.set()
+        for loop, event in list(self.async_events):
+            loop.call_soon_threadsafe(event.set)
 
 
 class TokenSystemDB:
-    def __init__(self, mysql_connection, hash_function):
-        self.engine = make_engine_with_env_ssl(mysql_connection)
-        self.metadata = MetaData()
+    def __init__(self, mysql_connection, hash_function, backend="sql", store_path=None, store=None):
+        self.store = store or make_token_store(backend, mysql_connection, path=store_path)
         self.hash = hash_function
-        self.tokens = Table(
-            'tokensystem', self.metadata,
-            Column('token', String(255), primary_key=True, nullable=False),
-            Column('data', String(4096))
-        )
-        self.metadata.create_all(self.engine)
+        self._waiters = {}
+        self._waiters_lock = threading.Lock()
+        self._async_pollers = {}
+
+    def create_schema(self):
+        self.store.create_schema()
 
     def _h(self, token: str) -> str:
+        # Only the digest written today. Tokens live for minutes, so unlike
+        # users and secrets they get no legacy fallback: every miss would
+        # cost a second lookup. ``rehash`` converts the ones in flight.
         return self.hash(token)
 
-    def load(self):
-        data = {}
-        try:
-            with self.engine.connect() as conn:
-                for row in conn.execute(self.tokens.select()).mappings():
-                    try:
-                        token_data = json.loads(row['data'])
-                    except Exception:
-                        token_data = {}
-                    data[row['token']] = token_data
-        except SQLAlchemyError:
-            return {}
-        return data
-
-    def save(self, data):
-        try:
-            with self.engine.begin() as conn:
-                conn.execute(self.tokens.delete())
-                for htok, token_data in data.items():
-                    ins = self.tokens.insert().values(
-                        token=htok,
-                        data=json.dumps(token_data)
-                    )
-                    conn.execute(ins)
-            return True
-        except SQLAlchemyError:
-            return False
-
-    def _purge_expired_tokens(self, data):
-        now = time.time()
-        return {k: v for k, v in data.items() if v.get("expiration_time", 0) > now}
-
     def create_token(self, username, token, server_id, ttl=600, extra_data=None):
-        htok = self._h(token)
-        data = self.load()
-        data = self._purge_expired_tokens(data)
-        token_data = {
-            "username": username,
-            "server_id": server_id,
-            "expiration_time": time.time() + ttl,
-            "authorized": False
-        }
-        if extra_data:
-            token_data.update(extra_data)
-        data[htok] = token_data
-        self.save(data)
+        self.store.put(self._h(token), username, server_id, time.time() + ttl, extra=extra_data)
         return token
 
-    def remove_token(self, token):
+    def grant_token(self, token, username, server_id, expires_at):
+        """Record that a stateless token was authorized. The row doubles as a
+        replay guard until ``expires_at``, so a token can be granted only once."""
         htok = self._h(token)
-        data = self.load()
-        if htok in data:
-            del data[htok]
-            self.save(data)
+        if not self.store.put(htok, username, server_id, expires_at, authorized=True, replace=False):
+            return False
+        self._notify_waiters(htok)
+        return True
+
+    def remove_token(self, token):
+        self.store.delete(self._h(token))
+
+    def sweep_expired(self, batch_size=1000, max_batches=None):
+        """Delete expired tokens in batches of at most ``batch_size`` rows.
+        Returns ``(removed, elapsed_seconds)``."""
+        return sweep_expired(self.store.sweep, batch_size, max_batches)
 
     def purge_expired_tokens(self):
-        data = self.load()
-        data = self._purge_expired_tokens(data)
-        self.save(data)
+        removed, _ = self.sweep_expired()
+        return removed
 
     def check_token(self, token):
-        htok = self._h(token)
-        data = self.load()
-        data = self._purge_expired_tokens(data)
-        self.save(data)
-        return data[htok]["username"] if htok in data else None
+        token_data = self.get_token_data(token)
+        return token_data["username"] if token_data else None
 
     def get_token_data(self, token):
-        htok = self._h(token)
-        data = self.load()
-        data = self._purge_expired_tokens(data)
-        self.save(data)
-        return data.get(htok)
+        return self.store.get(self._h(token))
+
+    def consume_if_authorized(self, server_id, token, keep_spent=False):
+        """Atomically delete ``token`` if it is authorized for ``server_id`` and
+        return its data; otherwise return ``None``. With ``keep_spent`` the
+        token is only marked unauthorized, so a granted stateless token cannot
+        be granted again before it expires."""
+        return self.store.consume(self._h(token), server_id, keep_spent=keep_spent)
+
+    def consume_authorized(self, server_id, tokens, keep_spent=False):
+        """Batch form of ``consume_if_authorized`` run in one transaction.
+        Returns ``{token: username}`` for the tokens this call consumed."""
+        hashed = {self._h(token): token for token in tokens}
+        consumed = self.store.consume_many(list(hashed), server_id, keep_spent=keep_spent)
+        return {hashed[htok]: username for htok, username in consumed.items()}
 
     def authorize_token(self, token):
+        """Mark ``token`` authorized with one conditional update. Returns whether
+        an unexpired token matched."""
         htok = self._h(token)
-        data = self.load()
-        data = self._purge_expired_tokens(data)
-        if htok in data:
-            data[htok]["authorized"] = True
-            self.save(data)
\ No newline at end of file
+        applied = self.store.authorize(htok)
+        if applied:
+            self._notify_waiters(htok)
+        return applied
+
+    def rehash(self, batch_size=1000):
+        """Rewrite stored token keys still in an older digest format. Returns
+        the number of rows converted."""
+        return self.store.rehash(self.hash.upgrade, batch_size)
+
+    def _notify_waiters(self, htok):
+        with self._waiters_lock:
+            waiter = self._waiters.get(htok)
+        if waiter is not None:
+            waiter.set()
+
+    def _add_waiter(self, htok, event=None, async_event=None):
+        with self._waiters_lock:
+            waiter = self._waiters.get(htok)
+            if waiter is None:
+                waiter = self._waiters[htok] = _Waiter()
+            waiter.count += 1
+            if event is not None:
+                waiter.events.add(event)
+            if async_event is not None:
+                waiter.async_events.add(async_event)
+        return waiter
+
+    def _remove_waiter(self, htok, waiter, event=None, async_event=None):
+        with self._waiters_lock:
+            waiter.events.discard(event)
+            waiter.async_events.discard(async_event)
+            waiter.count -= 1
+            if waiter.count == 0:
+                self._waiters.pop(htok, None)
+
+    def wait_for_authorization(self, token, timeout, server_id=None, poll_interval=1.0,
+                               require_row=True):
+        """Block until ``token`` is authorized or ``timeout`` seconds pass and
+        return its data, or ``None`` for an unknown token. Authorizations made in
+        this process wake the waiter at once; those made by other workers are
+        picked up by re-reading the row every ``poll_interval`` seconds.
+        Stateless tokens have no row until granted, so pass
+        ``require_row=False`` to keep waiting for one."""
+        htok = self._h(token)
+        deadline = time.monotonic() + timeout
+        woken = threading.Event()
+        waiter = self._add_waiter(htok, event=woken)
+        try:
+            while True:
+                token_data = self.get_token_data(token)
+                if token_data and server_id is not None and token_data.get("server_id") != server_id:
+                    return None
+                if not token_data and require_row:
+                    return None
+                remaining = deadline - time.monotonic()
+                if (token_data and token_data.get("authorized")) or remaining <= 0:
+                    return token_data
+                woken.wait(min(poll_interval, remaining))
+                woken.clear()
+        finally:
+            self._remove_waiter(htok, waiter, event=woken)
+
+    # Async forms for the ASGI /api routes.
+
+    async def create_token_async(self, username, token, server_id, ttl=600, extra_data=None):
+        await self.store.put_async(self._h(token), username, server_id, time.time() + ttl, extra=extra_data)
+        return token
+
+    async def get_token_data_async(self, token):
+        return await self.store.get_async(self._h(token))
+
+    async def consume_if_authorized_async(self, server_id, token, keep_spent=False):
+        return await self.store.consume_async(self._h(token), server_id, keep_spent=keep_spent)
+
+    async def consume_authorized_async(self, server_id, tokens, keep_spent=False):
+        hashed = {self._h(token): token for token in tokens}
+        consumed = await self.store.consume_many_async(list(hashed), server_id, keep_spent=keep_spent)
+        return {hashed[htok]: username for htok, username in consumed.items()}
+
+    async def wait_for_authorization_async(self, token, timeout, server_id=None, poll_interval=1.0,
+                                           require_row=True):
+        """``wait_for_authorization`` without holding a thread. Instead of
+        each waiter re-reading its own row, one task per event loop checks
+        every awaited token with a single query each ``poll_interval``, so
+        thousands of pending polls cost one coroutine each."""
+        htok = self._h(token)
+        deadline = time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        async_event = (loop, woken)
+        waiter = self._add_waiter(htok, async_event=async_event)
+        with self._waiters_lock:
+            if loop not in self._async_pollers:
+                self._async_pollers[loop] = loop.create_task(self._poll_waiters(loop, poll_interval))
+        try:
+            while True:
+                token_data = await self.get_token_data_async(token)
+                if token_data and server_id is not None and token_data.get("server_id") != server_id:
+                    return None
+                if not token_data and require_row:
+                    return None
+                remaining = deadline - time.monotonic()
+                if (token_data and token_data.get("authorized")) or remaining <= 0:
+                    return token_data
+                try:
+                    await asyncio.wait_for(woken.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                woken.clear()
+        finally:
+            self._remove_waiter(htok, waiter, async_event=async_event)
+
+    async def _poll_waiters(self, loop, poll_interval):
+        # Picks up authorizations made by other workers; those made in this
+        # process wake their waiters directly. Exits once nobody is waiting.
+        while True:
+            await asyncio.sleep(poll_interval)
+            with self._waiters_lock:
+                waiting = {}
+                for htok, waiter in self._waiters.items():
+                    events = [event for owner, event in waiter.async_events if owner is loop]
+                    if events:
+                        waiting[htok] = events
+                if not waiting:
+                    self._async_pollers.pop(loop, None)
+                    return
+            try:
+                authorized = await self.store.authorized_async(list(waiting))
+            except SQLAlchemyError:
+                continue
+            for htok in authorized:
+                for event in waiting[htok]:
+                    event.set()
+
+
+class TokenSweeper(ExpirySweeper):
+    """Background thread that periodically removes expired tokens."""
+
+    def __init__(self, tokens_db, interval=60, batch_size=1000, max_batches=10):
+        super().__init__(tokens_db, "tokens", interval=interval, batch_size=batch_size,
+                         max_batches=max_batches)
+        self.tokens_db = tokens_db
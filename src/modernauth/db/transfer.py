@@ -0,0 +1,103 @@
+import json, time
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+
+def export_rows(engine, tables, out, chunk_size=5000, progress=None):
+    """Write every row of ``tables`` (a ``{name: Table}`` dict) to ``out`` as
+    NDJSON lines of ``{"table": name, "row": {...}}``. Rows are read through a
+    server-side cursor ``chunk_size`` at a time, so memory stays flat however
+    large the table is. Returns ``{name: row_count}``."""
+    counts = {}
+    for name, table in tables.items():
+        started = time.perf_counter()
+        count = 0
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(
+                table.select().order_by(*table.primary_key.columns)
+            ).mappings()
+            for row in result:
+                out.write(json.dumps({"table": name, "row": dict(row)}, separators=(",", ":")))
+                out.write("\n")
+                count += 1
+                if progress is not None and count % chunk_size == 0:
+                    progress(name, count, time.perf_counter() - started)
+        counts[name] = count
+        if progress is not None and (count == 0 or count % chunk_size):
+            progress(name, count, time.perf_counter() - started)
+    return counts
+
+
+def _insert_ignoring_duplicates(dialect, table):
+    """An INSERT that skips rows whose key already exists, or ``None`` if
+    the dialect has no such form."""
+    if dialect.name in ("mysql", "mariadb"):
+        return table.insert().prefix_with("IGNORE")
+    if dialect.name == "sqlite":
+        return sqlite_insert(table).on_conflict_do_nothing()
+    if dialect.name == "postgresql":
+        return postgresql_insert(table).on_conflict_do_nothing()
+    return None
+
+
+def _insert_chunk(engine, table, rows):
+    """Insert ``rows`` in one executemany, skipping those that already
+    exist; returns how many were inserted."""
+    statement = _insert_ignoring_duplicates(engine.dialect, table)
+    if statement is not None and engine.dialect.supports_sane_multi_rowcount:
+        with engine.begin() as conn:
+            return conn.execute(statement, rows).rowcount
+    # No insert-ignore form: try the chunk, then one row at a time.
+    try:
+        with engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+        return len(rows)
+    except IntegrityError:
+        pass
+    inserted = 0
+    for row in rows:
+        try:
+            with engine.begin() as conn:
+                conn.execute(table.insert(), row)
+            inserted += 1
+        except IntegrityError:
+            continue
+    return inserted
+
+
+def import_rows(engine, tables, lines, chunk_size=5000, progress=None):
+    """Load NDJSON written by ``export_rows`` into ``tables``, inserting
+    ``chunk_size`` rows per transaction. Rows whose primary key already
+    exists are left as they are, so an interrupted import can be re-run.
+    Lines for unknown tables are ignored. Returns
+    ``{name: (rows_read, rows_inserted)}``."""
+    pending = {name: [] for name in tables}
+    read = dict.fromkeys(tables, 0)
+    inserted = dict.fromkeys(tables, 0)
+    started = dict.fromkeys(tables)
+
+    def flush(name):
+        inserted[name] += _insert_chunk(engine, tables[name], pending[name])
+        pending[name] = []
+        if progress is not None:
+            progress(name, read[name], time.perf_counter() - started[name])
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        name = record.get("table")
+        if name not in tables:
+            continue
+        if started[name] is None:
+            started[name] = time.perf_counter()
+        pending[name].append(record["row"])
+        read[name] += 1
+        if len(pending[name]) >= chunk_size:
+            flush(name)
+    for name in tables:
+        if pending[name]:
+            flush(name)
+    return {name: (read[name], inserted[name]) for name in tables if started[name] is not None}
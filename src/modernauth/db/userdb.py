@@ -1,37 +1,122 @@
-from sqlalchemy import create_engine, Table, Column, String, MetaData
-from sqlalchemy.exc import SQLAlchemyError
+import time
+from sqlalchemy import Table, Column, String, BigInteger, Boolean, MetaData, bindparam, tuple_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from modernauth.db.engine import get_engine, get_async_engine
+from modernauth.db.membership import MembershipCache
+from modernauth.hashing import CURRENT_PREFIX, hash_candidates
 
-def make_engine_with_env_ssl(url):
-    return create_engine(
-        url=url.replace("mysql://", "mysql+pymysql://"),
-        echo=False
-    )
+# Changes kept per server in ``user_changes``; a worker further behind than
+# this rebuilds its membership filter from the users table.
+CHANGE_LOG_SIZE = 1000
 
 class UserDB:
-    def __init__(self, mysql_connection, hash_function):
-        self.engine = make_engine_with_env_ssl(mysql_connection)
+    def __init__(self, mysql_connection, hash_function, cache_size=10000, cache_ttl=300,
+                 filter_check_interval=1.0):
+        self.mysql_connection = mysql_connection
+        self.engine = get_engine(mysql_connection).execution_options(modernauth_db="UserDB")
+        self._async_engine = None
         self.metadata = MetaData()
         self.hash = hash_function
+        self.cache = MembershipCache(cache_size, cache_ttl, filter_check_interval) if cache_size > 0 else None
+        self._versioned = set()
         self.users = Table(
             'users', self.metadata,
             Column('server_id', String(255), primary_key=True, nullable=False),
             Column('username', String(255), primary_key=True, nullable=False),
             Column('sub', String(255), nullable=False)
         )
+        # Bumped by every signup and delete, so each worker's membership
+        # filter can tell when another worker changed a server's users.
+        self.versions = Table(
+            'user_versions', self.metadata,
+            Column('server_id', String(255), primary_key=True, nullable=False),
+            Column('version', BigInteger, nullable=False, default=0)
+        )
+        self.changes = Table(
+            'user_changes', self.metadata,
+            Column('server_id', String(255), primary_key=True, nullable=False),
+            Column('version', BigInteger, primary_key=True, nullable=False, autoincrement=False),
+            Column('username', String(255), nullable=False),
+            Column('deleted', Boolean, nullable=False, default=False)
+        )
+
+    def create_schema(self):
         self.metadata.create_all(self.engine)
 
+    @property
+    def async_engine(self):
+        if self._async_engine is None:
+            self._async_engine = get_async_engine(self.mysql_connection).execution_options(
+                modernauth_db="UserDB")
+        return self._async_engine
+
     def _h(self, value: str) -> str:
         return self.hash(value)
 
+    def _ensure_version_row(self, server_id: str):
+        # Created outside the signup transaction, so two first signups on a
+        # server cannot fail each other on the version row's key.
+        if server_id in self._versioned:
+            return
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(self.versions.insert().values(server_id=server_id, version=0))
+        except IntegrityError:
+            pass
+        except SQLAlchemyError:
+            return
+        self._versioned.add(server_id)
+
+    def _bump_version(self, conn, server_id: str, username: str, deleted: bool):
+        """Record a signup or delete in the caller's transaction; returns the
+        server's new version, or ``None`` if it has no version row."""
+        conn.execute(
+            self.versions.update().where(self.versions.c.server_id == server_id)
+            .values(version=self.versions.c.version + 1)
+        )
+        version = conn.execute(self._version_query(server_id)).scalar()
+        if version is None:
+            return None
+        conn.execute(self.changes.insert().values(
+            server_id=server_id, version=version, username=username, deleted=deleted))
+        conn.execute(self.changes.delete().where(
+            self.changes.c.server_id == server_id,
+            self.changes.c.version <= version - CHANGE_LOG_SIZE
+        ))
+        return version
+
+    def _version_query(self, server_id: str):
+        return self.versions.select().with_only_columns(self.versions.c.version).where(
+            self.versions.c.server_id == server_id
+        )
+
+    def _filter_query(self, server_id: str):
+        return self.users.select().with_only_columns(self.users.c.username).where(
+            self.users.c.server_id == server_id
+        )
+
+    def _changes_query(self, server_id: str, after: int, upto: int):
+        return self.changes.select().with_only_columns(
+            self.changes.c.version, self.changes.c.username, self.changes.c.deleted
+        ).where(
+            self.changes.c.server_id == server_id,
+            self.changes.c.version > after,
+            self.changes.c.version <= upto
+        ).order_by(self.changes.c.version)
+
+    def _catch_up(self, server_id: str, current, version: int, changes, checked_at: float) -> bool:
+        """Apply ``changes`` if they cover every version since ``current``;
+        returns whether that brought the filter to ``version``."""
+        if len(changes) != version - current:
+            return False
+        return self.cache.apply(server_id, current, changes, checked_at)
+
     def signup(self, server_id: str, username: str, sub: str) -> bool:
         h_sub = self._h(sub)
+        self._ensure_version_row(server_id)
         try:
             with self.engine.begin() as conn:
-                sel = self.users.select().where(
-                    self.users.c.server_id == server_id,
-                    self.users.c.username == username
-                )
-                if conn.execute(sel).first():
+                if conn.execute(self._member_query(server_id, username)).first():
                     return False
                 conn.execute(
                     self.users.insert().values(
@@ -40,35 +125,181 @@ class UserDB:
                         sub=h_sub
                     )
                 )
+                version = self._bump_version(conn, server_id, username, deleted=False)
+        except SQLAlchemyError:
+            return False
+        if self.cache is not None:
+            self.cache.add(server_id, username)
+            if version is not None:
+                self.cache.advance(server_id, version)
+        return True
+
+    def _member_query(self, server_id: str, username: str):
+        return self.users.select().where(
+            self.users.c.server_id == server_id,
+            self.users.c.username == username
+        )
+
+    def _members_query(self, server_id: str, usernames):
+        return self.users.select().with_only_columns(self.users.c.username).where(
+            self.users.c.server_id == server_id,
+            self.users.c.username.in_(usernames)
+        )
+
+    def _lookup(self, server_id: str, usernames, checked=False) -> dict:
+        answers = {}
+        for username in usernames:
+            known = self.cache.lookup(server_id, username, checked)
+            if known is not None:
+                answers[username] = known
+        return answers
+
+    def _refresh_filter(self, server_id: str):
+        # One thread per server checks the version; the others skip the
+        # filter and ask the database until it is current again. Returns
+        # whether this call brought the filter up to date.
+        refreshing = self.cache.refreshing(server_id)
+        if not refreshing.acquire(blocking=False):
+            return False
+        try:
+            checked_at = time.monotonic()
+            with self.engine.connect() as conn:
+                version = conn.execute(self._version_query(server_id)).scalar() or 0
+                current = self.cache.version(server_id)
+                if version == current:
+                    self.cache.confirm(server_id, version, checked_at)
+                    return True
+                if current is not None and 0 < version - current <= CHANGE_LOG_SIZE:
+                    changes = conn.execute(self._changes_query(server_id, current, version)).all()
+                    if self._catch_up(server_id, current, version, changes, checked_at):
+                        return True
+                usernames = conn.execute(self._filter_query(server_id)).scalars().all()
+            self.cache.set_filter(server_id, version, usernames, checked_at)
             return True
         except SQLAlchemyError:
             return False
+        finally:
+            refreshing.release()
+
+    def _cached(self, server_id: str, usernames) -> dict:
+        """Cached answers for ``usernames``: ``True`` for known members,
+        ``False`` for names the server's current filter rules out."""
+        if self.cache is None:
+            return {}
+        checked = not self.cache.fresh(server_id) and self._refresh_filter(server_id)
+        return self._lookup(server_id, usernames, checked)
+
+    def _remember(self, server_id: str, usernames, found, answers: dict) -> dict:
+        for username in usernames:
+            answers[username] = username in found
+            if username in found and self.cache is not None:
+                self.cache.add(server_id, username)
+        return answers
 
     def isuser(self, server_id: str, username: str) -> bool:
+        known = self._cached(server_id, [username])
+        if username in known:
+            return known[username]
         try:
             with self.engine.connect() as conn:
-                sel = self.users.select().where(
-                    self.users.c.server_id == server_id,
-                    self.users.c.username == username
-                )
-                return conn.execute(sel).first() is not None
+                exists = conn.execute(self._member_query(server_id, username)).first() is not None
+        except SQLAlchemyError:
+            return False
+        if exists and self.cache is not None:
+            self.cache.add(server_id, username)
+        return exists
+
+    def isusers(self, server_id: str, usernames, chunk_size: int = 500) -> dict:
+        usernames = list(dict.fromkeys(usernames))
+        answers = self._cached(server_id, usernames)
+        pending = [username for username in usernames if username not in answers]
+        found = set()
+        try:
+            with self.engine.connect() as conn:
+                for i in range(0, len(pending), chunk_size):
+                    found.update(conn.execute(
+                        self._members_query(server_id, pending[i:i + chunk_size])).scalars())
+        except SQLAlchemyError:
+            found = set()
+        self._remember(server_id, pending, found, answers)
+        return {username: answers[username] for username in usernames}
+
+    # Async twins of the lookups above for the ASGI /api routes; they share
+    # the membership cache with the sync methods.
+
+    async def _refresh_filter_async(self, server_id: str):
+        refreshing = self.cache.refreshing(server_id)
+        if not refreshing.acquire(blocking=False):
+            return False
+        try:
+            checked_at = time.monotonic()
+            async with self.async_engine.connect() as conn:
+                version = (await conn.execute(self._version_query(server_id))).scalar() or 0
+                current = self.cache.version(server_id)
+                if version == current:
+                    self.cache.confirm(server_id, version, checked_at)
+                    return True
+                if current is not None and 0 < version - current <= CHANGE_LOG_SIZE:
+                    changes = (await conn.execute(self._changes_query(server_id, current, version))).all()
+                    if self._catch_up(server_id, current, version, changes, checked_at):
+                        return True
+                usernames = (await conn.execute(self._filter_query(server_id))).scalars().all()
+            self.cache.set_filter(server_id, version, usernames, checked_at)
+            return True
+        except SQLAlchemyError:
+            return False
+        finally:
+            refreshing.release()
+
+    async def _cached_async(self, server_id: str, usernames) -> dict:
+        if self.cache is None:
+            return {}
+        checked = not self.cache.fresh(server_id) and await self._refresh_filter_async(server_id)
+        return self._lookup(server_id, usernames, checked)
+
+    async def isuser_async(self, server_id: str, username: str) -> bool:
+        known = await self._cached_async(server_id, [username])
+        if username in known:
+            return known[username]
+        try:
+            async with self.async_engine.connect() as conn:
+                exists = (await conn.execute(self._member_query(server_id, username))).first() is not None
         except SQLAlchemyError:
             return False
+        if exists and self.cache is not None:
+            self.cache.add(server_id, username)
+        return exists
+
+    async def isusers_async(self, server_id: str, usernames, chunk_size: int = 500) -> dict:
+        usernames = list(dict.fromkeys(usernames))
+        answers = await self._cached_async(server_id, usernames)
+        pending = [username for username in usernames if username not in answers]
+        found = set()
+        try:
+            async with self.async_engine.connect() as conn:
+                for i in range(0, len(pending), chunk_size):
+                    result = await conn.execute(self._members_query(server_id, pending[i:i + chunk_size]))
+                    found.update(result.scalars())
+        except SQLAlchemyError:
+            found = set()
+        self._remember(server_id, pending, found, answers)
+        return {username: answers[username] for username in usernames}
 
     def login(self, server_id: str, username: str, sub: str) -> bool:
-        h_sub = self._h(sub)
+        h_subs = hash_candidates(self.hash, sub)
         try:
             with self.engine.connect() as conn:
                 sel = self.users.select().where(
                     self.users.c.server_id == server_id,
                     self.users.c.username == username,
-                    self.users.c.sub      == h_sub
+                    self.users.c.sub.in_(h_subs)
                 )
                 return conn.execute(sel).first() is not None
         except SQLAlchemyError:
             return False
 
     def delete(self, server_id: str, username: str) -> bool:
+        self._ensure_version_row(server_id)
         try:
             with self.engine.begin() as conn:
                 conn.execute(
@@ -77,9 +308,14 @@ class UserDB:
                         self.users.c.username == username
                     )
                 )
-            return True
+                version = self._bump_version(conn, server_id, username, deleted=True)
         except SQLAlchemyError:
             return False
+        if self.cache is not None:
+            self.cache.remove(server_id, username)
+            if version is not None:
+                self.cache.advance(server_id, version)
+        return True
 
     def load(self):
         data = {}
@@ -92,4 +328,32 @@ class UserDB:
                     data.setdefault(srv, {})[usr] = sb
         except SQLAlchemyError:
             return {}
-        return data
\ No newline at end of file
+        return data
+
+    def rehash(self, batch_size: int = 1000) -> int:
+        """Rewrite ``sub`` digests still in an older format, walking the
+        primary key in batches. Returns the number of rows converted."""
+        key = tuple_(self.users.c.server_id, self.users.c.username)
+        rename = self.users.update().where(
+            self.users.c.server_id == bindparam('b_server_id'),
+            self.users.c.username == bindparam('b_username')
+        ).values(sub=bindparam('b_sub'))
+        converted = 0
+        last = None
+        while True:
+            sel = self.users.select().where(
+                ~self.users.c.sub.startswith(CURRENT_PREFIX, autoescape=True)
+            ).order_by(self.users.c.server_id, self.users.c.username).limit(batch_size)
+            if last is not None:
+                sel = sel.where(key > tuple_(*last))
+            with self.engine.begin() as conn:
+                rows = conn.execute(sel).all()
+                if not rows:
+                    return converted
+                conn.execute(rename, [{
+                    "b_server_id": row.server_id,
+                    "b_username": row.username,
+                    "b_sub": self.hash.upgrade(row.sub)
+                } for row in rows])
+            converted += len(rows)
+            last = (rows[-1].server_id, rows[-1].username)
@@ -0,0 +1,82 @@
+import base64, hashlib, hmac, os
+
+CURRENT_PREFIX = "2$"
+
+
+def legacy_hash(data: str, algorithm: str = 'sha512') -> str:
+    """Create a unique hash of a string using the specified algorithm."""
+    hash_obj = hashlib.new(algorithm)
+    hash_obj.update(data.encode('utf-8'))
+    return hash_obj.hexdigest()
+
+
+class Hasher:
+    """Versioned digests for token keys, ``sub`` values and server secrets.
+
+    Version 1 is the original 128-character SHA-512 hex digest. Version 2 is
+    ``2$`` followed by a base64url keyed BLAKE2b digest of the version 1
+    digest (24 characters for the default 16-byte digest). Because version 2
+    is derived from version 1, stored rows can be rehashed without knowing
+    the original values. Without a key the hasher keeps writing version 1.
+
+    While ``accept_legacy`` is set, ``candidates`` and ``matches`` also
+    accept version 1 digests so users and server secrets written before the
+    switch keep working until ``modernauth rehash`` has converted them.
+    Token keys are only ever looked up under the current digest.
+
+    Version 2 is smaller to store and index, not cheaper to compute: it is
+    the SHA-512 digest plus a BLAKE2b over it.
+    """
+
+    def __init__(self, key=None, digest_size=16, accept_legacy=True):
+        self.key = key.encode('utf-8') if isinstance(key, str) else key
+        self.accept_legacy = accept_legacy
+        self._keyed = hashlib.blake2b(key=self.key, digest_size=digest_size) if self.key else None
+
+    def __call__(self, data: str) -> str:
+        return self.hash(data)
+
+    @staticmethod
+    def is_current(digest: str) -> bool:
+        return digest.startswith(CURRENT_PREFIX)
+
+    def upgrade(self, legacy_digest: str) -> str:
+        """Convert a stored version 1 digest into version 2."""
+        keyed = self._keyed.copy()
+        keyed.update(legacy_digest.encode('ascii'))
+        return CURRENT_PREFIX + base64.urlsafe_b64encode(keyed.digest()).rstrip(b"=").decode('ascii')
+
+    def hash(self, data: str) -> str:
+        legacy = legacy_hash(data)
+        return self.upgrade(legacy) if self._keyed else legacy
+
+    def candidates(self, data: str) -> list:
+        """Digests ``data`` may be stored under, the one written today first."""
+        legacy = legacy_hash(data)
+        if not self._keyed:
+            return [legacy]
+        current = self.upgrade(legacy)
+        return [current, legacy] if self.accept_legacy else [current]
+
+    def matches(self, data: str, digest: str) -> bool:
+        """Constant-time check of ``data`` against a stored digest of either version."""
+        if not data or not digest:
+            return False
+        legacy = legacy_hash(data)
+        if self.is_current(digest):
+            return self._keyed is not None and hmac.compare_digest(self.upgrade(legacy), digest)
+        return (self._keyed is None or self.accept_legacy) and hmac.compare_digest(legacy, digest)
+
+
+def hash_candidates(hash_function, data: str) -> list:
+    """``hash_function.candidates(data)``, or just its one digest for plain callables."""
+    candidates = getattr(hash_function, "candidates", None)
+    return candidates(data) if candidates else [hash_function(data)]
+
+
+def make_hasher():
+    """The hasher configured by ``HASH_KEY`` and ``HASH_ACCEPT_LEGACY``."""
+    return Hasher(
+        key=os.getenv("HASH_KEY") or None,
+        accept_legacy=os.getenv("HASH_ACCEPT_LEGACY", "1").lower() not in ("0", "false", "no")
+    )
@@ -0,0 +1,339 @@
+import bisect, json, os, sqlite3, threading, time
+from contextlib import contextmanager
+from modernauth.db.engine import SQLITE_BUSY_TIMEOUT, connect_sqlite, sqlite_transaction
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def snapshot(self):
+        """``{(label_values, field): value}``; a counter has the one field 0."""
+        with self._lock:
+            return {(label_values, 0): value for label_values, value in self._values.items()}
+
+    def samples(self, snapshot=None):
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        for (label_values, _), value in sorted(snapshot.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def snapshot(self):
+        """``{(label_values, field): value}``: fields ``0..len(buckets)`` are
+        the per-bucket counts, then the sum, then the count."""
+        snapshot = {}
+        with self._lock:
+            for label_values, (counts, total, count) in self._series.items():
+                for field, value in enumerate(counts + [total, count]):
+                    snapshot[(label_values, field)] = value
+        return snapshot
+
+    def samples(self, snapshot=None):
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        width = len(self.buckets) + 1
+        series = {}
+        for (label_values, field), value in snapshot.items():
+            series.setdefault(label_values, [0] * (width + 2))[field] = value
+        for label_values, values in sorted(series.items()):
+            counts, total, count = values[:width], values[width], values[width + 1]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield (f"{self.name}_bucket",
+                       _format_labels(self.labels, label_values, [("le", le)]), cumulative)
+            yield f"{self.name}_sum", _format_labels(self.labels, label_values), total
+            yield f"{self.name}_count", _format_labels(self.labels, label_values), count
+
+
+class CallbackGauge:
+    """Gauge whose samples come from ``callback()`` at scrape time, as an
+    iterable of ``(label_values, value)`` pairs."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, callback, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def reset(self):
+        pass
+
+    def snapshot(self):
+        return {(tuple(label_values), 0): value for label_values, value in self.callback()}
+
+    def samples(self, snapshot=None):
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        for (label_values, _), value in sorted(snapshot.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class SharedMetrics:
+    """Sums the metrics of every worker process on the host in a SQLite file,
+    so a scrape answered by any one worker covers them all.
+
+    Each process adds what its counters and histograms gained since its last
+    flush, every ``interval`` seconds and before answering a scrape. Totals
+    therefore survive worker restarts; other workers' latest counts show up
+    within ``interval``. Gauges are per process: each one writes its current
+    values, and those of processes silent for ``3 * interval`` are dropped.
+    """
+
+    def __init__(self, registry, path, interval=5.0, busy_timeout=SQLITE_BUSY_TIMEOUT):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.busy_timeout = busy_timeout
+        self._flushed = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metric_values (metric TEXT NOT NULL, labels TEXT NOT NULL, "
+                "field INTEGER NOT NULL, value REAL NOT NULL, PRIMARY KEY (metric, labels, field))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metric_gauges (metric TEXT NOT NULL, labels TEXT NOT NULL, "
+                "pid INTEGER NOT NULL, value REAL NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (metric, labels, pid))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = connect_sqlite(self.path, self.busy_timeout)
+        try:
+            with sqlite_transaction(conn):
+                yield conn
+        finally:
+            conn.close()
+
+    def start(self):
+        """Start this process's flush thread, once per process. Threads do
+        not survive a fork, so each worker starts its own."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="modernauth-metrics-flush", daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
+
+    def after_fork(self):
+        # A child starts from zero; whatever it inherited belongs to the parent.
+        self._flushed = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        for metric in self.registry.metrics:
+            metric.reset()
+
+    def flush(self):
+        now = time.time()
+        pid = os.getpid()
+        added, gauges, flushed = [], [], {}
+        with self._lock:
+            for metric in self.registry.metrics:
+                for (label_values, field), value in metric.snapshot().items():
+                    labels = json.dumps(list(label_values))
+                    if metric.kind == "gauge":
+                        gauges.append((metric.name, labels, pid, value, now))
+                        continue
+                    key = (metric.name, label_values, field)
+                    delta = value - self._flushed.get(key, 0)
+                    if delta:
+                        added.append((metric.name, labels, field, delta))
+                        flushed[key] = value
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO metric_values (metric, labels, field, value) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (metric, labels, field) DO UPDATE SET value = value + excluded.value",
+                    added
+                )
+                conn.executemany("INSERT OR REPLACE INTO metric_gauges VALUES (?, ?, ?, ?, ?)", gauges)
+                conn.execute("DELETE FROM metric_gauges WHERE updated_at < ?", (now - 3 * self.interval,))
+            # Only once written, so a failed flush is retried in full.
+            self._flushed.update(flushed)
+
+    def collect(self):
+        """Flush this process, then return ``{metric name: snapshot}`` summed
+        over every process."""
+        self.flush()
+        snapshots = {}
+        with self._connect() as conn:
+            rows = conn.execute("SELECT metric, labels, field, value FROM metric_values").fetchall()
+            rows += conn.execute(
+                "SELECT metric, labels, 0, SUM(value) FROM metric_gauges GROUP BY metric, labels"
+            ).fetchall()
+        for metric, labels, field, value in rows:
+            snapshots.setdefault(metric, {})[(tuple(json.loads(labels)), field)] = value
+        return snapshots
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.shared = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def share(self, path, interval=5.0):
+        """Aggregate across processes through the SQLite file at ``path``;
+        see ``SharedMetrics``."""
+        self.shared = SharedMetrics(self, path, interval)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.shared.after_fork)
+        return self.shared
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, callback, labels=()):
+        return self.register(CallbackGauge(name, help_text, callback, labels))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        snapshots = self.shared.collect() if self.shared is not None else None
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            snapshot = snapshots.get(metric.name, {}) if snapshots is not None else None
+            for name, labels, value in metric.samples(snapshot):
+                lines.append(f"{name}{labels} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+http_requests = REGISTRY.counter(
+    "modernauth_http_requests_total", "HTTP requests served.", ("method", "route", "status"))
+http_latency = REGISTRY.histogram(
+    "modernauth_http_request_duration_seconds", "HTTP request latency.", ("route",))
+rate_limited = REGISTRY.counter(
+    "modernauth_rate_limited_total", "Requests rejected by the rate limiter.", ("route",))
+sql_latency = REGISTRY.histogram(
+    "modernauth_sql_statement_duration_seconds", "SQL statement latency by db class.", ("db",))
+auth0_latency = REGISTRY.histogram(
+    "modernauth_auth0_request_duration_seconds", "Latency of outbound Auth0 calls.", ("call",))
+expired_rows_swept = REGISTRY.counter(
+    "modernauth_expired_rows_swept_total", "Expired rows removed by the background sweepers.", ("what",))
+sweep_latency = REGISTRY.histogram(
+    "modernauth_sweep_duration_seconds", "Duration of one background sweep.", ("what",))
+
+
+def instrument_sqlalchemy():
+    """Time every SQL statement. Statements are labelled with the
+    ``modernauth_db`` execution option set by each db class."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if getattr(instrument_sqlalchemy, "installed", False):
+        return
+    instrument_sqlalchemy.installed = True
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("modernauth_started", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("modernauth_started")
+        if not started:
+            return
+        db = context.execution_options.get("modernauth_db", "other") if context is not None else "other"
+        sql_latency.observe(time.perf_counter() - started.pop(), db)
+
+
+def instrument_app(app):
+    """Record per-route request counts, latency and rate-limit rejections."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        if REGISTRY.shared is not None:
+            REGISTRY.shared.start()
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        started = g.get("metrics_started")
+        if started is not None:
+            http_latency.observe(time.perf_counter() - started, route)
+        http_requests.inc(request.method, route, str(response.status_code))
+        if response.status_code == 429:
+            rate_limited.inc(route)
+        return response
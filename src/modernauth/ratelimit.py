@@ -0,0 +1,152 @@
+import os, sqlite3, tempfile, threading, time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from limits.storage import Storage, MovingWindowSupport
+from modernauth.db.engine import SQLITE_BUSY_TIMEOUT, connect_sqlite, sqlite_transaction
+
+STORAGE_SCHEME = "modernauth+sqlite"
+
+
+def default_storage_uri():
+    return f"{STORAGE_SCHEME}:///{os.path.join(tempfile.gettempdir(), 'modernauth-ratelimit.db')}"
+
+
+class SQLiteLimiterStorage(Storage, MovingWindowSupport):
+    """Rate-limit storage in a local SQLite file, shared by every worker
+    process on the host. Supports the fixed-window and moving-window
+    strategies; use ``modernauth+sqlite:///path/to/file.db`` as the
+    ``storage_uri``.
+    """
+
+    STORAGE_SCHEME = [STORAGE_SCHEME]
+    PRUNE_EVERY = 1000
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        self.path = urlparse(uri).path if uri else urlparse(default_storage_uri()).path
+        self.busy_timeout = float(options.get("busy_timeout", SQLITE_BUSY_TIMEOUT))
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._write_lock_pid = os.getpid()
+        self._operations = 0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ratelimit_counters "
+                "(key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ratelimit_events "
+                "(key TEXT NOT NULL, ts REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_ratelimit_events_key_ts ON ratelimit_events (key, ts)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_ratelimit_events_expires ON ratelimit_events (expires_at)")
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        # Connections are per thread and per process, so forked workers
+        # never reuse the parent's handle.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = connect_sqlite(self.path, self.busy_timeout)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _process_write_lock(self):
+        # A lock held by another thread at fork time would never be released
+        # in the child, so each process gets its own.
+        if self._write_lock_pid != os.getpid():
+            self._write_lock = threading.Lock()
+            self._write_lock_pid = os.getpid()
+        return self._write_lock
+
+    @contextmanager
+    def _transaction(self):
+        # Threads of one process take turns here, so SQLite's busy timeout
+        # is only spent waiting on other processes rather than on dozens of
+        # sibling threads polling the same file lock.
+        with self._process_write_lock():
+            with sqlite_transaction(self._connection()) as conn:
+                yield conn
+
+    def _maybe_prune(self, conn, now):
+        self._operations += 1
+        if self._operations % self.PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM ratelimit_events WHERE expires_at <= ?", (now,))
+            conn.execute("DELETE FROM ratelimit_counters WHERE expires_at <= ?", (now,))
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT count, expires_at FROM ratelimit_counters WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                count = amount
+                conn.execute(
+                    "INSERT OR REPLACE INTO ratelimit_counters (key, count, expires_at) VALUES (?, ?, ?)",
+                    (key, count, now + expiry)
+                )
+            else:
+                count = row[0] + amount
+                conn.execute("UPDATE ratelimit_counters SET count = ? WHERE key = ?", (count, key))
+            self._maybe_prune(conn, now)
+        return count
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT count FROM ratelimit_counters WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._connection().execute(
+            "SELECT expires_at FROM ratelimit_counters WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self._transaction() as conn:
+            removed = conn.execute("DELETE FROM ratelimit_counters").rowcount
+            removed += conn.execute("DELETE FROM ratelimit_events").rowcount
+        return removed
+
+    def clear(self, key):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM ratelimit_counters WHERE key = ?", (key,))
+            conn.execute("DELETE FROM ratelimit_events WHERE key = ?", (key,))
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM ratelimit_events WHERE key = ? AND ts <= ?", (key, now - expiry))
+            (count,) = conn.execute(
+                "SELECT COUNT(*) FROM ratelimit_events WHERE key = ?", (key,)
+            ).fetchone()
+            if count + amount > limit:
+                return False
+            conn.executemany(
+                "INSERT INTO ratelimit_events (key, ts, expires_at) VALUES (?, ?, ?)",
+                [(key, now, now + expiry)] * amount
+            )
+            self._maybe_prune(conn, now)
+        return True
+
+    def get_moving_window(self, key, limit, expiry):
+        now = time.time()
+        oldest, count = self._connection().execute(
+            "SELECT MIN(ts), COUNT(*) FROM ratelimit_events WHERE key = ? AND ts > ?", (key, now - expiry)
+        ).fetchone()
+        return (oldest if oldest is not None else now), count
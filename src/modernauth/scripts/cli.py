@@ -3,8 +3,6 @@ import os
 import secrets
 import string
 from dotenv import load_dotenv
-from modernauth.app import create_hash
-from modernauth.db.server_config import ServerConfig
 import modernauth.scripts.cli_functions as cf
 from modernauth.scripts.cli_functions import MYSQL_CONN, INVITE_BASE_URL
 
@@ -18,6 +16,11 @@ def cli():
     """ModernAuth administration commands."""
     pass
 
+@cli.command("init-db")
+def init_db():
+    cf.init_db()
+    click.echo("Database tables are up to date.")
+
 @cli.command("add-server")
 @click.argument("server_id")
 def add_server(server_id):
@@ -56,6 +59,105 @@ def remove_server(server_id):
         return
     click.echo(f"Removed server '{server_id}' successfully.")
 
+@cli.command("sweep-tokens")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows deleted per statement.")
+@click.option("--max-batches", type=int, default=None, help="Stop after this many batches.")
+def sweep_tokens(batch_size, max_batches):
+    removed, elapsed = cf.sweep_tokens(batch_size=batch_size, max_batches=max_batches)
+    click.echo(f"Removed {removed} expired tokens in {elapsed:.3f}s.")
+
+@cli.command("sweep-sessions")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows deleted per statement.")
+@click.option("--max-batches", type=int, default=None, help="Stop after this many batches.")
+def sweep_sessions(batch_size, max_batches):
+    response = cf.sweep_sessions(batch_size=batch_size, max_batches=max_batches)
+    if response is False:
+        click.echo("SESSION_BACKEND is cookie; there are no server-side sessions to sweep.")
+        return
+    removed, elapsed = response
+    click.echo(f"Removed {removed} expired sessions in {elapsed:.3f}s.")
+
+@cli.command("build-assets")
+@click.option("--output", default=None, help="Directory to write to (default: $ASSETS_BUILD_DIR or a temp dir).")
+def build_assets(output):
+    output, files = cf.build_assets(output)
+    for name, entry in sorted(files.items()):
+        encodings = ", ".join(entry["encodings"]) or "uncompressed"
+        click.echo(f"{name} -> {entry['path']} ({encodings})")
+    click.echo(f"Wrote {len(files)} assets to {output}.")
+
+@cli.command("rehash")
+@click.option("--batch-size", default=1000, show_default=True, help="Rows updated per transaction.")
+def rehash(batch_size):
+    response = cf.rehash(batch_size=batch_size)
+    if response is False:
+        click.echo("HASH_KEY is not set; nothing to convert to.")
+        return
+    for table, converted in response.items():
+        click.echo(f"{table}: rehashed {converted} rows.")
+
+def report_progress(table, rows, elapsed):
+    rate = rows / elapsed if elapsed > 0 else 0
+    click.echo(f"{table}: {rows:,} rows ({rate:,.0f} rows/s)", err=True)
+
+@cli.command("export")
+@click.argument("output", type=click.File("w"), default="-")
+@click.option("--database", default=None, help="Database URL to read (default: $MYSQL).")
+@click.option("--tokens", is_flag=True, help="Also export the tokensystem table.")
+@click.option("--chunk-size", default=5000, show_default=True, help="Rows fetched per round trip.")
+def export_data(output, database, tokens, chunk_size):
+    counts = cf.export_data(output, database=database, tokens=tokens,
+                            chunk_size=chunk_size, progress=report_progress)
+    for table, rows in counts.items():
+        click.echo(f"Exported {rows:,} rows from {table}.", err=True)
+
+@cli.command("import")
+@click.argument("input_file", metavar="INPUT", type=click.File("r"), default="-")
+@click.option("--database", default=None, help="Database URL to write (default: $MYSQL).")
+@click.option("--chunk-size", default=5000, show_default=True, help="Rows inserted per transaction.")
+def import_data(input_file, database, chunk_size):
+    counts = cf.import_data(input_file, database=database, chunk_size=chunk_size, progress=report_progress)
+    for table, (read, inserted) in counts.items():
+        click.echo(f"Imported {inserted:,} of {read:,} rows into {table} "
+                   f"({read - inserted:,} already present).", err=True)
+
+@cli.command("serve")
+@click.option("--bind", default=lambda: f"0.0.0.0:{os.getenv('PORT', '3000')}", show_default="0.0.0.0:$PORT",
+              help="Address to listen on.")
+@click.option("--workers", type=int, envvar="WEB_CONCURRENCY", default=None,
+              help="Worker processes (default: 2 x CPUs + 1).")
+@click.option("--worker-class", type=click.Choice(["auto", "sync", "gthread", "gevent", "uvicorn"]),
+              envvar="WORKER_CLASS", default="auto", show_default=True,
+              help="uvicorn: the ASGI app with async /api routes. gevent: greenlets. Both hold many "
+                   "concurrent long-polls. gthread: thread pool per worker. auto: uvicorn or gevent "
+                   "if installed, else gthread.")
+@click.option("--threads", type=int, envvar="WORKER_THREADS", default=4, show_default=True,
+              help="Threads per gthread worker.")
+@click.option("--worker-connections", type=int, default=1000, show_default=True,
+              help="Concurrent requests per gevent worker.")
+@click.option("--keep-alive", type=int, default=5, show_default=True, help="Seconds to hold idle connections.")
+@click.option("--timeout", type=int, default=None,
+              help="Seconds before a silent worker is restarted (default: AUTHSTATUS_MAX_WAIT + 30).")
+@click.option("--graceful-timeout", type=int, default=30, show_default=True,
+              help="Seconds workers get to finish requests on reload or shutdown.")
+@click.option("--max-requests", type=int, default=1000, show_default=True,
+              help="Recycle a worker after this many requests (0 disables).")
+@click.option("--max-requests-jitter", type=int, default=100, show_default=True,
+              help="Random spread added to --max-requests so workers do not restart together.")
+@click.option("--preload", is_flag=True, help="Import the app once in the master before forking.")
+def serve(bind, workers, worker_class, threads, worker_connections, keep_alive, timeout,
+          graceful_timeout, max_requests, max_requests_jitter, preload):
+    """Run the web app under gunicorn. Send SIGHUP to reload gracefully."""
+    from modernauth.server import serve as run_server, resolve_worker_class, long_poll_warning, default_workers
+    worker_class = resolve_worker_class(worker_class)
+    warning = long_poll_warning(worker_class, workers or default_workers(), threads)
+    if warning:
+        click.echo(f"Warning: {warning}", err=True)
+    run_server(bind, workers=workers, worker_class=worker_class, threads=threads,
+               keepalive=keep_alive, timeout=timeout, graceful_timeout=graceful_timeout,
+               max_requests=max_requests, max_requests_jitter=max_requests_jitter,
+               preload=preload, worker_connections=worker_connections)
+
 
 if __name__ == "__main__":
     cli()
\ No newline at end of file
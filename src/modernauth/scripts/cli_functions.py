@@ -2,13 +2,22 @@ import os
 import secrets
 import string
 from dotenv import load_dotenv
-from modernauth.app import create_hash
+from modernauth.hashing import make_hasher
 from modernauth.db.server_config import ServerConfig
+from modernauth.db.tokensystem import TokenSystemDB
+from modernauth.db.userdb import UserDB
+from modernauth.db.token_stores import SQLTokenStore
+from modernauth.db.sessions import make_session_store
+from modernauth.db.engine import get_engine
+from modernauth.db.transfer import export_rows, import_rows
+from modernauth.db.schema import init_db as create_schema
+from modernauth.static import build as build_static, default_build_dir
 
 load_dotenv()
 
 MYSQL_CONN = os.getenv("MYSQL")
 INVITE_BASE_URL = os.getenv("BASE_URL")
+create_hash = make_hasher()
 
 def generate_secret_key(length=100):
     """Generate a random secret key of given length."""
@@ -16,15 +25,20 @@ def generate_secret_key(length=100):
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
 
+def init_db():
+    """Create the database tables, or upgrade older layouts in place."""
+    create_schema(MYSQL_CONN)
+    return True
+
+
 def add_server(server_id):
     """Add a new server with the specified SERVER_ID."""
     config_obj = ServerConfig(mysql_connection=MYSQL_CONN, hash_function=create_hash)
-    config = config_obj.load()
-    if server_id in config:
+    if config_obj.get(server_id) is not None:
         return False
     secret_key = generate_secret_key(100)
-    config[server_id] = {"secret_key": create_hash(secret_key)}
-    config_obj.save(config)
+    if not config_obj.upsert(server_id, {"secret_key": create_hash(secret_key)}):
+        return False
     return secret_key
 
 
@@ -43,20 +57,81 @@ def list_servers():
 def reset_key(server_id):
     """Reset the secret key for the specified SERVER_ID."""
     config_obj = ServerConfig(mysql_connection=MYSQL_CONN, hash_function=create_hash)
-    config = config_obj.load()
-    if server_id not in config:
-        return False
     secret_key = generate_secret_key(100)
-    config[server_id]["secret_key"] = create_hash(secret_key)
-    config_obj.save(config)
+    if not config_obj.update_secret(server_id, secret_key):
+        return False
     return secret_key
 
 def remove_server(server_id):
     """Remove the server with the specified SERVER_ID."""
     config_obj = ServerConfig(mysql_connection=MYSQL_CONN, hash_function=create_hash)
-    config = config_obj.load()
-    if server_id not in config:
+    return config_obj.delete(server_id)
+
+def sweep_tokens(batch_size=1000, max_batches=None):
+    """Delete expired login tokens, returning the count removed and the time taken."""
+    tokens_db = TokenSystemDB(
+        mysql_connection=MYSQL_CONN,
+        hash_function=create_hash,
+        backend=os.getenv("TOKEN_STORE", "sql"),
+        store_path=os.getenv("TOKEN_STORE_PATH")
+    )
+    return tokens_db.sweep_expired(batch_size=batch_size, max_batches=max_batches)
+
+def sweep_sessions(batch_size=1000, max_batches=None):
+    """Delete expired server-side sessions, returning the count removed and
+    the time taken, or False when SESSION_BACKEND keeps sessions in cookies."""
+    backend = os.getenv("SESSION_BACKEND", "cookie")
+    if backend == "cookie":
         return False
-    del config[server_id]
-    config_obj.save(config)
-    return True
\ No newline at end of file
+    store = make_session_store(backend, mysql_connection=MYSQL_CONN, path=os.getenv("SESSION_STORE_PATH"))
+    return store.sweep_expired(batch_size=batch_size, max_batches=max_batches)
+
+def build_assets(output=None):
+    """Fingerprint and precompress the static assets into ``output`` (default
+    ASSETS_BUILD_DIR). Returns the output directory and the manifest entries."""
+    output = output or default_build_dir()
+    return output, build_static(build_dir=output)["files"]
+
+def rehash(batch_size=1000):
+    """Convert stored digests to the current hash format. Returns the number
+    of rows converted per table, or False when no HASH_KEY is configured."""
+    if create_hash.key is None:
+        return False
+    tokens_db = TokenSystemDB(
+        mysql_connection=MYSQL_CONN,
+        hash_function=create_hash,
+        backend=os.getenv("TOKEN_STORE", "sql"),
+        store_path=os.getenv("TOKEN_STORE_PATH")
+    )
+    userdb = UserDB(mysql_connection=MYSQL_CONN, hash_function=create_hash, cache_size=0)
+    config_obj = ServerConfig(mysql_connection=MYSQL_CONN, hash_function=create_hash)
+    return {
+        "server_config": config_obj.rehash(),
+        "users": userdb.rehash(batch_size=batch_size),
+        "tokensystem": tokens_db.rehash(batch_size=batch_size)
+    }
+
+def transfer_tables(database, tokens=False):
+    """The tables moved by export and import."""
+    tables = {
+        "server_config": ServerConfig(mysql_connection=database, hash_function=create_hash).config_table,
+        "users": UserDB(mysql_connection=database, hash_function=create_hash, cache_size=0).users
+    }
+    if tokens:
+        tables["tokensystem"] = SQLTokenStore(get_engine(database)).tokens
+    return tables
+
+
+def export_data(out, database=None, tokens=False, chunk_size=5000, progress=None):
+    """Stream the servers, users and optionally tokens of DATABASE to OUT as NDJSON."""
+    database = database or MYSQL_CONN
+    return export_rows(get_engine(database), transfer_tables(database, tokens), out,
+                       chunk_size=chunk_size, progress=progress)
+
+
+def import_data(lines, database=None, chunk_size=5000, progress=None):
+    """Insert NDJSON produced by export_data into DATABASE."""
+    database = database or MYSQL_CONN
+    create_schema(database)
+    return import_rows(get_engine(database), transfer_tables(database, tokens=True), lines,
+                       chunk_size=chunk_size, progress=progress)
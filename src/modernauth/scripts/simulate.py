@@ -12,6 +12,9 @@ SECRET_KEY = os.getenv("TEST_SERVER_CODE")
 
 TOKEN = ''.join(random.choices(string.ascii_letters + string.digits, k=30))
 USERNAME = "PyroEdged"
+WAIT_SECONDS = 25
+# Tokens live for 10 minutes.
+MAX_POLLS = 600 // WAIT_SECONDS
 
 def main():
     headers = {"X-Server-Secret": SECRET_KEY}
@@ -32,16 +35,23 @@ def main():
     print(f"{BASE_URL}/auth/{SERVER_ID}/{TOKEN}?username={USERNAME}")
     print("Polling the server to see if you're authorized...")
 
-    while True:
-        time.sleep(1)
-        auth_url = f"{BASE_URL}/api/authstatus/{SERVER_ID}/{TOKEN}"
-        resp = requests.get(auth_url, headers=headers)
-        if resp.status_code == 200:
-            data = resp.json()
-            if data.get("logged_in"):
-                print("You are now authorized with the correct Auth0 account!")
-                break
+    auth_url = f"{BASE_URL}/api/authstatus/{SERVER_ID}/{TOKEN}"
+    for _ in range(MAX_POLLS):
+        started = time.monotonic()
+        try:
+            resp = requests.get(auth_url, headers=headers,
+                                params={"wait": WAIT_SECONDS}, timeout=WAIT_SECONDS + 10)
+        except requests.RequestException as e:
+            print(f"Poll failed: {e}")
+            resp = None
+        if resp is not None and resp.status_code == 200 and resp.json().get("logged_in"):
+            print("You are now authorized with the correct Auth0 account!")
+            return
         print("Still waiting (not authorized yet)...")
+        # A bad secret, an unknown or expired token, or a server that ignores
+        # ``wait`` answers at once; don't poll faster than one per interval.
+        time.sleep(max(WAIT_SECONDS - (time.monotonic() - started), 0))
+    print("Gave up waiting; the token has expired.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,77 @@
+import hashlib, hmac, secrets, threading
+from collections import OrderedDict
+
+
+class VerifiedSecretCache:
+    """Bounded LRU of server secrets that already passed verification.
+
+    Entries are keyed by a BLAKE2b digest of the presented secret under a
+    per-process random key, so the plaintext secret is never kept in memory
+    and the full ``hash_function`` only runs on a cache miss. Each entry
+    remembers the stored hash it was checked against; once ``reset-key``
+    changes that hash the entry no longer matches and is dropped.
+    """
+
+    def __init__(self, server_config, hash_function, max_entries=1024):
+        self.server_config = server_config
+        self.hash = hash_function
+        self.max_entries = max_entries
+        self._keyed = hashlib.blake2b(key=secrets.token_bytes(32), digest_size=16)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, presented: str) -> bytes:
+        digest = self._keyed.copy()
+        digest.update(presented.encode('utf-8'))
+        return digest.digest()
+
+    def _matches(self, presented, expected) -> bool:
+        matches = getattr(self.hash, "matches", None)
+        if matches is not None:
+            return matches(presented, expected)
+        return hmac.compare_digest(self.hash(presented), expected)
+
+    def verify(self, server_id, presented) -> bool:
+        if not server_id or not presented:
+            return False
+        return self._check(server_id, presented, self.server_config.get_secret(server_id))
+
+    async def verify_async(self, server_id, presented) -> bool:
+        """``verify`` that reads the stored hash through the asyncio engine."""
+        if not server_id or not presented:
+            return False
+        return self._check(server_id, presented, await self.server_config.get_secret_async(server_id))
+
+    def _check(self, server_id, presented, expected) -> bool:
+        if not expected:
+            return False
+        digest = self._digest(presented)
+        entry = self._entries.get(digest)
+        if entry is not None:
+            if entry[0] == server_id and hmac.compare_digest(entry[1], expected):
+                try:
+                    self._entries.move_to_end(digest)
+                except KeyError:
+                    pass
+                self.hits += 1
+                return True
+            with self._lock:
+                self._entries.pop(digest, None)
+        self.misses += 1
+        if not self._matches(presented, expected):
+            return False
+        with self._lock:
+            self._entries[digest] = (server_id, expected)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def forget(self, server_id=None):
+        with self._lock:
+            if server_id is None:
+                self._entries.clear()
+                return
+            for digest in [d for d, e in self._entries.items() if e[0] == server_id]:
+                del self._entries[digest]
@@ -0,0 +1,118 @@
+import os, multiprocessing, tempfile
+from importlib.util import find_spec
+from gunicorn.app.base import BaseApplication
+
+WORKER_CLASSES = {
+    "sync": "sync",
+    "gthread": "gthread",
+    "gevent": "gevent",
+    "uvicorn": "uvicorn_worker.UvicornWorker",
+}
+
+
+# Worker classes that hold an idle /api/authstatus long-poll without a
+# thread, best first, with the modules each needs.
+COOPERATIVE = (
+    ("uvicorn", ("uvicorn_worker", "starlette", "a2wsgi", "greenlet")),
+    ("gevent", ("gevent",)),
+)
+
+
+def resolve_worker_class(worker_class):
+    """``auto`` becomes the first cooperative class whose extra is installed,
+    else ``gthread``; other names are returned unchanged."""
+    if worker_class != "auto":
+        return worker_class
+    for name, modules in COOPERATIVE:
+        if all(find_spec(module) is not None for module in modules):
+            return name
+    return "gthread"
+
+
+def long_poll_warning(worker_class, workers, threads):
+    """A warning when pending long-polls would each hold a worker thread."""
+    max_wait = float(os.getenv("AUTHSTATUS_MAX_WAIT", "30"))
+    if worker_class not in ("sync", "gthread") or max_wait <= 0:
+        return None
+    slots = workers * (threads if worker_class == "gthread" else 1)
+    return (
+        f"The {worker_class} worker holds a thread for each pending /api/authstatus long-poll "
+        f"(up to {max_wait:g}s); {slots} of them fill the server and /auth requests queue behind "
+        f"them. Install the asgi or gevent extra and use --worker-class uvicorn or gevent, "
+        f"or set AUTHSTATUS_MAX_WAIT=0."
+    )
+
+
+def remove_sqlite_file(path):
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def default_workers():
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def default_timeout():
+    # A worker must outlive the longest /api/authstatus long-poll.
+    return int(float(os.getenv("AUTHSTATUS_MAX_WAIT", "30"))) + 30
+
+
+class ModernAuthServer(BaseApplication):
+    """Runs ``modernauth.app:app`` under gunicorn with the given settings.
+
+    ``uvicorn`` serves ``modernauth.asgi:app`` instead, whose /api routes
+    are async; it needs the ``asgi`` extra. ``gevent`` runs each request in
+    a greenlet; it needs the ``gevent`` extra. With either, thousands of idle
+    long-polls cost almost nothing. ``gthread`` serves several requests per
+    worker from a thread pool and ``sync`` one at a time; with these, every
+    pending long-poll holds a thread. ``serve`` defaults to ``auto``: the
+    first of uvicorn and gevent that is installed, else gthread. Send SIGHUP
+    to the master to reload workers gracefully.
+    """
+
+    def __init__(self, options, asgi=False):
+        self.options = options
+        self.asgi = asgi
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None and key in self.cfg.settings:
+                self.cfg.set(key, value)
+
+    def load(self):
+        if self.asgi:
+            from modernauth.asgi import app
+        else:
+            from modernauth.app import app
+        return app
+
+
+def serve(bind, workers=None, worker_class="auto", threads=4, keepalive=5, timeout=None,
+          graceful_timeout=30, max_requests=1000, max_requests_jitter=100, preload=False,
+          worker_connections=1000):
+    worker_class = resolve_worker_class(worker_class)
+    options = {
+        "bind": bind,
+        "workers": workers or default_workers(),
+        "worker_class": WORKER_CLASSES[worker_class],
+        "keepalive": keepalive,
+        "timeout": timeout or default_timeout(),
+        "graceful_timeout": graceful_timeout,
+        "max_requests": max_requests,
+        "max_requests_jitter": max_requests_jitter,
+        "preload_app": preload,
+    }
+    if worker_class == "gthread":
+        options["threads"] = threads
+    if worker_class == "gevent":
+        options["worker_connections"] = worker_connections
+    if not os.getenv("METRICS_STORE_PATH"):
+        # One file per master, so /metrics sums this server's workers only.
+        path = os.path.join(tempfile.gettempdir(), f"modernauth-metrics-{os.getpid()}.db")
+        os.environ["METRICS_STORE_PATH"] = path
+        options["on_exit"] = lambda arbiter: remove_sqlite_file(path)
+    ModernAuthServer(options, asgi=worker_class == "uvicorn").run()
@@ -0,0 +1,143 @@
+import os, threading
+from modernauth.hashing import make_hasher
+from modernauth.db.server_config import ServerConfig
+from modernauth.db.userdb import UserDB
+from modernauth.db.tokensystem import TokenSystemDB, TokenSweeper
+from modernauth.db.sessions import make_session_store
+from modernauth.db.sweeper import ExpirySweeper
+from modernauth.secret_cache import VerifiedSecretCache
+from modernauth.auth0 import ManagementTokenCache, make_session
+from modernauth.static import AssetManifest
+
+
+class Services:
+    """The database-backed objects the web app uses, configured from the
+    environment and built the first time each one is used.
+
+    Nothing here connects to the database at import time, and everything is
+    dropped in a forked child so each worker builds its own, including the
+    sweeper threads, which do not survive a fork.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._objects = {}
+        self._lock = threading.RLock()
+
+    def _get(self, name, build):
+        obj = self._objects.get(name)
+        if obj is None:
+            with self._lock:
+                obj = self._objects.get(name)
+                if obj is None:
+                    obj = self._objects[name] = build()
+        return obj
+
+    @property
+    def mysql_connection(self):
+        return os.getenv("MYSQL")
+
+    @property
+    def hasher(self):
+        return self._get("hasher", make_hasher)
+
+    @property
+    def server_config(self):
+        return self._get("server_config", lambda: ServerConfig(
+            mysql_connection=self.mysql_connection,
+            hash_function=self.hasher,
+            cache_ttl=float(os.getenv("SERVER_CONFIG_CACHE_TTL", "30"))
+        ))
+
+    @property
+    def secret_cache(self):
+        def build():
+            secret_cache = VerifiedSecretCache(
+                self.server_config,
+                hash_function=self.hasher,
+                max_entries=int(os.getenv("SECRET_CACHE_SIZE", "1024"))
+            )
+            self.server_config.add_listener(secret_cache.forget)
+            return secret_cache
+
+        return self._get("secret_cache", build)
+
+    @property
+    def userdb(self):
+        return self._get("userdb", lambda: UserDB(
+            mysql_connection=self.mysql_connection,
+            hash_function=self.hasher,
+            cache_size=int(os.getenv("USER_CACHE_SIZE", "10000")),
+            cache_ttl=float(os.getenv("USER_CACHE_TTL", "300")),
+            filter_check_interval=float(os.getenv("USER_FILTER_CHECK_INTERVAL", "1"))
+        ))
+
+    @property
+    def tokens_db(self):
+        def build():
+            tokens_db = TokenSystemDB(
+                mysql_connection=self.mysql_connection,
+                hash_function=self.hasher,
+                backend=os.getenv("TOKEN_STORE", "sql"),
+                store_path=os.getenv("TOKEN_STORE_PATH")
+            )
+            interval = int(os.getenv("TOKEN_SWEEP_INTERVAL", "60"))
+            if interval > 0:
+                TokenSweeper(
+                    tokens_db,
+                    interval=interval,
+                    batch_size=int(os.getenv("TOKEN_SWEEP_BATCH_SIZE", "1000"))
+                ).start()
+            return tokens_db
+
+        return self._get("tokens_db", build)
+
+    @property
+    def session_store(self):
+        def build():
+            store = make_session_store(
+                os.getenv("SESSION_BACKEND"),
+                mysql_connection=self.mysql_connection,
+                path=os.getenv("SESSION_STORE_PATH")
+            )
+            interval = int(os.getenv("SESSION_SWEEP_INTERVAL", "300"))
+            if interval > 0:
+                ExpirySweeper(
+                    store, "sessions",
+                    interval=interval,
+                    batch_size=int(os.getenv("SESSION_SWEEP_BATCH_SIZE", "1000"))
+                ).start()
+            return store
+
+        return self._get("session_store", build)
+
+    @property
+    def assets(self):
+        return self._get("assets", lambda: AssetManifest.load(os.getenv("ASSETS_BUILD_DIR")))
+
+    @property
+    def auth0_http(self):
+        return self._get("auth0_http", lambda: make_session(
+            pool_size=int(os.getenv("AUTH0_HTTP_POOL_SIZE", "10"))
+        ))
+
+    @property
+    def management_tokens(self):
+        return self._get("management_tokens", lambda: ManagementTokenCache(
+            domain=os.getenv("AUTH0_DOMAIN"),
+            client_id=os.getenv("AUTH0_CLIENT_ID"),
+            client_secret=os.getenv("AUTH0_CLIENT_SECRET"),
+            session=self.auth0_http
+        ))
+
+    def built(self, name):
+        """The object called ``name`` if this process has built it, else ``None``."""
+        return self._objects.get(name)
+
+
+services = Services()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=services.reset)
@@ -0,0 +1,144 @@
+import secrets, time
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+
+
+class ServerSideSession(SessionMixin):
+    """Session whose data lives in a session store. Nothing is read until
+    the first key is touched, so requests that never use the session (such
+    as ``/assets/*``) cost no database round trip."""
+
+    def __init__(self, sid=None, load=None):
+        self.sid = sid
+        self.new = sid is None
+        self.modified = False
+        self.expires_at = None
+        self.replaced_sid = None
+        self._load = load
+        self._data = None
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    @property
+    def data(self):
+        if self._data is None:
+            stored = self._load() if self._load is not None else None
+            if stored is None:
+                # Unknown or expired id: start over under a fresh one.
+                self.sid, self.new, self._data = None, True, {}
+            else:
+                self._data, self.expires_at = stored
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self._data = {}
+        self.modified = True
+
+    def regenerate(self):
+        """Move the session to a fresh id when it is saved and delete the row
+        under the old one. Call it on login, so an id handed out before
+        authentication never reaches the authenticated session."""
+        self.data  # load under the old id before dropping it
+        if self.sid is not None:
+            self.replaced_sid = self.sid
+        self.sid = None
+        self.new = True
+        self.modified = True
+
+
+def regenerate_session(session):
+    """``session.regenerate()`` for server-side sessions. Signed-cookie
+    sessions need nothing: their cookie changes with their contents."""
+    regenerate = getattr(session, "regenerate", None)
+    if regenerate is not None:
+        regenerate()
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in ``store`` (see ``modernauth.db.sessions``); the
+    cookie carries only a signed random session id. Sessions expire after
+    ``ttl`` seconds without use; the expiry is pushed back at most once per
+    ``ttl / 2`` so reads do not turn into writes."""
+
+    salt = "modernauth-session-id"
+
+    def __init__(self, store, ttl=7 * 24 * 3600):
+        self.store = store
+        self.ttl = ttl
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt, key_derivation="hmac")
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return ServerSideSession()
+        try:
+            sid = self._signer(app).unsign(cookie).decode("ascii")
+        except (BadSignature, UnicodeDecodeError):
+            return ServerSideSession()
+        return ServerSideSession(sid, load=lambda: self.store.get(sid))
+
+    def save_session(self, app, session, response):
+        if session.accessed:
+            response.vary.add("Cookie")
+        if not session.loaded and not session.modified:
+            return
+        cookie = {
+            "domain": self.get_cookie_domain(app),
+            "path": self.get_cookie_path(app),
+            "secure": self.get_cookie_secure(app),
+            "samesite": self.get_cookie_samesite(app),
+            "httponly": self.get_cookie_httponly(app),
+        }
+        # SESSION_COOKIE_PARTITIONED arrived in Flask 3.1.
+        if hasattr(self, "get_cookie_partitioned"):
+            cookie["partitioned"] = self.get_cookie_partitioned(app)
+        name = self.get_cookie_name(app)
+        now = time.time()
+        if not session:
+            if session.modified:
+                for sid in (session.sid, session.replaced_sid):
+                    if sid is not None:
+                        self.store.delete(sid)
+                response.delete_cookie(name, **cookie)
+            return
+        if session.modified or session.new:
+            session.sid = session.sid or secrets.token_urlsafe(32)
+            if not self.store.put(session.sid, dict(session), now + self.ttl):
+                return
+            if session.replaced_sid is not None:
+                self.store.delete(session.replaced_sid)
+                session.replaced_sid = None
+        elif session.expires_at - now < self.ttl / 2:
+            if not self.store.touch(session.sid, now + self.ttl):
+                return
+        else:
+            return
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode("ascii"),
+            expires=self.get_expiration_time(app, session),
+            **cookie
+        )
@@ -0,0 +1,65 @@
+import base64, hashlib, hmac, json, secrets, time
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class SignedTokenCodec:
+    """Issues and verifies self-contained login tokens.
+
+    A token is ``v1.<payload>.<signature>``: base64url JSON holding the
+    server id, username, expiry and a random nonce, signed with HMAC-SHA256.
+    Verifying one needs no database access.
+    """
+
+    prefix = "v1"
+
+    def __init__(self, key, ttl=600):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        if not key:
+            raise ValueError("A signing key is required for stateless tokens.")
+        self.key = key
+        self.ttl = ttl
+
+    def _sign(self, payload: str) -> str:
+        mac = hmac.new(self.key, f"{self.prefix}.{payload}".encode("ascii"), hashlib.sha256)
+        return _b64encode(mac.digest())
+
+    def issue(self, server_id, username, ttl=None) -> str:
+        claims = {
+            "s": server_id,
+            "u": username,
+            "e": int(time.time() + (self.ttl if ttl is None else ttl)),
+            "n": secrets.token_urlsafe(9),
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return f"{self.prefix}.{payload}.{self._sign(payload)}"
+
+    def verify(self, token, server_id=None):
+        """Return the token data for a valid, unexpired token, else ``None``."""
+        try:
+            prefix, payload, signature = token.split(".")
+            if prefix != self.prefix or not hmac.compare_digest(
+                    signature.encode("ascii"), self._sign(payload).encode("ascii")):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (AttributeError, ValueError):
+            return None
+        if not isinstance(claims, dict) or not isinstance(claims.get("e"), int):
+            return None
+        if claims["e"] <= time.time():
+            return None
+        if server_id is not None and claims.get("s") != server_id:
+            return None
+        return {
+            "username": claims.get("u"),
+            "server_id": claims.get("s"),
+            "expiration_time": claims.get("e"),
+            "authorized": False,
+        }
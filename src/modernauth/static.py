@@ -0,0 +1,168 @@
+"""Fingerprinted, precompressed copies of the files in ``modernauth/assets``.
+
+``build`` (``modernauth build-assets``) writes each asset to the build
+directory under a content-hashed name such as ``style.1a2b3c4d5e6f7a8b.css``,
+plus ``.gz`` and, when the ``brotli`` package is installed, ``.br`` variants
+of the ones that compress, and records the names in ``manifest.json``. A
+fingerprinted URL always names the same bytes, so it is served as immutable
+and browsers stop asking for it; the build directory can equally be served
+as-is by a reverse proxy or CDN.
+"""
+import gzip, hashlib, json, mimetypes, os, posixpath, tempfile
+from collections import namedtuple
+from werkzeug.http import parse_accept_header
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), "assets")
+MANIFEST = "manifest.json"
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Formats that are compressed already; gzip or brotli would not shrink them.
+PRECOMPRESSED = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".ico", ".woff", ".woff2", ".gz", ".br", ".zip"}
+# Keep a compressed variant only if it is at most this fraction of the original.
+MIN_RATIO = 0.95
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+Asset = namedtuple("Asset", "file mimetype etag headers")
+
+
+def default_build_dir():
+    return os.getenv("ASSETS_BUILD_DIR") or os.path.join(tempfile.gettempdir(), "modernauth-assets")
+
+
+def compressors():
+    """``(encoding, compress)`` for each available encoding, best first."""
+    available = []
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        available.append(("br", lambda data: brotli.compress(data, quality=11)))
+    available.append(("gzip", lambda data: gzip.compress(data, compresslevel=9, mtime=0)))
+    return available
+
+
+def source_files(source_dir):
+    """Relative, ``/``-separated names of the files under ``source_dir``."""
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for name in sorted(files):
+            yield os.path.relpath(os.path.join(root, name), source_dir).replace(os.sep, "/")
+
+
+def digest(data):
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def source_digest(source_dir):
+    """One digest over every source file's name and contents."""
+    h = hashlib.blake2b(digest_size=8)
+    for name in source_files(source_dir):
+        with open(os.path.join(source_dir, name), "rb") as f:
+            h.update(name.encode() + b"\0" + f.read() + b"\0")
+    return h.hexdigest()
+
+
+def write_file(build_dir, name, data):
+    # Written under a temporary name and renamed, so a worker building at the
+    # same time, or reading the manifest, never sees a partial file.
+    path = os.path.join(build_dir, *name.split("/"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp creates 0600; a proxy serving the directory must read it.
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def build(source_dir=SOURCE_DIR, build_dir=None):
+    """Write the fingerprinted and compressed assets and the manifest into
+    ``build_dir``; return the manifest. Earlier builds are left in place so
+    pages rendered before a deploy can still load their assets."""
+    build_dir = build_dir or default_build_dir()
+    files = {}
+    for name in source_files(source_dir):
+        with open(os.path.join(source_dir, name), "rb") as f:
+            data = f.read()
+        etag = digest(data)
+        stem, ext = posixpath.splitext(name)
+        fingerprinted = f"{stem}.{etag}{ext}"
+        write_file(build_dir, fingerprinted, data)
+        encodings = []
+        if ext.lower() not in PRECOMPRESSED:
+            for encoding, compress in compressors():
+                packed = compress(data)
+                if len(packed) <= len(data) * MIN_RATIO:
+                    write_file(build_dir, fingerprinted + SUFFIXES[encoding], packed)
+                    encodings.append(encoding)
+        files[name] = {"path": fingerprinted, "etag": etag, "encodings": encodings}
+    manifest = {"source": source_digest(source_dir), "files": files}
+    write_file(build_dir, MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class AssetManifest:
+    """Maps asset names to their fingerprinted URLs and picks the file and
+    headers to answer an asset request with."""
+
+    def __init__(self, build_dir, manifest, source_dir=SOURCE_DIR):
+        self.build_dir = build_dir
+        self.source_dir = source_dir
+        self.files = manifest["files"]
+        self.fingerprinted = {entry["path"]: name for name, entry in self.files.items()}
+
+    @classmethod
+    def load(cls, build_dir=None, source_dir=SOURCE_DIR):
+        """The manifest in ``build_dir``, built first if it is missing or
+        does not match the current source files."""
+        build_dir = build_dir or default_build_dir()
+        try:
+            with open(os.path.join(build_dir, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        if manifest is None or manifest.get("source") != source_digest(source_dir):
+            manifest = build(source_dir, build_dir)
+        return cls(build_dir, manifest, source_dir)
+
+    def path(self, name):
+        """The fingerprinted name for ``name``, or ``name`` if it is unknown."""
+        entry = self.files.get(name)
+        return entry["path"] if entry else name
+
+    def resolve(self, path, accept_encoding=None):
+        """The ``Asset`` to send for ``path``, or ``None`` if there is none.
+
+        Fingerprinted names are cached for a year; plain names, as linked
+        before fingerprinting, must be revalidated with their ETag. Either
+        is sent in the best encoding that ``accept_encoding`` allows.
+        """
+        name = self.fingerprinted.get(path)
+        immutable = name is not None
+        if name is None:
+            name = path
+        entry = self.files.get(name)
+        if entry is None:
+            return None
+        accepted = parse_accept_header(accept_encoding)
+        encoding = next((e for e in entry["encodings"] if accepted.quality(e) > 0), None)
+        file = os.path.join(self.build_dir, *entry["path"].split("/"))
+        etag = entry["etag"]
+        headers = {"Cache-Control": IMMUTABLE if immutable else "no-cache"}
+        if entry["encodings"]:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding is not None:
+            file += SUFFIXES[encoding]
+            etag = f"{etag}.{encoding}"
+            headers["Content-Encoding"] = encoding
+        headers["ETag"] = f'"{etag}"'
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if not os.path.exists(file):
+            # Cleared from under us (a tmp cleaner, say); the same sources
+            # rebuild to the same names.
+            build(self.source_dir, self.build_dir)
+        return Asset(file, mimetype, etag, headers)
@@ -0,0 +1,52 @@
+import pytest
+from modernauth.hashing import Hasher
+from modernauth.db.engine import dispose_engines
+from modernauth.db.schema import init_db
+from modernauth.db.tokensystem import TokenSystemDB
+
+TOKEN_BACKENDS = ["sql", "sqlite", "memory"]
+
+
+@pytest.fixture
+def hasher():
+    return Hasher(key="test-key")
+
+
+@pytest.fixture(params=TOKEN_BACKENDS)
+def tokens_db(request, tmp_path, hasher):
+    """A ``TokenSystemDB`` on each token store backend: ``sql`` on a SQLite
+    database file, ``sqlite`` on a host-local file, and ``memory``."""
+    tokens_db = TokenSystemDB(
+        mysql_connection=f"sqlite:///{tmp_path / 'main.db'}",
+        hash_function=hasher,
+        backend=request.param,
+        store_path=str(tmp_path / "tokens.db")
+    )
+    tokens_db.create_schema()
+    yield tokens_db
+    dispose_engines()
+
+
+@pytest.fixture
+def app_env(monkeypatch, tmp_path):
+    """Point the web app's lazily built services at a fresh SQLite database."""
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    monkeypatch.setenv("MYSQL", url)
+    monkeypatch.setenv("APP_SECRET_KEY", "test-secret")
+    monkeypatch.setenv("AUTH0_DOMAIN", "auth.invalid")
+    monkeypatch.setenv("TOKEN_SWEEP_INTERVAL", "0")
+    monkeypatch.setenv("RATELIMIT_STORAGE_URI", "memory://")
+    init_db(url)
+    from modernauth.services import services
+    services.reset()
+    yield services
+    services.reset()
+    dispose_engines()
+
+
+@pytest.fixture
+def client(app_env):
+    from modernauth.app import app, limiter
+    limiter.enabled = False
+    yield app.test_client()
+    limiter.enabled = True
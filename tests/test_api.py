@@ -0,0 +1,38 @@
+def test_isuser_batch_requires_server_secret(client, app_env):
+    app_env.server_config.upsert("srv", {"secret_key": app_env.hasher("secret")})
+    app_env.userdb.signup("srv", "alice", "auth0|alice")
+    body = {"server_id": "srv", "usernames": ["alice", "bob"]}
+    assert client.post("/api/isuser/batch", json=body).status_code == 403
+    assert client.post("/api/isuser/batch", json=body, headers={"X-Server-Secret": "wrong"}).status_code == 403
+    response = client.post("/api/isuser/batch", json=body, headers={"X-Server-Secret": "secret"})
+    assert response.get_json() == {"exists": {"alice": True, "bob": False}}
+
+
+def test_replayed_stateless_token_is_refused(client, app_env, monkeypatch):
+    from modernauth import app as app_module
+    from modernauth.signed_tokens import SignedTokenCodec
+    signer = SignedTokenCodec("signing-key")
+    monkeypatch.setattr(app_module, "STATELESS_TOKENS", True)
+    monkeypatch.setattr(app_module, "token_signer", signer)
+    app_env.userdb.signup("srv", "alice", "auth0|alice")
+    token = signer.issue("srv", "alice")
+    with client.session_transaction() as sess:
+        sess["user"] = {"sub": "auth0|alice"}
+    first = client.get(f"/auth/srv/{token}?username=alice").get_data(as_text=True)
+    assert "Logged in as alice" in first
+    replay = client.get(f"/auth/srv/{token}?username=alice").get_data(as_text=True)
+    assert "Logged in as" not in replay
+    assert "already used" in replay
+
+
+def test_batch_endpoints_reject_a_malformed_body_with_400(client, app_env):
+    app_env.server_config.upsert("srv", {"secret_key": app_env.hasher("secret")})
+    secret = {"X-Server-Secret": "secret"}
+    for url, field in (("/api/authstatus/batch", "tokens"), ("/api/isuser/batch", "usernames")):
+        assert client.post(url, json=["srv"], headers=secret).status_code == 400
+        assert client.post(url, json={"server_id": "srv"}, headers=secret).status_code == 400
+        assert client.post(url, json={"server_id": "srv", field: [1]}, headers=secret).status_code == 400
+        assert client.post(url, data="not json", headers=secret).status_code == 400
+        assert client.post(url, json={"server_id": "srv", field: []}).status_code == 403
+    response = client.post("/api/authstatus/batch", json={"server_id": "srv", "tokens": ["t"]}, headers=secret)
+    assert response.get_json() == {"statuses": {"t": False}}
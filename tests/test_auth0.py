@@ -0,0 +1,117 @@
+"""``ManagementTokenCache`` against a stub Auth0 token endpoint."""
+import threading, time
+import requests
+from modernauth import auth0
+from modernauth.auth0 import ManagementTokenCache
+
+
+class StubResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {}
+        self.text = str(self.body)
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+
+class StubAuth0:
+    """Stands in for the ``requests.Session``: hands out numbered tokens from
+    ``/oauth/token`` and answers every other POST with ``api_status``."""
+
+    def __init__(self, expires_in=86400, delay=0.0, api_status=201):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.api_status = api_status
+        self.token_requests = 0
+        self.api_tokens = []
+        self._lock = threading.Lock()
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        if url.endswith("/oauth/token"):
+            time.sleep(self.delay)
+            with self._lock:
+                self.token_requests += 1
+                n = self.token_requests
+            return StubResponse(200, {"access_token": f"token{n}", "expires_in": self.expires_in})
+        self.api_tokens.append(headers["Authorization"])
+        return StubResponse(self.api_status)
+
+
+def make_cache(stub, **kwargs):
+    return ManagementTokenCache("auth.invalid", "client", "secret", session=stub, **kwargs)
+
+
+def test_concurrent_callers_share_one_refresh():
+    stub = StubAuth0(delay=0.05)
+    cache = make_cache(stub)
+    barrier = threading.Barrier(20)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(cache.get())
+
+    threads = [threading.Thread(target=run) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stub.token_requests == 1
+    assert results == ["token1"] * 20
+
+
+def test_refreshes_before_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(auth0.time, "monotonic", lambda: now[0])
+    stub = StubAuth0(expires_in=1000)
+    cache = make_cache(stub, refresh_margin=300)
+    assert cache.get() == "token1"
+    now[0] += 699
+    assert cache.get() == "token1"
+    now[0] += 1
+    assert cache.get() == "token2"
+    assert stub.token_requests == 2
+
+
+def test_short_lived_tokens_are_kept_for_half_their_lifetime(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(auth0.time, "monotonic", lambda: now[0])
+    stub = StubAuth0(expires_in=400)
+    cache = make_cache(stub, refresh_margin=300)
+    assert cache.get() == "token1"
+    now[0] += 199
+    assert cache.get() == "token1"
+    now[0] += 1
+    assert cache.get() == "token2"
+
+
+def test_invalidate_forces_a_new_token():
+    stub = StubAuth0()
+    cache = make_cache(stub)
+    assert cache.get() == "token1"
+    cache.invalidate()
+    assert cache.get() == "token2"
+
+
+def test_link_callback_drops_the_token_on_401(client, app_env, monkeypatch):
+    from modernauth.app import oauth
+    stub = StubAuth0(api_status=401)
+    app_env._objects["auth0_http"] = stub
+    monkeypatch.setattr(oauth.auth0, "authorize_access_token",
+                        lambda: {"userinfo": {"sub": "google-oauth2|42"}})
+
+    def link():
+        with client.session_transaction() as sess:
+            sess["user"] = {"sub": "auth0|alice"}
+            sess["linking"] = "google"
+        return client.get("/link_callback/google")
+
+    assert b"Error linking account" in link().data
+    stub.api_status = 201
+    assert b"Successfully linked" in link().data
+    assert stub.api_tokens == ["Bearer token1", "Bearer token2"]
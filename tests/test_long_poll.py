@@ -0,0 +1,35 @@
+import threading, time
+
+
+def counting_reads(tokens_db):
+    reads = []
+    get = tokens_db.store.get
+
+    def counted(htok):
+        reads.append(htok)
+        return get(htok)
+
+    tokens_db.store.get = counted
+    return reads
+
+
+def test_wake_without_authorization_does_not_spin(tokens_db):
+    # A wake-up that finds the token still unauthorized (a duplicate poll,
+    # or a spent stateless grant) must go back to sleep, not re-read in a loop.
+    tokens_db.create_token("player", "tok", server_id="srv")
+    reads = counting_reads(tokens_db)
+    threading.Timer(0.05, tokens_db._notify_waiters, args=(tokens_db._h("tok"),)).start()
+    started = time.monotonic()
+    token_data = tokens_db.wait_for_authorization("tok", 0.5, server_id="srv", poll_interval=0.1)
+    assert time.monotonic() - started >= 0.5
+    assert not token_data["authorized"]
+    assert len(reads) <= 2 * (0.5 / 0.1 + 2)
+
+
+def test_authorization_wakes_waiter(tokens_db):
+    tokens_db.create_token("player", "tok", server_id="srv")
+    threading.Timer(0.05, tokens_db.authorize_token, args=("tok",)).start()
+    started = time.monotonic()
+    token_data = tokens_db.wait_for_authorization("tok", 5, server_id="srv", poll_interval=5)
+    assert token_data["authorized"]
+    assert time.monotonic() - started < 1
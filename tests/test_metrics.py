@@ -0,0 +1,49 @@
+from modernauth.metrics import MetricsRegistry, SharedMetrics
+
+
+def make_registry(path):
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ("route",))
+    latency = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    registry.shared = SharedMetrics(registry, str(path), interval=60)
+    return registry, requests, latency
+
+
+def test_scrape_sums_every_process(tmp_path):
+    path = tmp_path / "metrics.db"
+    a, a_requests, a_latency = make_registry(path)
+    b, b_requests, b_latency = make_registry(path)
+    a_requests.inc("/", amount=3)
+    b_requests.inc("/", amount=4)
+    a_latency.observe(0.05, "/")
+    b_latency.observe(0.5, "/")
+    b.shared.flush()
+    text = a.render()
+    assert 'requests_total{route="/"} 7.0' in text
+    assert 'latency_seconds_bucket{route="/",le="0.1"} 1.0' in text
+    assert 'latency_seconds_bucket{route="/",le="1.0"} 2.0' in text
+    assert 'latency_seconds_count{route="/"} 2.0' in text
+    # A second scrape does not add the same counts again.
+    assert 'requests_total{route="/"} 7.0' in b.render()
+
+
+def test_totals_survive_a_worker_restart(tmp_path):
+    path = tmp_path / "metrics.db"
+    old, old_requests, _ = make_registry(path)
+    old_requests.inc("/", amount=5)
+    old.shared.flush()
+    new, new_requests, _ = make_registry(path)
+    new_requests.inc("/")
+    assert 'requests_total{route="/"} 6.0' in new.render()
+
+
+def test_metrics_endpoint_requires_token(client, monkeypatch):
+    import modernauth.app as app_module
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", None)
+    assert client.get("/metrics").status_code == 404
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", "scrape-token")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-token"})
+    assert response.status_code == 200
+    assert "modernauth_http_requests_total" in response.get_data(as_text=True)
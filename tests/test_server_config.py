@@ -0,0 +1,44 @@
+"""``ServerConfig`` writes and its in-process cache."""
+import pytest
+from sqlalchemy import event
+from modernauth.db.engine import dispose_engines
+from modernauth.db.server_config import ServerConfig
+
+
+@pytest.fixture
+def server_config(tmp_path, hasher):
+    config = ServerConfig(f"sqlite:///{tmp_path / 'servers.db'}", hasher)
+    config.create_schema()
+    yield config
+    dispose_engines()
+
+
+def count_queries(config):
+    statements = []
+    event.listen(config.engine.engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+def test_update_secret_is_one_statement(server_config, hasher):
+    server_config.upsert("srv", {"secret_key": hasher("old"), "name": "Server"})
+    statements = count_queries(server_config)
+    assert server_config.update_secret("srv", "new")
+    assert len(statements) == 1
+    assert server_config.get("srv") == {"secret_key": hasher("new"), "name": "Server"}
+    assert not server_config.update_secret("missing", "new")
+    assert server_config.get("missing") is None
+
+
+def test_unknown_ids_evict_only_the_least_recently_used(tmp_path, hasher):
+    config = ServerConfig(f"sqlite:///{tmp_path / 'servers.db'}", hasher, cache_size=3)
+    config.create_schema()
+    config.upsert("srv", {"secret_key": hasher("secret")})
+    assert config.get_secret("srv") == hasher("secret")
+    statements = count_queries(config)
+    for i in range(10):
+        assert config.get(f"random{i}") is None
+        assert config.get_secret("srv") == hasher("secret")
+    assert len(statements) == 10
+    assert len(config._cache) == 3
+    dispose_engines()
@@ -0,0 +1,70 @@
+from flask import Flask, session
+from modernauth import metrics
+from modernauth.db.sweeper import ExpirySweeper
+from modernauth.db.sessions import SQLiteSessionStore
+from modernauth.sessions import ServerSideSessionInterface, regenerate_session
+
+
+def make_app(store):
+    app = Flask(__name__)
+    app.secret_key = "test-secret"
+    app.session_interface = ServerSideSessionInterface(store)
+
+    @app.route("/visit")
+    def visit():
+        session["next"] = "/settings"
+        return "ok"
+
+    @app.route("/login")
+    def login():
+        regenerate_session(session)
+        session["user"] = {"sub": "auth0|victim"}
+        return "ok"
+
+    @app.route("/whoami")
+    def whoami():
+        return {"user": session.get("user"), "next": session.get("next")}
+
+    return app
+
+
+def session_cookie(client):
+    return client.get_cookie("session").value
+
+
+def test_login_moves_session_to_a_new_id(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    app = make_app(store)
+    victim = app.test_client()
+    victim.get("/visit")
+    before = session_cookie(victim)
+    victim.get("/login")
+    after = session_cookie(victim)
+    assert after != before
+    # Data set before login carries over under the new id.
+    assert victim.get("/whoami").get_json() == {"user": {"sub": "auth0|victim"}, "next": "/settings"}
+
+    attacker = app.test_client()
+    attacker.set_cookie("session", before)
+    assert attacker.get("/whoami").get_json() == {"user": None, "next": None}
+    with store.engine.connect() as conn:
+        assert len(conn.execute(store.sessions.select()).all()) == 1
+
+
+def test_sweep_expired_removes_only_expired(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    store.put("live", {"a": 1}, 2 ** 40)
+    for i in range(5):
+        store.put(f"old{i}", {}, 1)
+    assert store.sweep_expired(batch_size=2)[0] == 5
+    assert store.get("live") == ({"a": 1}, 2 ** 40)
+
+
+def test_sweeps_are_published_as_metrics(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    for i in range(3):
+        store.put(f"old{i}", {}, 1)
+    before = metrics.expired_rows_swept.snapshot().get((("sessions",), 0), 0)
+    assert ExpirySweeper(store, "sessions", batch_size=2).sweep_once() == 3
+    assert metrics.expired_rows_swept.snapshot()[(("sessions",), 0)] == before + 3
+    assert 'modernauth_sweep_duration_seconds_count{what="sessions"}' in metrics.REGISTRY.render()
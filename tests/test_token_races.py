@@ -0,0 +1,71 @@
+"""Concurrent pollers racing for the same authorized tokens: each token must
+be handed out exactly once."""
+import threading
+
+THREADS = 16
+ROUNDS = 20
+
+
+def race(workers):
+    """Run every callable in ``workers`` at once; return their results."""
+    barrier = threading.Barrier(len(workers))
+    results = [None] * len(workers)
+
+    def run(i):
+        barrier.wait()
+        results[i] = workers[i]()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_consume_if_authorized_has_one_winner(tokens_db):
+    for round_ in range(ROUNDS):
+        token = f"token{round_}"
+        tokens_db.create_token("player", token, server_id="srv")
+        assert tokens_db.authorize_token(token)
+        results = race([lambda: tokens_db.consume_if_authorized("srv", token)] * THREADS)
+        winners = [r for r in results if r is not None]
+        assert len(winners) == 1
+        assert winners[0]["username"] == "player"
+        assert tokens_db.get_token_data(token) is None
+
+
+def test_consume_authorized_batch_hands_out_each_token_once(tokens_db):
+    tokens = [f"token{i}" for i in range(50)]
+    for i, token in enumerate(tokens):
+        tokens_db.create_token(f"player{i}", token, server_id="srv")
+        assert tokens_db.authorize_token(token)
+    results = race([lambda: tokens_db.consume_authorized("srv", tokens)] * THREADS)
+    handed_out = [token for consumed in results for token in consumed]
+    assert sorted(handed_out) == sorted(tokens)
+
+
+def test_unauthorized_token_survives_polling(tokens_db):
+    tokens_db.create_token("player", "pending", server_id="srv")
+    results = race([lambda: tokens_db.consume_if_authorized("srv", "pending")] * THREADS)
+    assert results == [None] * THREADS
+    assert tokens_db.authorize_token("pending")
+    assert tokens_db.consume_if_authorized("srv", "pending")["username"] == "player"
+
+
+def test_consume_checks_server(tokens_db):
+    tokens_db.create_token("player", "tok", server_id="srv")
+    assert tokens_db.authorize_token("tok")
+    assert tokens_db.consume_if_authorized("other", "tok") is None
+    assert tokens_db.consume_if_authorized("srv", "tok") is not None
+
+
+def test_authstatus_reports_an_authorized_token_once(client, app_env):
+    # The consume is the whole check: no membership lookup afterwards can
+    # turn an authorized, already deleted token into "logged_in": false.
+    app_env.server_config.upsert("srv", {"secret_key": app_env.hasher("secret")})
+    app_env.tokens_db.create_token("player", "tok", server_id="srv")
+    assert app_env.tokens_db.authorize_token("tok")
+    headers = {"X-Server-Secret": "secret"}
+    results = race([lambda: client.get("/api/authstatus/srv/tok", headers=headers).get_json()] * 8)
+    assert sorted(r["logged_in"] for r in results) == [False] * 7 + [True]
@@ -0,0 +1,210 @@
+"""The ``TokenStore`` contract, checked against every backend."""
+import asyncio, time
+import pytest
+from sqlalchemy import event
+from modernauth.db.engine import dispose_engines, get_engine
+from modernauth.db.token_stores import MemoryTokenStore, SQLTokenStore, TokenStore
+from modernauth.db.tokensystem import TokenSystemDB
+from modernauth.hashing import legacy_hash
+
+
+@pytest.fixture
+def store(tokens_db):
+    return tokens_db.store
+
+
+def later(seconds=60):
+    return time.time() + seconds
+
+
+def test_put_and_get_round_trip(store):
+    assert store.put("t1", "alice", "srv", later(), extra={"ip": "10.0.0.1"})
+    data = store.get("t1")
+    assert data["username"] == "alice"
+    assert data["server_id"] == "srv"
+    assert data["authorized"] is False
+    assert data["ip"] == "10.0.0.1"
+    assert data["expiration_time"] > time.time()
+
+
+def test_put_without_replace_keeps_the_existing_token(store):
+    assert store.put("t1", "alice", "srv", later())
+    assert not store.put("t1", "mallory", "srv", later(), replace=False)
+    assert store.get("t1")["username"] == "alice"
+    assert store.put("t1", "bob", "srv", later())
+    assert store.get("t1")["username"] == "bob"
+
+
+def test_expired_tokens_are_not_returned(store):
+    store.put("old", "alice", "srv", later(-1), authorized=True)
+    assert store.get("old") is None
+    assert not store.authorize("old")
+    assert store.consume("old", "srv") is None
+    assert store.consume_many(["old"], "srv") == {}
+    assert store.authorized(["old"]) == set()
+
+
+def test_delete(store):
+    store.put("t1", "alice", "srv", later())
+    store.delete("t1")
+    assert store.get("t1") is None
+    store.delete("missing")
+
+
+def test_authorize(store):
+    store.put("t1", "alice", "srv", later())
+    assert store.authorize("t1")
+    assert store.get("t1")["authorized"] is True
+    assert not store.authorize("missing")
+
+
+def test_consume_needs_an_authorized_token_for_the_server(store):
+    store.put("t1", "alice", "srv", later())
+    assert store.consume("t1", "srv") is None
+    store.authorize("t1")
+    assert store.consume("t1", "other") is None
+    data = store.consume("t1", "srv")
+    assert data["username"] == "alice"
+    assert store.get("t1") is None
+    assert store.consume("t1", "srv") is None
+
+
+def test_consume_keep_spent_leaves_the_token_unauthorized(store):
+    store.put("t1", "alice", "srv", later(), authorized=True)
+    assert store.consume("t1", "srv", keep_spent=True)["username"] == "alice"
+    assert store.get("t1")["authorized"] is False
+    assert store.consume("t1", "srv", keep_spent=True) is None
+    assert not store.put("t1", "alice", "srv", later(), replace=False)
+
+
+def test_consume_many(store):
+    for i in range(5):
+        store.put(f"t{i}", f"user{i}", "srv", later(), authorized=i % 2 == 0)
+    store.put("elsewhere", "eve", "other", later(), authorized=True)
+    tokens = [f"t{i}" for i in range(5)] + ["elsewhere", "missing"]
+    assert store.consume_many(tokens, "srv") == {"t0": "user0", "t2": "user2", "t4": "user4"}
+    assert store.consume_many(tokens, "srv") == {}
+    assert store.get("t1") is not None
+    assert store.get("elsewhere") is not None
+    assert store.consume_many([], "srv") == {}
+
+
+def test_consume_many_keep_spent(store):
+    store.put("t1", "alice", "srv", later(), authorized=True)
+    assert store.consume_many(["t1"], "srv", keep_spent=True) == {"t1": "alice"}
+    assert store.get("t1")["authorized"] is False
+    assert store.consume_many(["t1"], "srv", keep_spent=True) == {}
+
+
+def test_authorized(store):
+    store.put("a", "alice", "srv", later(), authorized=True)
+    store.put("b", "bob", "srv", later())
+    assert store.authorized(["a", "b", "missing"]) == {"a"}
+
+
+def test_sweep_removes_only_expired_tokens(store):
+    for i in range(5):
+        store.put(f"old{i}", "alice", "srv", later(-1))
+    store.put("live", "bob", "srv", later())
+    assert store.sweep(3) == 3
+    assert store.sweep(10) == 2
+    assert store.sweep(10) == 0
+    assert store.get("live") is not None
+
+
+def test_rehash_converts_legacy_keys(store):
+    store.put("legacy", "alice", "srv", later(), authorized=True)
+    store.put("2$current", "bob", "srv", later())
+    assert store.rehash(lambda htok: "2$" + htok, batch_size=1) == 1
+    assert store.get("legacy") is None
+    assert store.get("2$legacy")["username"] == "alice"
+    assert store.get("2$current")["username"] == "bob"
+    assert store.rehash(lambda htok: "2$" + htok, batch_size=1) == 0
+
+
+def test_async_forms(store):
+    async def run():
+        assert await store.put_async("t1", "alice", "srv", later(), extra={"ip": "10.0.0.1"})
+        assert not await store.put_async("t1", "mallory", "srv", later(), replace=False)
+        assert (await store.get_async("t1"))["ip"] == "10.0.0.1"
+        assert await store.consume_async("t1", "srv") is None
+        store.authorize("t1")
+        assert await store.authorized_async(["t1", "missing"]) == {"t1"}
+        assert (await store.consume_async("t1", "srv"))["username"] == "alice"
+        assert await store.get_async("t1") is None
+
+        await store.put_async("t2", "bob", "srv", later(), authorized=True)
+        await store.put_async("t3", "carol", "srv", later())
+        assert await store.consume_many_async(["t2", "t3"], "srv") == {"t2": "bob"}
+        assert await store.consume_many_async(["t2", "t3"], "srv") == {}
+
+        async_engine = getattr(store, "_async_engine", None)
+        if async_engine is not None:
+            await async_engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_an_incomplete_store_fails_at_construction():
+    class NoSweep(TokenStore):
+        def put(self, htok, username, server_id, expires_at, authorized=False, extra=None, replace=True):
+            return True
+
+    with pytest.raises(TypeError, match="sweep"):
+        NoSweep()
+
+
+def test_tokens_are_looked_up_under_the_current_digest_only(hasher):
+    class CountingStore(MemoryTokenStore):
+        def __init__(self):
+            super().__init__()
+            self.gets = []
+
+        def get(self, htok):
+            self.gets.append(htok)
+            return super().get(htok)
+
+    store = CountingStore()
+    tokens_db = TokenSystemDB(mysql_connection=None, hash_function=hasher, store=store)
+    store.put(legacy_hash("old"), "alice", "srv", later(), authorized=True)
+    assert tokens_db.get_token_data("old") is None
+    assert tokens_db.get_token_data("missing") is None
+    assert store.gets == [hasher("old"), hasher("missing")]
+    assert tokens_db.rehash() == 1
+    assert tokens_db.consume_if_authorized("srv", "old")["username"] == "alice"
+
+
+def test_sql_consume_many_is_one_statement(tmp_path):
+    store = SQLTokenStore(get_engine(f"sqlite:///{tmp_path / 'tokens.db'}"))
+    store.create_schema()
+    for i in range(20):
+        store.put(f"t{i}", f"user{i}", "srv", later(), authorized=True)
+    statements = []
+    event.listen(store.engine.engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    assert len(store.consume_many([f"t{i}" for i in range(20)], "srv")) == 20
+    assert len(statements) == 1
+    dispose_engines()
+
+
+@pytest.mark.parametrize("keep_spent", [False, True])
+def test_sql_consume_many_without_returning(tmp_path, monkeypatch, keep_spent):
+    # MySQL, and every dialect on SQLAlchemy 1.4, lock the rows and then
+    # take them with one statement.
+    store = SQLTokenStore(get_engine(f"sqlite:///{tmp_path / 'tokens.db'}"))
+    store.create_schema()
+    # SQLAlchemy 1.4 dialects have no such flags at all.
+    assert store._consume_many_returning(object(), ["t0"], "srv", 0, keep_spent) is None
+    monkeypatch.setattr(store.engine.dialect, "update_returning", False)
+    monkeypatch.setattr(store.engine.dialect, "delete_returning", False)
+    for i in range(3):
+        store.put(f"t{i}", f"user{i}", "srv", later(), authorized=i < 2)
+    statements = []
+    event.listen(store.engine.engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement.split()[0]))
+    tokens = ["t0", "t1", "t2", "missing"]
+    assert store.consume_many(tokens, "srv", keep_spent=keep_spent) == {"t0": "user0", "t1": "user1"}
+    assert statements == ["SELECT", "UPDATE" if keep_spent else "DELETE"]
+    assert store.consume_many(tokens, "srv", keep_spent=keep_spent) == {}
+    assert asyncio.run(store.consume_many_async(tokens, "srv", keep_spent=keep_spent)) == {}
+    dispose_engines()
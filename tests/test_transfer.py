@@ -0,0 +1,32 @@
+import io, json
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, event, func, select
+from modernauth.db.transfer import export_rows, import_rows
+
+
+def make_table(url):
+    engine = create_engine(url)
+    table = Table("items", MetaData(), Column("id", Integer, primary_key=True), Column("name", String(20)))
+    table.metadata.create_all(engine)
+    return engine, table
+
+
+def test_import_skips_existing_rows_in_one_statement(tmp_path):
+    source, source_table = make_table(f"sqlite:///{tmp_path / 'source.db'}")
+    with source.begin() as conn:
+        conn.execute(source_table.insert(), [{"id": i, "name": f"item{i}"} for i in range(10)])
+    out = io.StringIO()
+    assert export_rows(source, {"items": source_table}, out) == {"items": 10}
+    lines = out.getvalue().splitlines()
+
+    target, table = make_table(f"sqlite:///{tmp_path / 'target.db'}")
+    assert import_rows(target, {"items": table}, lines[:4]) == {"items": (4, 4)}
+
+    inserts = []
+    event.listen(target, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: inserts.append(statement))
+    assert import_rows(target, {"items": table}, lines) == {"items": (10, 6)}
+    assert len(inserts) == 1
+    with target.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(table)).scalar() == 10
+        assert conn.execute(select(table.c.name).where(table.c.id == 9)).scalar() == "item9"
+    assert json.loads(lines[0])["table"] == "items"
@@ -0,0 +1,108 @@
+"""The membership cache in ``UserDB``, with two instances on one database
+standing in for two workers."""
+import asyncio, time
+import pytest
+from sqlalchemy import event
+from modernauth.db import userdb as userdb_module
+from modernauth.db.engine import dispose_engines
+from modernauth.db.userdb import UserDB
+
+
+@pytest.fixture
+def make_userdb(tmp_path, hasher):
+    url = f"sqlite:///{tmp_path / 'users.db'}"
+
+    def make(**kwargs):
+        userdb = UserDB(mysql_connection=url, hash_function=hasher, **kwargs)
+        userdb.create_schema()
+        return userdb
+
+    yield make
+    dispose_engines()
+
+
+def count_queries(userdb):
+    statements = []
+    event.listen(userdb.engine.engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+def test_unknown_names_are_answered_by_the_filter(make_userdb):
+    userdb = make_userdb(filter_check_interval=60)
+    userdb.signup("srv", "alice", "auth0|alice")
+    assert userdb.isuser("srv", "alice")
+    statements = count_queries(userdb)
+    assert not userdb.isuser("srv", "nobody")
+    assert userdb.isusers("srv", ["alice", "bob", "carol"]) == {"alice": True, "bob": False, "carol": False}
+    assert statements == []
+    assert userdb.cache.stats()["negative_hits"] == 3
+
+
+def test_own_signup_and_delete_apply_at_once(make_userdb):
+    userdb = make_userdb(filter_check_interval=60)
+    assert not userdb.isuser("srv", "alice")
+    builds = userdb.cache.filter_builds
+    assert userdb.signup("srv", "alice", "auth0|alice")
+    assert userdb.isuser("srv", "alice")
+    assert userdb.delete("srv", "alice")
+    assert not userdb.isuser("srv", "alice")
+    assert userdb.cache.filter_builds == builds
+
+
+def test_other_workers_changes_show_up_after_a_version_check(make_userdb):
+    worker_a = make_userdb()
+    worker_b = make_userdb(filter_check_interval=0.05)
+    assert not worker_b.isuser("srv", "alice")
+    worker_a.signup("srv", "alice", "auth0|alice")
+    time.sleep(0.06)
+    assert worker_b.isuser("srv", "alice")
+    worker_a.delete("srv", "alice")
+    time.sleep(0.06)
+    assert not worker_b.isuser("srv", "alice")
+
+
+def test_a_filter_behind_catches_up_from_the_change_log(make_userdb, monkeypatch):
+    worker_a = make_userdb()
+    worker_b = make_userdb(filter_check_interval=0)
+    worker_a.signup("srv", "alice", "auth0|alice")
+    assert worker_b.isuser("srv", "alice")
+    builds = worker_b.cache.filter_builds
+    worker_a.signup("srv", "bob", "auth0|bob")
+    worker_a.delete("srv", "alice")
+    assert worker_b.isusers("srv", ["alice", "bob"]) == {"alice": False, "bob": True}
+    assert worker_b.cache.filter_builds == builds
+
+    # Further behind than the log reaches: rebuilt from the users table.
+    monkeypatch.setattr(userdb_module, "CHANGE_LOG_SIZE", 2)
+    for name in ("carol", "dave", "erin"):
+        worker_a.signup("srv", name, f"auth0|{name}")
+    assert worker_b.isuser("srv", "erin")
+    assert worker_b.cache.filter_builds == builds + 1
+
+
+def test_zero_interval_checks_every_lookup(make_userdb):
+    worker_a = make_userdb()
+    worker_b = make_userdb(filter_check_interval=0)
+    assert not worker_b.isuser("srv", "alice")
+    worker_a.signup("srv", "alice", "auth0|alice")
+    assert worker_b.isusers("srv", ["alice"]) == {"alice": True}
+    worker_a.delete("srv", "alice")
+    assert not worker_b.isuser("srv", "alice")
+    statements = count_queries(worker_b)
+    assert not worker_b.isuser("srv", "nobody")
+    assert len(statements) == 1
+
+
+def test_async_lookups_share_the_filter(make_userdb):
+    worker_a = make_userdb()
+    worker_b = make_userdb(filter_check_interval=0)
+
+    async def run():
+        assert not await worker_b.isuser_async("srv", "alice")
+        worker_a.signup("srv", "alice", "auth0|alice")
+        assert await worker_b.isuser_async("srv", "alice")
+        assert await worker_b.isusers_async("srv", ["alice", "bob"]) == {"alice": True, "bob": False}
+        await worker_b.async_engine.dispose()
+
+    asyncio.run(run())